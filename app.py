@@ -1,16 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response, send_from_directory, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_session import Session
-from models import db, User
+from models import db, User, SlideshowJob, GeneratedAsset
 from supabase_service import SupabaseService
+import job_queue
+import job_events
+from job_queue import JobError
+from prompt_cache import prompt_cache, make_key as prompt_cache_key, prompt_version
+from prompt_similarity import prompt_index, prompt_scope, canonical_text, PROMPT_SIMILARITY_ENABLED
+import upstream_client
+import fast_json
+import circuit_breaker
+from rate_limiter import rate_limiter
+from deadline import Deadline, MIN_STAGE_SECONDS, stage_timeout
+import image_preprocess
+import image_variants
+from storage import get_storage, content_type_for
+from file_serving import serve_file
+from zip_stream import stream_zip
+import b64_stream
+from work_pool import imagen_pool, prompt_stream_pool, PoolFull
+from stream_slots import stream_slots, STREAM_RETRY_SECONDS
+import fair_queue
+import retention
+from retention import sweeper as retention_sweeper
+from image_cache import image_cache, perceptual_hash, color_signature, analysis_scope, IMAGE_CACHE_ENABLED
+from uploads import (SpooledUploadRequest, UploadRejected, MAX_UPLOAD_BYTES, max_content_length,
+                     check_content_length, save_image_upload, too_large_message)
 import re
 import os
-import requests
 import hmac
 import hashlib
 import base64
 import uuid
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+import shutil
+import tempfile
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, TimeoutError as FuturesTimeoutError
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import time
@@ -22,12 +50,47 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 print("OPENAI_API_KEY loaded:", OPENAI_API_KEY is not None)
 print("GOOGLE_API_KEY loaded:", GOOGLE_API_KEY is not None)
 
+OPENAI_CHAT_URL = f'{upstream_client.OPENAI_API_BASE}/v1/chat/completions'
+IMAGEN_PREDICT_URL = f'{upstream_client.GOOGLE_API_BASE}/v1beta/models/imagen-4.0-generate-001:predict'
+if upstream_client.MOCK_UPSTREAM_URL:
+    print(f"⚠️ Upstream AI calls go to the mock server at {upstream_client.MOCK_UPSTREAM_URL}")
+
+# Slideshows generated before the storage backends were added live here as <batch_id>/<file>
 GENERATED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'generated')
 os.makedirs(GENERATED_DIR, exist_ok=True)
 
+# Product uploads wait here until a slideshow worker picks up the job
+UPLOAD_STAGING_DIR = os.getenv('UPLOAD_STAGING_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'uploads'))
+os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+
+# 'embedded' runs a worker thread in the web process; 'external' expects slideshow_worker.py
+SLIDESHOW_WORKER_MODE = os.getenv('SLIDESHOW_WORKER_MODE', 'embedded')
+
+# Total budget for one slideshow (vision + scene prompts + Imagen); kept under gunicorn's 180s timeout.
+# Each stage gets the smaller of its own timeout and what is left of this.
+SLIDESHOW_DEADLINE_SECONDS = float(os.getenv('SLIDESHOW_DEADLINE_SECONDS', '170'))
+ANALYZE_IMAGE_TIMEOUT = 30
+SCENE_PROMPTS_TIMEOUT = 25
+IMAGEN_TIMEOUT = 90
+SLIDESHOW_TIMEOUT_ERROR = 'Image generation took too long. Please try again.'
+SLIDESHOW_SCENES = 4
+# Admission control for /generate-slideshow: beyond these, new slideshows get 429/503 + Retry-After
+SLIDESHOW_MAX_QUEUED = int(os.getenv('SLIDESHOW_MAX_QUEUED', '20'))
+SLIDESHOW_MAX_ACTIVE_PER_USER = int(os.getenv('SLIDESHOW_MAX_ACTIVE_PER_USER', '2'))
+SLIDESHOW_RETRY_AFTER = int(os.getenv('SLIDESHOW_RETRY_AFTER', '30'))
+SLIDESHOW_BUSY_MESSAGE = 'Slideshow generation is busy right now. Please try again in a minute.'
+# A status page's event stream is closed (and reopened by the browser) after this long
+SLIDESHOW_EVENTS_STREAM_SECONDS = 120
+SSE_KEEPALIVE_SECONDS = 15
+
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
+# orjson-backed jsonify/get_json when orjson is installed
+app.json = fast_json.FastJSONProvider(app)
 
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY")
+# Bodies larger than one product image plus form overhead are refused with a 413 before parsing
+app.config['MAX_CONTENT_LENGTH'] = max_content_length(MAX_UPLOAD_BYTES)
 
 # Session configuration - more flexible for development and production
 if os.environ.get('FLASK_ENV') == 'production':
@@ -166,13 +229,48 @@ def ensure_slideshow_columns():
     except Exception as e:
         print(f"Slideshow column check (non-critical): {e}")
 
+# Columns added to feature tables after they first shipped: (table, column, type)
+FEATURE_COLUMNS = [
+    ('image_analysis', 'color', 'VARCHAR(24)'),
+    ('prompt_signature', 'prompt', 'TEXT'),
+]
+
+def ensure_feature_columns():
+    """Add columns missing from feature tables created before those columns existed."""
+    try:
+        with app.app_context():
+            from sqlalchemy import inspect as sa_inspect
+            inspector = sa_inspect(db.engine)
+            for table, column, column_type in FEATURE_COLUMNS:
+                if not inspector.has_table(table):
+                    continue
+                if column not in [col['name'] for col in inspector.get_columns(table)]:
+                    with db.engine.connect() as conn:
+                        conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+                        conn.commit()
+                    print(f"Added {column} column to {table} table")
+    except Exception as e:
+        print(f"Feature column check (non-critical): {e}")
+
+def ensure_feature_tables():
+    """Create tables added after the initial deploy (create_all skips existing ones)."""
+    try:
+        with app.app_context():
+            db.create_all()
+    except Exception as e:
+        print(f"Feature table check (non-critical): {e}")
+
 # Initialize database on startup
 if not ensure_db_initialized():
     print("Warning: Database initialization failed, but continuing startup...")
 ensure_slideshow_columns()
+ensure_feature_tables()
+ensure_feature_columns()
 
 # Initialize Flask-Session after database is configured
 Session(app)
+# Session rows as JSON rather than pickles (older pickled rows still load)
+app.session_interface.serializer = fast_json.SessionSerializer()
 
 # --- Main Application Routes ---
 @app.route("/login/process", methods=["GET", "POST"])
@@ -783,17 +881,220 @@ def home():
                                models=IMAGE_VIDEO_MODELS)
     return render_template('index.html', remaining="6", paid=False, models=IMAGE_VIDEO_MODELS)
 
-# --- AI App Builder Prompt Improver ---
-def improve_prompt_with_ai(original_prompt):
-    """Use AI to analyze and improve a prompt for AI app builders"""
-    if not OPENAI_API_KEY:
-        return None, None
+# --- Shared OpenAI completion helpers ---
+# Analysis and improvement are independent, so both calls share one deadline
+OPENAI_PROMPT_DEADLINE = float(os.getenv('OPENAI_PROMPT_DEADLINE', '15'))
+_completion_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='openai-completion')
 
-    headers = {
+
+def _chat_completion(payload, headers, timeout, label, deadline=None):
+    """Run one chat completion and return the stripped message content"""
+    started = time.monotonic()
+    ok = False
+    try:
+        response = upstream_client.post(OPENAI_CHAT_URL, headers=headers, json=payload, timeout=timeout,
+                                        deadline=deadline)
+        response.raise_for_status()
+        content = response.json()['choices'][0]['message']['content'].strip()
+        ok = True
+        return content
+    finally:
+        upstream_client.record_timing(label, time.monotonic() - started, ok)
+
+
+def run_prompt_completions(headers, analysis_data, improvement_data, label):
+    """Run the analysis and improvement completions concurrently.
+
+    Returns (analysis, improved); either is None if its call failed or
+    missed the shared deadline, so callers still get a partial result.
+    Calls already running when the deadline passes stop too: their timeouts,
+    retries and rate-limit waits are all capped at the same Deadline.
+    """
+    started = time.monotonic()
+    deadline = Deadline(OPENAI_PROMPT_DEADLINE)
+    futures = {
+        _completion_executor.submit(_chat_completion, analysis_data, headers, OPENAI_PROMPT_DEADLINE,
+                                    f"{label}.analysis", deadline): 'analysis',
+        _completion_executor.submit(_chat_completion, improvement_data, headers, OPENAI_PROMPT_DEADLINE,
+                                    f"{label}.improvement", deadline): 'improved',
+    }
+    results = {'analysis': None, 'improved': None}
+
+    done, not_done = wait(futures, timeout=deadline.remaining())
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            print(f"AI {label} {futures[future]} error: {e}")
+    for future in not_done:
+        future.cancel()
+        print(f"AI {label} {futures[future]} missed the {OPENAI_PROMPT_DEADLINE}s deadline")
+
+    upstream_client.record_timing(f"{label}.total", time.monotonic() - started,
+                                  results['analysis'] is not None and results['improved'] is not None)
+    return results['analysis'], results['improved']
+
+
+def prompt_result_cache_key(original_prompt, tool_type, model_key, analysis_data, improvement_data):
+    return prompt_cache_key(original_prompt[:1500], tool_type, model_key,
+                            prompt_version(analysis_data, improvement_data))
+
+
+def find_similar_result(original_prompt, tool_type, model_key, analysis_data, improvement_data):
+    """(analysis, improved, matched prompt, similarity) for the closest near-duplicate prompt, else None"""
+    if not PROMPT_SIMILARITY_ENABLED:
+        return None
+    scope = prompt_scope(tool_type, model_key, prompt_version(analysis_data, improvement_data))
+    match = prompt_index.find(original_prompt[:1500], scope)
+    if match is None:
+        return None
+    similar_key, score = match
+    cached = prompt_cache.get(similar_key, record_stats=False)
+    if cached is None:
+        # The stored result expired; stop offering it
+        prompt_index.discard(similar_key)
+        return None
+    matched_prompt = prompt_index.prompt_for(similar_key)
+    if matched_prompt is None:
+        return None
+    return cached[0], cached[1], matched_prompt, score
+
+
+def lookup_prompt_result(original_prompt, tool_type, model_key, analysis_data, improvement_data):
+    """Cached (analysis, improved) for this prompt, else None.
+
+    A near-duplicate only counts when it reads the same word for word (case,
+    punctuation and spacing aside); closer edits like another color are
+    offered to the user instead (see similar_prompt_offer).
+    """
+    cache_key = prompt_result_cache_key(original_prompt, tool_type, model_key, analysis_data, improvement_data)
+    cached = prompt_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    similar = find_similar_result(original_prompt, tool_type, model_key, analysis_data, improvement_data)
+    if similar is None or canonical_text(similar[2]) != canonical_text(original_prompt[:1500]):
+        return None
+    print(f"♻️ Reusing near-duplicate prompt result (similarity {similar[3]:.2f})")
+    return similar[0], similar[1]
+
+
+def similar_prompt_offer(original_prompt, tool_type, model_key):
+    """The stored result of a similar but not identical prompt, to offer before paying for a new one.
+
+    Returns a dict with analysis, improved, prompt (the one it was written
+    for) and similarity, or None.
+    """
+    if tool_type == 'image_video':
+        analysis_data, improvement_data = build_image_prompt_payloads(original_prompt, model_key)
+    else:
+        analysis_data, improvement_data = build_app_prompt_payloads(original_prompt)
+    similar = find_similar_result(original_prompt, tool_type, model_key, analysis_data, improvement_data)
+    if similar is None or canonical_text(similar[2]) == canonical_text(original_prompt[:1500]):
+        return None
+    analysis, improved, matched_prompt, score = similar
+    return {'analysis': analysis, 'improved': improved, 'prompt': matched_prompt, 'similarity': round(score, 2)}
+
+
+def store_prompt_result(original_prompt, tool_type, model_key, analysis_data, improvement_data, analysis, improved):
+    """Cache a complete result and index the prompt for near-duplicate lookups"""
+    cache_key = prompt_result_cache_key(original_prompt, tool_type, model_key, analysis_data, improvement_data)
+    prompt_cache.set(cache_key, analysis, improved, tool_type=tool_type, model_key=model_key)
+    if PROMPT_SIMILARITY_ENABLED:
+        scope = prompt_scope(tool_type, model_key, prompt_version(analysis_data, improvement_data))
+        prompt_index.add(original_prompt[:1500], scope, cache_key)
+
+
+def cached_prompt_completions(original_prompt, tool_type, model_key, headers, analysis_data, improvement_data, label):
+    """Serve a previous result for the same (or a near-duplicate) prompt, else call OpenAI and cache it"""
+    cached = lookup_prompt_result(original_prompt, tool_type, model_key, analysis_data, improvement_data)
+    if cached is not None:
+        return cached
+
+    analysis, improved = run_prompt_completions(headers, analysis_data, improvement_data, label)
+    # Only complete results are cached; a partial one should be retried next time
+    if analysis and improved:
+        store_prompt_result(original_prompt, tool_type, model_key, analysis_data, improvement_data, analysis, improved)
+    return analysis, improved
+
+
+# --- Streaming (Server-Sent Events) ---
+OPENAI_STREAM_DEADLINE = float(os.getenv('OPENAI_STREAM_DEADLINE', '30'))
+IMPROVED_PROMPT_FALLBACK = '(Could not generate improved prompt. Please try again.)'
+AI_UNAVAILABLE_MESSAGE = '(AI improvement is temporarily unavailable. Please try again in a minute.)'
+# Stream ids with a /prompt-stream response running in this process
+_live_streams = set()
+_live_streams_lock = threading.Lock()
+PROMPT_STREAM_BUSY_MESSAGE = 'Too many prompt improvements are running right now. Please try again in a moment.'
+AI_UNAVAILABLE_FLASH = 'Our AI provider is having issues right now, so this result uses rule-based analysis only. You were not charged.'
+
+
+def stream_chat_completion(payload, headers, timeout, label, on_delta, cancelled):
+    """Stream one chat completion, calling on_delta(text) for each token.
+
+    Returns the full stripped text, or None if the call failed or was cancelled.
+    """
+    started = time.monotonic()
+    parts = []
+    ok = False
+    try:
+        body = dict(payload, stream=True)
+        with upstream_client.post(OPENAI_CHAT_URL, headers=headers, json=body, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if cancelled.is_set():
+                    return None
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                choices = fast_json.loads(data).get('choices') or []
+                delta = choices[0].get('delta', {}).get('content') if choices else None
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+        ok = True
+        return ''.join(parts).strip() or None
+    except Exception as e:
+        print(f"AI {label} stream error: {e}")
+        return None
+    finally:
+        upstream_client.record_timing(label, time.monotonic() - started, ok)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_key_for(stream_id):
+    """Cache key where a finished stream's result is kept for the result page"""
+    return f"stream:{stream_id}"
+
+
+def resolve_pending_prompt_result():
+    """Copy a finished stream's result into the session prompt_result"""
+    prompt_data = session.get('prompt_result', {})
+    if prompt_data.get('pending') and prompt_data.get('stream_id'):
+        finished = prompt_cache.get(stream_key_for(prompt_data['stream_id']), record_stats=False)
+        if finished is not None:
+            prompt_data['ai_analysis'], improved = finished
+            prompt_data['improved_prompt'] = improved or IMPROVED_PROMPT_FALLBACK
+            prompt_data['pending'] = False
+            session['prompt_result'] = prompt_data
+    return prompt_data
+
+
+# --- AI App Builder Prompt Improver ---
+def openai_headers():
+    return {
         'Authorization': f'Bearer {OPENAI_API_KEY}',
         'Content-Type': 'application/json'
     }
 
+
+def build_app_prompt_payloads(original_prompt):
+    """Build the (analysis, improvement) chat requests for an AI app builder prompt"""
     analysis_data = {
         "model": "gpt-3.5-turbo",
         "messages": [
@@ -814,21 +1115,17 @@ def improve_prompt_with_ai(original_prompt):
         "temperature": 0.4
     }
 
-    analysis = None
-    improved = None
+    return analysis_data, improvement_data
 
-    try:
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=analysis_data, timeout=15)
-        response.raise_for_status()
-        analysis = response.json()['choices'][0]['message']['content'].strip()
 
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=improvement_data, timeout=15)
-        response.raise_for_status()
-        improved = response.json()['choices'][0]['message']['content'].strip()
-    except Exception as e:
-        print(f"AI prompt improvement error: {e}")
+def improve_prompt_with_ai(original_prompt):
+    """Use AI to analyze and improve a prompt for AI app builders"""
+    if not OPENAI_API_KEY:
+        return None, None
 
-    return analysis, improved
+    analysis_data, improvement_data = build_app_prompt_payloads(original_prompt)
+    return cached_prompt_completions(original_prompt, 'app_builder', None,
+                                     openai_headers(), analysis_data, improvement_data, 'app_prompt')
 
 
 def rule_based_prompt_analysis(prompt):
@@ -910,16 +1207,9 @@ def rule_based_prompt_analysis(prompt):
 
 
 # --- AI Image/Video Prompt Improver ---
-def improve_image_prompt_with_ai(original_prompt, model_key):
-    """Use AI to improve a prompt for image/video generation models"""
-    if not OPENAI_API_KEY:
-        return None, None
-
+def build_image_prompt_payloads(original_prompt, model_key):
+    """Build the (analysis, improvement) chat requests for an image/video prompt"""
     model_name = IMAGE_VIDEO_MODELS.get(model_key, 'General')
-    headers = {
-        'Authorization': f'Bearer {OPENAI_API_KEY}',
-        'Content-Type': 'application/json'
-    }
 
     model_tips = {
         'midjourney': "Use Midjourney-specific syntax: aspect ratios (--ar 16:9), style parameters (--s 750), quality (--q 2), version (--v 6). Use descriptive, comma-separated phrases. Midjourney responds well to artistic references, lighting descriptions, and camera angles.",
@@ -955,21 +1245,17 @@ def improve_image_prompt_with_ai(original_prompt, model_key):
         "temperature": 0.4
     }
 
-    analysis = None
-    improved = None
+    return analysis_data, improvement_data
 
-    try:
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=analysis_data, timeout=15)
-        response.raise_for_status()
-        analysis = response.json()['choices'][0]['message']['content'].strip()
 
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=improvement_data, timeout=15)
-        response.raise_for_status()
-        improved = response.json()['choices'][0]['message']['content'].strip()
-    except Exception as e:
-        print(f"AI image prompt improvement error: {e}")
+def improve_image_prompt_with_ai(original_prompt, model_key):
+    """Use AI to improve a prompt for image/video generation models"""
+    if not OPENAI_API_KEY:
+        return None, None
 
-    return analysis, improved
+    analysis_data, improvement_data = build_image_prompt_payloads(original_prompt, model_key)
+    return cached_prompt_completions(original_prompt, 'image_video', model_key,
+                                     openai_headers(), analysis_data, improvement_data, 'image_prompt')
 
 
 def rule_based_image_prompt_analysis(prompt, model_key):
@@ -1055,35 +1341,58 @@ def rule_based_image_prompt_analysis(prompt, model_key):
 
 # --- UGC Slideshow Image Generation ---
 
-def analyze_product_image(image_bytes):
-    """Use GPT-4o Vision to describe an uploaded product image."""
+VISION_MODEL = "gpt-4o"
+PRODUCT_ANALYSIS_INSTRUCTIONS = (
+    "Analyze this product image concisely. Describe: "
+    "1) Product type/category 2) Colors and materials "
+    "3) Any visible brand text or logo 4) Shape and proportions "
+    "5) Key visual features that make it recognizable. "
+    "Be specific — this description will be used to recreate "
+    "the product in AI-generated images."
+)
+
+
+def analyze_product_image(image_bytes, deadline=None):
+    """Use GPT-4o Vision to describe an uploaded product image.
+
+    A photo that looks like one analyzed before (same perceptual hash, give
+    or take re-compression or a small crop) reuses the stored description.
+    """
     if not OPENAI_API_KEY:
         return None
 
-    b64_image = base64.b64encode(image_bytes).decode('utf-8')
+    image_hash = image_color = None
+    scope = analysis_scope(VISION_MODEL, PRODUCT_ANALYSIS_INSTRUCTIONS)
+    if IMAGE_CACHE_ENABLED:
+        image_hash, image_color = perceptual_hash(image_bytes), color_signature(image_bytes)
+        cached = image_cache.lookup(image_hash, image_color, scope)
+        if cached is not None:
+            print(f"Product analysis reused (hash distance {cached[1]})")
+            return cached[0]
+
+    # Runs on the slideshow worker, never on a request thread
+    started = time.monotonic()
+    image = image_preprocess.prepare_for_vision(image_bytes)
+    upstream_client.record_timing('vision.preprocess', time.monotonic() - started)
+    print(f"Product image prepared: {len(image_bytes) // 1024}KB -> {len(image.data) // 1024}KB "
+          f"{image.mime}, detail={image.detail}")
+
     headers = {
         'Authorization': f'Bearer {OPENAI_API_KEY}',
         'Content-Type': 'application/json'
     }
     data = {
-        "model": "gpt-4o",
+        "model": VISION_MODEL,
         "messages": [{
             "role": "user",
             "content": [
                 {
                     "type": "text",
-                    "text": (
-                        "Analyze this product image concisely. Describe: "
-                        "1) Product type/category 2) Colors and materials "
-                        "3) Any visible brand text or logo 4) Shape and proportions "
-                        "5) Key visual features that make it recognizable. "
-                        "Be specific — this description will be used to recreate "
-                        "the product in AI-generated images."
-                    )
+                    "text": PRODUCT_ANALYSIS_INSTRUCTIONS
                 },
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}
+                    "image_url": {"url": image_preprocess.data_url(image), "detail": image.detail}
                 }
             ]
         }],
@@ -1092,18 +1401,22 @@ def analyze_product_image(image_bytes):
     }
 
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers, json=data, timeout=30
+        response = upstream_client.post(
+            OPENAI_CHAT_URL,
+            headers=headers, json=data,
+            timeout=stage_timeout(deadline, ANALYZE_IMAGE_TIMEOUT, 'product analysis'), deadline=deadline
         )
         response.raise_for_status()
-        return response.json()['choices'][0]['message']['content'].strip()
+        description = response.json()['choices'][0]['message']['content'].strip()
     except Exception as e:
         print(f"Product image analysis error: {e}")
         return None
 
+    image_cache.store(image_hash, image_color, scope, description)
+    return description
 
-def generate_ugc_scene_prompts(product_description, improved_prompt, num_scenes=4):
+
+def generate_ugc_scene_prompts(product_description, improved_prompt, num_scenes=4, deadline=None):
     """Generate diverse UGC-style scene descriptions using GPT-4o-mini."""
     if not OPENAI_API_KEY:
         return []
@@ -1148,13 +1461,14 @@ def generate_ugc_scene_prompts(product_description, improved_prompt, num_scenes=
     }
 
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers, json=data, timeout=25
+        response = upstream_client.post(
+            OPENAI_CHAT_URL,
+            headers=headers, json=data,
+            timeout=stage_timeout(deadline, SCENE_PROMPTS_TIMEOUT, 'scene prompts'), deadline=deadline
         )
         response.raise_for_status()
         content = response.json()['choices'][0]['message']['content'].strip()
-        parsed = json.loads(content)
+        parsed = fast_json.loads(content)
 
         if isinstance(parsed, dict):
             for v in parsed.values():
@@ -1168,12 +1482,15 @@ def generate_ugc_scene_prompts(product_description, improved_prompt, num_scenes=
         return []
 
 
-def generate_image_imagen(prompt):
-    """Generate an image using Google Imagen 4 via the Generative Language API."""
+def generate_image_imagen(prompt, deadline=None, dest=None):
+    """Generate an image using Google Imagen 4 via the Generative Language API.
+
+    Returns the PNG bytes, or with dest, streams the image into that file and
+    returns its path without holding the response or the image in memory.
+    """
     if not GOOGLE_API_KEY:
         raise ValueError("GOOGLE_API_KEY not configured")
 
-    url = "https://generativelanguage.googleapis.com/v1beta/models/imagen-4.0-generate-001:predict"
     headers = {
         "x-goog-api-key": GOOGLE_API_KEY,
         "Content-Type": "application/json"
@@ -1187,7 +1504,12 @@ def generate_image_imagen(prompt):
         }
     }
 
-    response = requests.post(url, headers=headers, json=payload, timeout=90)
+    timeout = stage_timeout(deadline, IMAGEN_TIMEOUT, 'Imagen')
+    if dest is not None:
+        return _stream_imagen_to_file(headers, payload, timeout, deadline, dest)
+
+    response = upstream_client.post(IMAGEN_PREDICT_URL, headers=headers, json=payload,
+                                    timeout=timeout, deadline=deadline)
     if response.status_code != 200:
         error_detail = response.text[:500]
         raise ValueError(f"Imagen API error ({response.status_code}): {error_detail}")
@@ -1204,25 +1526,86 @@ def generate_image_imagen(prompt):
     return base64.b64decode(image_b64)
 
 
-def generate_slideshow_images(scene_prompts, provider):
-    """Generate multiple images in parallel for a UGC slideshow."""
+def _stream_imagen_to_file(headers, payload, timeout, deadline, dest):
+    """Imagen call whose base64 image is decoded chunk by chunk into dest as the body arrives"""
+    with upstream_client.post(IMAGEN_PREDICT_URL, headers=headers, json=payload,
+                              timeout=timeout, deadline=deadline, stream=True) as response:
+        if response.status_code != 200:
+            error_detail = response.text[:500]
+            raise ValueError(f"Imagen API error ({response.status_code}): {error_detail}")
+        try:
+            with open(dest, 'wb') as f:
+                written, rest = b64_stream.decode_json_field(
+                    response.iter_content(chunk_size=b64_stream.CHUNK_SIZE), 'bytesBase64Encoded', f)
+        except Exception:
+            _remove_quietly(dest)
+            raise
+
+    if not written:
+        _remove_quietly(dest)
+        try:
+            result = fast_json.loads(rest)
+        except ValueError:
+            result = None
+        if not (result or {}).get('predictions'):
+            raise ValueError(f"No image returned from Imagen. Response: {rest[:300].decode('utf-8', 'replace')}")
+        raise ValueError("No image data in Imagen response")
+    return dest
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def generate_slideshow_images(scene_prompts, provider, deadline=None, on_image=None, user_id=None,
+                              tier=fair_queue.TIER_FREE, work_dir=None):
+    """Generate multiple images in parallel for a UGC slideshow.
+
+    Results are the images' bytes, or with work_dir, the paths of
+    scene_<index>.png files the images were streamed into. on_image(index,
+    result) is called for each image as soon as it finishes; if it raises,
+    that scene counts as failed. With a deadline,
+    images still pending when it passes are cancelled (or abandoned, if
+    already running) and left as None, so the caller gets whatever
+    finished in time. user_id and tier place the calls in the pool's fair
+    queue, so they share the Imagen workers with other users' slideshows.
+    """
     gen_func = generate_image_imagen
     results = [None] * len(scene_prompts)
     errors = []
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {}
-        for i, prompt in enumerate(scene_prompts):
-            futures[executor.submit(gen_func, prompt)] = i
+    # The process-wide pool caps Imagen concurrency across jobs; raises PoolFull if it can't take them all
+    calls = []
+    for i, prompt in enumerate(scene_prompts):
+        kwargs = {'deadline': deadline}
+        if work_dir is not None:
+            kwargs['dest'] = os.path.join(work_dir, f"scene_{i}.png")
+        calls.append((gen_func, (prompt,), kwargs))
+    submitted = imagen_pool.submit_all(calls, flow=user_id, tier=tier)
+    futures = {future: i for i, future in enumerate(submitted)}
 
-        for future in as_completed(futures):
+    try:
+        for future in as_completed(futures, timeout=None if deadline is None else deadline.remaining()):
             idx = futures[future]
             try:
                 results[idx] = future.result()
+                if on_image is not None and results[idx]:
+                    on_image(idx, results[idx])
             except Exception as e:
                 print(f"Image generation error (scene {idx}): {e}")
                 errors.append(str(e))
                 results[idx] = None
+    except FuturesTimeoutError:
+        late = sorted(idx for future, idx in futures.items() if not future.done())
+        print(f"Slideshow deadline passed; dropping scenes {late}")
+        errors.append(f"Timed out generating {len(late)} of {len(scene_prompts)} images")
+    finally:
+        # Running calls can't be interrupted, but their timeouts already end at the deadline
+        for future in futures:
+            future.cancel()
 
     return results, errors
 
@@ -1245,11 +1628,50 @@ def improve_prompt():
         return redirect(url_for('home'))
 
     rule_analysis = rule_based_prompt_analysis(prompt_content)
+
+    offer = None if request.form.get('regenerate') == '1' else similar_prompt_offer(prompt_content, 'app_builder', None)
+    if offer is not None:
+        # Someone asked for nearly this before: offer that result (not charged) with a regenerate button
+        session['prompt_result'] = {
+            'original_prompt': prompt_content,
+            'improved_prompt': offer['improved'],
+            'ai_analysis': offer['analysis'],
+            'rule_analysis': rule_analysis,
+            'tool_type': 'app_builder',
+            'similar_to': {'prompt': offer['prompt'], 'similarity': offer['similarity']}
+        }
+        return redirect(url_for('prompt_result'))
+
+    if OPENAI_API_KEY and not upstream_client.is_available(OPENAI_CHAT_URL):
+        # OpenAI's circuit is open: fail fast with the rule-based analysis (not charged)
+        flash(AI_UNAVAILABLE_FLASH)
+        session['prompt_result'] = {
+            'original_prompt': prompt_content,
+            'improved_prompt': AI_UNAVAILABLE_MESSAGE,
+            'ai_analysis': None,
+            'rule_analysis': rule_analysis,
+            'tool_type': 'app_builder'
+        }
+        return redirect(url_for('prompt_result'))
+
+    if request.form.get('stream') == '1' and OPENAI_API_KEY:
+        # Tokens are streamed by /prompt-stream, which also charges the quota
+        session['prompt_result'] = {
+            'original_prompt': prompt_content,
+            'improved_prompt': '',
+            'ai_analysis': None,
+            'rule_analysis': rule_analysis,
+            'tool_type': 'app_builder',
+            'pending': True,
+            'stream_id': uuid.uuid4().hex
+        }
+        return redirect(url_for('prompt_result'))
+
     ai_analysis, improved_prompt = improve_prompt_with_ai(prompt_content)
 
     session['prompt_result'] = {
         'original_prompt': prompt_content,
-        'improved_prompt': improved_prompt or '(Could not generate improved prompt. Please try again.)',
+        'improved_prompt': improved_prompt or IMPROVED_PROMPT_FALLBACK,
         'ai_analysis': ai_analysis,
         'rule_analysis': rule_analysis,
         'tool_type': 'app_builder'
@@ -1282,11 +1704,56 @@ def improve_image_prompt():
         model_key = 'midjourney'
 
     rule_analysis = rule_based_image_prompt_analysis(prompt_content, model_key)
+
+    offer = None if request.form.get('regenerate') == '1' else similar_prompt_offer(prompt_content, 'image_video', model_key)
+    if offer is not None:
+        # Someone asked for nearly this before: offer that result (not charged) with a regenerate button
+        session['prompt_result'] = {
+            'original_prompt': prompt_content,
+            'improved_prompt': offer['improved'],
+            'ai_analysis': offer['analysis'],
+            'rule_analysis': rule_analysis,
+            'tool_type': 'image_video',
+            'model': IMAGE_VIDEO_MODELS.get(model_key, 'General'),
+            'model_key': model_key,
+            'similar_to': {'prompt': offer['prompt'], 'similarity': offer['similarity']}
+        }
+        return redirect(url_for('prompt_result'))
+
+    if OPENAI_API_KEY and not upstream_client.is_available(OPENAI_CHAT_URL):
+        # OpenAI's circuit is open: fail fast with the rule-based analysis (not charged)
+        flash(AI_UNAVAILABLE_FLASH)
+        session['prompt_result'] = {
+            'original_prompt': prompt_content,
+            'improved_prompt': AI_UNAVAILABLE_MESSAGE,
+            'ai_analysis': None,
+            'rule_analysis': rule_analysis,
+            'tool_type': 'image_video',
+            'model': IMAGE_VIDEO_MODELS.get(model_key, 'General'),
+            'model_key': model_key
+        }
+        return redirect(url_for('prompt_result'))
+
+    if request.form.get('stream') == '1' and OPENAI_API_KEY:
+        # Tokens are streamed by /prompt-stream, which also charges the quota
+        session['prompt_result'] = {
+            'original_prompt': prompt_content,
+            'improved_prompt': '',
+            'ai_analysis': None,
+            'rule_analysis': rule_analysis,
+            'tool_type': 'image_video',
+            'model': IMAGE_VIDEO_MODELS.get(model_key, 'General'),
+            'model_key': model_key,
+            'pending': True,
+            'stream_id': uuid.uuid4().hex
+        }
+        return redirect(url_for('prompt_result'))
+
     ai_analysis, improved_prompt = improve_image_prompt_with_ai(prompt_content, model_key)
 
     session['prompt_result'] = {
         'original_prompt': prompt_content,
-        'improved_prompt': improved_prompt or '(Could not generate improved prompt. Please try again.)',
+        'improved_prompt': improved_prompt or IMPROVED_PROMPT_FALLBACK,
         'ai_analysis': ai_analysis,
         'rule_analysis': rule_analysis,
         'tool_type': 'image_video',
@@ -1298,12 +1765,352 @@ def improve_image_prompt():
     return redirect(url_for('prompt_result'))
 
 
+@app.route('/prompt-stream')
+@login_required
+def prompt_stream():
+    """Stream the pending prompt improvement to the result page as Server-Sent Events.
+
+    The quota is charged as the first token goes out, once per stream id even
+    across reconnects; a client that disconnects before any token cancels the
+    upstream calls and is not charged. Past the stream_slots cap the browser
+    is told to reconnect after a short delay instead.
+    """
+    prompt_data = session.get('prompt_result', {})
+    if not prompt_data.get('pending') or not prompt_data.get('stream_id'):
+        return '', 204
+
+    original_prompt = prompt_data['original_prompt']
+    tool_type = prompt_data.get('tool_type', 'app_builder')
+    model_key = prompt_data.get('model_key') if tool_type == 'image_video' else None
+    if tool_type == 'image_video':
+        analysis_data, improvement_data = build_image_prompt_payloads(original_prompt, model_key)
+        label = 'image_prompt'
+    else:
+        analysis_data, improvement_data = build_app_prompt_payloads(original_prompt)
+        label = 'app_prompt'
+    stream_key = stream_key_for(prompt_data['stream_id'])
+    charged_key = f"{stream_key}:charged"
+
+    def charge():
+        """Charge this stream's analysis the first time any of its text is sent"""
+        if prompt_cache.get(charged_key, record_stats=False) is None:
+            prompt_cache.set(charged_key, 'charged', None, tool_type='stream', record_stats=False)
+            current_user.increment_analysis()
+
+    def generate():
+        # A reconnect after completion replays the stored result without charging again
+        finished = prompt_cache.get(stream_key, record_stats=False)
+        if finished is not None:
+            yield sse_event('done', {'analysis': finished[0], 'improved': finished[1] or IMPROVED_PROMPT_FALLBACK})
+            return
+
+        if not current_user.can_analyze():
+            yield sse_event('failed', {'message': 'Prompt improvement limit reached.'})
+            return
+
+        # One live stream per stream id: a reconnect racing the stream it replaces retries once that ends
+        with _live_streams_lock:
+            duplicate = stream_key in _live_streams
+            _live_streams.add(stream_key)
+        if duplicate:
+            yield f"retry: {int(STREAM_RETRY_SECONDS * 1000)}\n\n"
+            yield sse_event('busy', {'retry_after': STREAM_RETRY_SECONDS})
+            return
+        try:
+            # After a dropped connection the browser still shows the old deltas; start it over
+            yield sse_event('reset', {})
+            cached = lookup_prompt_result(original_prompt, tool_type, model_key, analysis_data, improvement_data)
+            if cached is not None:
+                analysis, improved = cached
+                charge()
+                yield sse_event('analysis', {'delta': analysis})
+                yield sse_event('improved', {'delta': improved})
+            else:
+                if not stream_slots.try_acquire():
+                    # Every thread streams may hold is taken: the browser reconnects after the retry delay
+                    yield f"retry: {int(STREAM_RETRY_SECONDS * 1000)}\n\n"
+                    yield sse_event('busy', {'retry_after': STREAM_RETRY_SECONDS})
+                    return
+                events = queue.Queue()
+                cancelled = threading.Event()
+                headers = openai_headers()
+
+                def run(field, payload):
+                    text = stream_chat_completion(payload, headers, OPENAI_STREAM_DEADLINE, f"{label}.{field}.stream",
+                                                  lambda delta: events.put(('delta', field, delta)), cancelled)
+                    events.put(('finished', field, text))
+
+                # A pool of its own: open streams must not tie up the threads /improve-prompt waits on
+                try:
+                    futures = prompt_stream_pool.submit_all(
+                        [(run, ('analysis', analysis_data), {}), (run, ('improved', improvement_data), {})],
+                        flow=current_user.id, tier=fair_queue.tier_for(current_user.is_paid))
+                except PoolFull:
+                    stream_slots.release()
+                    yield sse_event('failed', {'message': PROMPT_STREAM_BUSY_MESSAGE})
+                    return
+
+                results = {}
+                deadline = time.monotonic() + OPENAI_STREAM_DEADLINE
+                try:
+                    while len(results) < 2 and time.monotonic() < deadline:
+                        try:
+                            kind, field, text = events.get(timeout=1)
+                        except queue.Empty:
+                            # Heartbeat so a closed connection is noticed promptly
+                            yield ': keep-alive\n\n'
+                            continue
+                        if kind == 'delta':
+                            charge()
+                            yield sse_event(field, {'delta': text})
+                        else:
+                            results[field] = text
+                finally:
+                    # Runs on completion, deadline and client disconnect (GeneratorExit)
+                    cancelled.set()
+                    for future in futures:
+                        future.cancel()
+                    stream_slots.release()
+
+                analysis, improved = results.get('analysis'), results.get('improved')
+                if analysis and improved:
+                    store_prompt_result(original_prompt, tool_type, model_key, analysis_data, improvement_data,
+                                        analysis, improved)
+
+            prompt_cache.set(stream_key, analysis, improved, tool_type='stream', model_key=model_key, record_stats=False)
+            yield sse_event('done', {'analysis': analysis, 'improved': improved or IMPROVED_PROMPT_FALLBACK})
+        finally:
+            with _live_streams_lock:
+                _live_streams.discard(stream_key)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def process_slideshow_job(job):
+    """Run the vision -> scene prompts -> Imagen pipeline for one claimed job (slideshow worker)"""
+    payload = job_queue.job_payload(job)
+    deadline = Deadline(SLIDESHOW_DEADLINE_SECONDS)
+    upload_path = payload['upload_path']
+    improved_prompt = payload.get('improved_prompt', '')
+    provider = payload.get('provider', 'imagen')
+
+    try:
+        with open(upload_path, 'rb') as f:
+            image_bytes = f.read()
+    except OSError:
+        raise JobError('The uploaded image is no longer available. Please upload it again.')
+
+    job_events.publish(job.id, 'stage', {'stage': 'vision', 'elapsed': round(deadline.elapsed(), 2)})
+    try:
+        product_description = analyze_product_image(image_bytes, deadline=deadline)
+    except Exception as e:
+        print(f"Product analysis failed: {e}")
+        product_description = None
+
+    if not product_description:
+        if deadline.remaining() < MIN_STAGE_SECONDS:
+            raise JobError(SLIDESHOW_TIMEOUT_ERROR)
+        raise JobError('Could not analyze the product image. Please try again.')
+
+    job_events.publish(job.id, 'stage', {'stage': 'scene_prompts', 'elapsed': round(deadline.elapsed(), 2)})
+    try:
+        scene_prompts = generate_ugc_scene_prompts(product_description, improved_prompt, num_scenes=SLIDESHOW_SCENES,
+                                                   deadline=deadline)
+    except Exception as e:
+        print(f"Scene prompt generation failed: {e}")
+        scene_prompts = []
+
+    if not scene_prompts:
+        if deadline.remaining() < MIN_STAGE_SECONDS:
+            raise JobError(SLIDESHOW_TIMEOUT_ERROR)
+        raise JobError('Could not generate scene descriptions. Please try again.')
+
+    job_events.publish(job.id, 'stage', {'stage': 'images', 'total': len(scene_prompts),
+                                         'scene_prompts': scene_prompts, 'elapsed': round(deadline.elapsed(), 2)})
+
+    batch_id = str(uuid.uuid4())[:12]
+    # Files are rendered in a scratch directory, then streamed into storage under their content hash
+    work_dir = tempfile.mkdtemp(prefix=f'slideshow-{batch_id}-', dir=UPLOAD_STAGING_DIR)
+    assets = []
+    saved = {}  # scene index -> (PNG path, URL)
+
+    def publish(path):
+        asset, url = store_generated_file(batch_id, job.user_id, path)
+        assets.append(asset)
+        return url
+
+    def save_scene(index, filepath):
+        """Store a scene the moment Imagen has streamed it to disk and tell the status page"""
+        started = time.monotonic()
+        try:
+            url = publish(filepath)
+            retention.add_usage(job.user_id, assets[-1].size, 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        saved[index] = (filepath, url)
+        upstream_client.record_timing('slideshow.store', time.monotonic() - started, True)
+        if len(saved) == 1:
+            # What the user waits for before seeing anything
+            upstream_client.record_timing('slideshow.first_image', deadline.elapsed(), True)
+        job_events.publish(job.id, 'scene', {'index': index, 'url': url, 'image_file': os.path.basename(filepath),
+                                             'completed': len(saved), 'total': len(scene_prompts),
+                                             'elapsed': round(deadline.elapsed(), 2)})
+
+    try:
+        print(f"Generating {len(scene_prompts)} images with Imagen 4 ({deadline.remaining():.0f}s left)...")
+        try:
+            owner = db.session.get(User, job.user_id)
+            _, errors = generate_slideshow_images(scene_prompts, provider, deadline=deadline, on_image=save_scene,
+                                                  user_id=job.user_id, tier=fair_queue.tier_for(owner and owner.is_paid),
+                                                  work_dir=work_dir)
+        except PoolFull:
+            raise JobError(SLIDESHOW_BUSY_MESSAGE)
+        if errors:
+            print(f"Slideshow generation errors: {errors}")
+        image_paths = [saved[i][0] for i in sorted(saved)]
+        image_urls = [saved[i][1] for i in sorted(saved)]
+
+        # WebP/AVIF copies and thumbnails for the result page; downloads keep the PNG
+        if image_paths:
+            job_events.publish(job.id, 'stage', {'stage': 'finishing', 'elapsed': round(deadline.elapsed(), 2)})
+        stored_scenes = len(assets)
+        started = time.monotonic()
+        variants = image_variants.generate_variants(
+            image_paths, publish,
+            timeout=min(image_variants.IMAGE_VARIANT_TIMEOUT, max(deadline.remaining(), 5)))
+        upstream_client.record_timing('slideshow.variants', time.monotonic() - started, None not in variants)
+        variant_assets = assets[stored_scenes:]
+        retention.add_usage(job.user_id, sum(asset.size for asset in variant_assets), len(variant_assets))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Make room for this batch now rather than at the next sweep
+    try:
+        retention.enforce_quota(job.user_id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Storage quota check failed: {e}")
+
+    if not image_urls:
+        error_msg = 'Image generation failed.'
+        if errors:
+            error_msg += f' Error: {errors[0][:200]}'
+        raise JobError(error_msg)
+
+    try:
+        user = db.session.get(User, job.user_id)
+        user.increment_slideshow_generation()
+    except Exception as e:
+        print(f"Could not increment slideshow count: {e}")
+
+    return {
+        'images': image_urls,
+        'image_variants': variants,
+        'image_files': [os.path.basename(path) for path in image_paths],
+        'scene_prompts': scene_prompts,
+        'product_description': product_description,
+        'provider': 'Google Nano Banana/Imagen',
+        'provider_key': provider,
+        'batch_id': batch_id,
+        'original_prompt': payload.get('original_prompt', ''),
+        'improved_prompt': improved_prompt,
+        'num_generated': len(image_urls),
+        'num_failed': len(scene_prompts) - len(image_urls),
+        'deadline_exceeded': deadline.expired
+    }
+
+
+_embedded_worker = {'pid': None, 'threads': []}
+_embedded_worker_lock = threading.Lock()
+
+
+def start_embedded_worker():
+    """Run slideshow worker threads inside this process (SLIDESHOW_WORKER_MODE=embedded)"""
+    if SLIDESHOW_WORKER_MODE != 'embedded':
+        return None
+    with _embedded_worker_lock:
+        # Threads don't survive a fork, so track the pid that started them
+        threads = _embedded_worker['threads']
+        if _embedded_worker['pid'] == os.getpid() and threads and all(thread.is_alive() for thread in threads):
+            return threads
+        threads = job_queue.start_workers(app, process_slideshow_job)
+        _embedded_worker['pid'] = os.getpid()
+        _embedded_worker['threads'] = threads
+        print(f"Embedded slideshow worker started with {len(threads)} threads (pid: {os.getpid()})")
+        return threads
+
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+
+_admission_rejections = {'user_active_limit': 0, 'queue_full': 0, 'pool_full': 0}
+_admission_lock = threading.Lock()
+
+
+def busy_response(message, status, retry_after, reason):
+    """429/503 with Retry-After (JSON clients), or a flash and redirect carrying the same header"""
+    with _admission_lock:
+        _admission_rejections[reason] += 1
+    if wants_json():
+        response = jsonify({'error': message, 'retry_after': retry_after})
+        response.status_code = status
+    else:
+        flash(message)
+        response = redirect(url_for('prompt_result'))
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def slideshow_admission(user_id, active_jobs):
+    """Refuse a new slideshow the system can't start soon; returns a response, or None to admit it"""
+    if active_jobs >= SLIDESHOW_MAX_ACTIVE_PER_USER:
+        return busy_response('You already have slideshows in progress. Please wait for them to finish.',
+                             429, SLIDESHOW_RETRY_AFTER, 'user_active_limit')
+    if job_queue.queue_depth() >= SLIDESHOW_MAX_QUEUED:
+        return busy_response(SLIDESHOW_BUSY_MESSAGE, 503, SLIDESHOW_RETRY_AFTER, 'queue_full')
+    # An embedded worker generates in this process, so this process's Imagen pool must have room
+    if SLIDESHOW_WORKER_MODE == 'embedded' and not imagen_pool.has_room(SLIDESHOW_SCENES):
+        return busy_response(SLIDESHOW_BUSY_MESSAGE, 503, imagen_pool.retry_after(), 'pool_full')
+    return None
+
+
+def upload_rejected_response(message, status):
+    if wants_json():
+        return jsonify({'error': message}), status
+    flash(message)
+    return redirect(url_for('prompt_result'))
+
+
+@app.errorhandler(UploadRejected)
+def handle_upload_rejected(error):
+    return upload_rejected_response(error.message, error.status)
+
+
+@app.errorhandler(413)
+def handle_request_too_large(error):
+    return upload_rejected_response(too_large_message(), 413)
+
+
 @app.route('/generate-slideshow', methods=['POST'])
 @login_required
 def generate_slideshow():
+    # Refuse oversized uploads from the header alone, before any of the body is read
+    check_content_length(request.content_length)
+
     try:
-        can_gen = current_user.can_generate_slideshow()
+        # Jobs still in the queue count against the quota too
+        active_jobs = job_queue.count_active_jobs(current_user.id)
+        can_gen = current_user.get_remaining_slideshows() - active_jobs > 0
     except Exception:
+        active_jobs = 0
         can_gen = False
 
     if not can_gen:
@@ -1314,11 +2121,19 @@ def generate_slideshow():
             return redirect(url_for('upgrade'))
         return redirect(url_for('prompt_result'))
 
-    prompt_data = session.get('prompt_result', {})
-    if not prompt_data:
+    busy = slideshow_admission(current_user.id, active_jobs)
+    if busy is not None:
+        return busy
+
+    prompt_data = resolve_pending_prompt_result()
+    if not prompt_data or prompt_data.get('pending'):
         flash('Please optimize a prompt first.')
         return redirect(url_for('home'))
 
+    if not upstream_client.is_available(OPENAI_CHAT_URL) or not upstream_client.is_available(IMAGEN_PREDICT_URL):
+        flash('Image generation is temporarily unavailable. Please try again in a minute.')
+        return redirect(url_for('prompt_result'))
+
     improved_prompt = prompt_data.get('improved_prompt', '')
     provider = request.form.get('provider', 'imagen')
 
@@ -1335,81 +2150,204 @@ def generate_slideshow():
         flash('No file selected.')
         return redirect(url_for('prompt_result'))
 
-    image_bytes = file.read()
-    if len(image_bytes) > 10 * 1024 * 1024:
-        flash('Image too large. Please upload an image under 10MB.')
-        return redirect(url_for('prompt_result'))
+    job_id = uuid.uuid4().hex
+    upload_path = os.path.join(UPLOAD_STAGING_DIR, f"{job_id}.upload")
+    # Raises UploadRejected for a non-image or an oversized file
+    save_image_upload(file, upload_path)
 
-    try:
-        product_description = analyze_product_image(image_bytes)
-    except Exception as e:
-        print(f"Product analysis failed: {e}")
-        product_description = None
+    job_queue.enqueue(job_id, current_user.id, {
+        'upload_path': upload_path,
+        'improved_prompt': improved_prompt,
+        'original_prompt': prompt_data.get('original_prompt', ''),
+        'provider': provider
+    })
+    start_embedded_worker()
 
-    if not product_description:
-        flash('Could not analyze the product image. Please try again.')
-        return redirect(url_for('prompt_result'))
+    if wants_json():
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('slideshow_job_status', job_id=job_id)
+        }), 202
+    return redirect(url_for('slideshow_status', job_id=job_id))
 
-    try:
-        scene_prompts = generate_ugc_scene_prompts(product_description, improved_prompt, num_scenes=4)
-    except Exception as e:
-        print(f"Scene prompt generation failed: {e}")
-        scene_prompts = []
 
-    if not scene_prompts:
-        flash('Could not generate scene descriptions. Please try again.')
-        return redirect(url_for('prompt_result'))
+def get_user_job(job_id):
+    """Load a slideshow job owned by the current user, or None"""
+    job = job_queue.get_job(job_id)
+    if job is None or job.user_id != current_user.id:
+        return None
+    return job
 
-    print(f"Generating {len(scene_prompts)} images with Imagen 4...")
-    image_bytes_list, errors = generate_slideshow_images(scene_prompts, provider)
-    if errors:
-        print(f"Slideshow generation errors: {errors}")
 
-    batch_id = str(uuid.uuid4())[:12]
-    batch_dir = os.path.join(GENERATED_DIR, batch_id)
-    os.makedirs(batch_dir, exist_ok=True)
-
-    image_urls = []
-    for i, img_bytes in enumerate(image_bytes_list):
-        if img_bytes:
-            filename = f"scene_{i}.png"
-            filepath = os.path.join(batch_dir, filename)
-            with open(filepath, 'wb') as f:
-                f.write(img_bytes)
-            image_urls.append(f"/static/generated/{batch_id}/{filename}")
+@app.route('/slideshow-status/<job_id>')
+@login_required
+def slideshow_status(job_id):
+    """Progress page shown while a slideshow job is queued or running"""
+    job = get_user_job(job_id)
+    if job is None:
+        flash('Slideshow not found.')
+        return redirect(url_for('home'))
+    if job.status == SlideshowJob.STATUS_DONE:
+        return redirect(url_for('slideshow_result', job=job.id))
+    return render_template('slideshow_status.html', job=job)
 
-    if not image_urls:
-        error_msg = 'Image generation failed.'
-        if errors:
-            error_msg += f' Error: {errors[0][:200]}'
-        flash(error_msg)
-        return redirect(url_for('prompt_result'))
 
+@app.route('/slideshow-job/<job_id>')
+@login_required
+def slideshow_job_status(job_id):
+    """JSON status of a slideshow job (polled by the status page)"""
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None
+    }
+    if job.status == SlideshowJob.STATUS_DONE:
+        data['result_url'] = url_for('slideshow_result', job=job.id)
+    return jsonify(data)
+
+
+def slideshow_job_state(job_id):
+    """Terminal (event, data) for a finished slideshow job, or None while it is queued or running"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return 'failed', {'error': 'Job not found'}
+    if job.status == SlideshowJob.STATUS_DONE:
+        return 'done', {'result_url': url_for('slideshow_result', job=job.id)}
+    if job.status == SlideshowJob.STATUS_FAILED:
+        return 'failed', {'error': job.error or 'Slideshow generation failed. Please try again.'}
+    return None
+
+
+@app.route('/slideshow-job/<job_id>/events')
+@login_required
+def slideshow_job_events(job_id):
+    """Progress of a slideshow job as it happens: stage changes, then each scene the moment it is stored.
+
+    EventSource clients get SSE (resuming from Last-Event-ID); anything else
+    long-polls: ?after=<last id>&wait=<seconds> answers as soon as there is news.
+    Both hold a web thread, so they share the stream_slots cap; past it they
+    answer with what is new right away and tell the browser when to ask again.
+    """
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
     try:
-        current_user.increment_slideshow_generation()
-    except Exception as e:
-        print(f"Could not increment slideshow count: {e}")
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        after = 0
 
-    session['slideshow_result'] = {
-        'images': image_urls,
-        'scene_prompts': scene_prompts,
-        'product_description': product_description,
-        'provider': 'Google Nano Banana/Imagen',
-        'provider_key': provider,
-        'batch_id': batch_id,
-        'original_prompt': prompt_data.get('original_prompt', ''),
-        'improved_prompt': improved_prompt,
-        'num_generated': len(image_urls),
-        'num_failed': len(scene_prompts) - len(image_urls)
-    }
+    def job_state():
+        return slideshow_job_state(job_id)
 
-    return redirect(url_for('slideshow_result'))
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        try:
+            wait_seconds = min(max(float(request.args.get('wait', 0)), 0), job_events.JOB_EVENT_LONG_POLL_SECONDS)
+        except ValueError:
+            wait_seconds = 0
+        held = wait_seconds > 0 and stream_slots.try_acquire()
+        try:
+            events, state = job_events.follow(job_id, after, job_state, timeout=wait_seconds if held else 0)
+        finally:
+            if held:
+                stream_slots.release()
+        data = {'events': events, 'last_id': events[-1]['id'] if events else after, 'status': 'running'}
+        if wait_seconds > 0 and not held:
+            data['retry_after'] = STREAM_RETRY_SECONDS
+        if state is not None:
+            data['status'] = state[0]
+            data.update(state[1])
+        return jsonify(data)
+
+    def replay(events, state):
+        for event in events:
+            yield f"id: {event['id']}\n" + sse_event(event['event'], event['data'])
+        if state is not None:
+            yield sse_event(*state)
+
+    if not stream_slots.try_acquire():
+        # No thread to spare: send what is new now; the browser reconnects after the retry delay
+        events, state = job_events.follow(job_id, after, job_state, timeout=0)
+        body = f"retry: {int(STREAM_RETRY_SECONDS * 1000)}\n\n" + ''.join(replay(events, state))
+        if state is None:
+            body += sse_event('busy', {'retry_after': STREAM_RETRY_SECONDS})
+        return Response(body, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    def generate():
+        last_id = after
+        started = time.monotonic()
+        # The browser reconnects (with Last-Event-ID) if a slow job outlives one stream
+        while time.monotonic() - started < SLIDESHOW_EVENTS_STREAM_SECONDS:
+            events, state = job_events.follow(job_id, last_id, job_state, timeout=SSE_KEEPALIVE_SECONDS)
+            if events:
+                last_id = events[-1]['id']
+            yield from replay(events, state)
+            if state is not None:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also runs when the client goes away before the stream starts
+    response.call_on_close(stream_slots.release)
+    return response
+
+
+def generated_url(backend, key):
+    """Page URL for a stored file: its permanent URL, or /generated/<key> which redirects to a fresh presigned one"""
+    storage = get_storage(backend)
+    if storage.permanent_urls:
+        return storage.url(key)
+    return f"/generated/{key}"
+
+
+def store_generated_file(batch_id, user_id, path):
+    """Stream a generated file into storage and record it under its batch; returns (asset, page URL)"""
+    storage = get_storage()
+    stored = storage.put_file(path)
+    asset = GeneratedAsset(batch_id=batch_id, user_id=user_id, filename=os.path.basename(path),
+                           backend=storage.name, storage_key=stored.key,
+                           content_type=stored.content_type, size=stored.size, sha256=stored.sha256)
+    db.session.add(asset)
+    return asset, generated_url(storage.name, stored.key)
+
+
+@app.route('/generated/<path:key>')
+def generated_file(key):
+    """Serve a stored file: local files go out immutable (keys are content hashes, so they can't be
+    guessed or change); S3 objects redirect to a short-lived presigned URL"""
+    if not re.fullmatch(r'[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+', key):
+        return jsonify({'error': 'Not found'}), 404
+    local = get_storage('local')
+    if get_storage().name == 'local' or local.exists(key):
+        digest, extension = os.path.basename(key).split('.', 1)
+        return serve_file(local.local_path(key), local.root, etag=digest, mimetype=content_type_for(extension))
+    response = redirect(get_storage().url(key))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
 
 
 @app.route('/download-image/<batch_id>/<filename>')
 @login_required
 def download_image(batch_id, filename):
     """Serve generated images for download."""
+    asset = GeneratedAsset.query.filter_by(batch_id=batch_id, filename=filename).first()
+    if asset is not None:
+        if asset.user_id is not None and asset.user_id != current_user.id:
+            flash('Image not found.')
+            return redirect(url_for('home'))
+        storage = get_storage(asset.backend)
+        if asset.backend == 'local':
+            return serve_file(storage.local_path(asset.storage_key), storage.root, etag=asset.sha256,
+                              mimetype=asset.content_type, download_name=asset.filename, public=False)
+        return redirect(storage.download_url(asset.storage_key, asset.filename))
+
+    # Slideshows from before storage backends
     safe_batch = batch_id.replace('..', '').replace('/', '').replace('\\', '')
     safe_file = filename.replace('..', '').replace('/', '').replace('\\', '')
     directory = os.path.join(GENERATED_DIR, safe_batch)
@@ -1420,9 +2358,45 @@ def download_image(batch_id, filename):
     return send_from_directory(directory, safe_file, as_attachment=True, download_name=safe_file)
 
 
+@app.route('/download-batch/<batch_id>')
+@login_required
+def download_batch(batch_id):
+    """Download a slideshow's original PNGs as one ZIP, streamed while it is built"""
+    assets = (GeneratedAsset.query.filter_by(batch_id=batch_id, content_type='image/png')
+              .order_by(GeneratedAsset.filename).all())
+    if assets:
+        if any(asset.user_id is not None and asset.user_id != current_user.id for asset in assets):
+            flash('Slideshow not found.')
+            return redirect(url_for('home'))
+        entries = [(asset.filename, partial(get_storage(asset.backend).open, asset.storage_key),
+                    asset.size, asset.created_at) for asset in assets]
+    else:
+        # Slideshows from before storage backends
+        safe_batch = batch_id.replace('..', '').replace('/', '').replace('\\', '')
+        directory = os.path.join(GENERATED_DIR, safe_batch)
+        paths = sorted(entry.path for entry in os.scandir(directory)
+                       if entry.name.endswith('.png')) if safe_batch and os.path.isdir(directory) else []
+        if not paths:
+            flash('Slideshow not found.')
+            return redirect(url_for('home'))
+        entries = [(os.path.basename(path), partial(open, path, 'rb'), os.path.getsize(path),
+                    datetime.fromtimestamp(os.path.getmtime(path))) for path in paths]
+
+    response = Response(stream_zip(entries), mimetype='application/zip',
+                        headers={'Cache-Control': 'private, no-store', 'X-Accel-Buffering': 'no'})
+    response.headers.set('Content-Disposition', 'attachment', filename=f"slideshow-{batch_id}.zip")
+    return response
+
+
 @app.route('/slideshow-result')
 @login_required
 def slideshow_result():
+    job_id = request.args.get('job')
+    if job_id:
+        job = get_user_job(job_id)
+        if job is not None and job.status == SlideshowJob.STATUS_DONE:
+            session['slideshow_result'] = job_queue.job_result(job)
+
     slideshow_data = session.get('slideshow_result', {})
     if not slideshow_data:
         return redirect(url_for('home'))
@@ -1441,7 +2415,7 @@ def slideshow_result():
 @app.route('/prompt-result')
 @login_required
 def prompt_result():
-    prompt_data = session.get('prompt_result', {})
+    prompt_data = resolve_pending_prompt_result()
 
     if not prompt_data:
         return redirect(url_for('home'))
@@ -1518,6 +2492,31 @@ def health_check():
             "timestamp": datetime.utcnow().isoformat()
         }), 500
 
+@app.route('/metrics')
+def metrics():
+    """Runtime metrics for upstream calls and caches (JSON)"""
+    return jsonify({
+        'timestamp': datetime.utcnow().isoformat(),
+        'upstream_timings': upstream_client.timing_stats(),
+        'upstream_singleflight': upstream_client.singleflight_stats(),
+        'prompt_cache': prompt_cache.stats(),
+        'prompt_similarity': prompt_index.stats(),
+        'image_cache': image_cache.stats(),
+        'storage': retention_sweeper.stats(),
+        'circuit_breakers': circuit_breaker.all_stats(),
+        'rate_limits': rate_limiter.stats(),
+        'slideshow_jobs': {
+            'queued': job_queue.queue_depth(),
+            'max_queued': SLIDESHOW_MAX_QUEUED,
+            'worker_mode': SLIDESHOW_WORKER_MODE,
+            'admission_rejections': dict(_admission_rejections),
+            'tier_weights': fair_queue.TIER_WEIGHTS,
+            'queue_wait': job_queue.queue_wait_stats()
+        },
+        'work_pools': {'imagen': imagen_pool.stats(), 'prompt_stream': prompt_stream_pool.stats()},
+        'stream_slots': stream_slots.stats()
+    })
+
 @app.route('/init-db')
 def init_db_route():
     """Initialize database via web route (for debugging)"""
@@ -1752,6 +2751,12 @@ if __name__ == '__main__':
         
         # Clean up expired sessions on startup
         cleanup_expired_sessions()
+        start_embedded_worker()
+        if PROMPT_SIMILARITY_ENABLED:
+            prompt_index.warm(app)
+        if IMAGE_CACHE_ENABLED:
+            image_cache.warm(app)
+        retention_sweeper.start(app)
         
         # Get port from environment variable (for deployment) or use 5000 for local development
         port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,85 @@
+"""
+Base64 fields of streamed JSON responses, decoded straight to a file
+Imagen returns each image as a ~2MB base64 string inside a JSON body. Rather than load the body,
+parse it and decode the string in memory, the body is scanned chunk by chunk: the field's value
+is decoded four characters at a time into the output file, and only the small JSON around it is kept.
+"""
+
+import re
+import base64
+import binascii
+
+CHUNK_SIZE = 64 * 1024
+# Bytes held back while looking for the field name, so a match split across chunks is still found
+KEY_LOOKBEHIND = 256
+
+
+class TruncatedField(ValueError):
+    """The body ended inside the field's value, or the value wasn't valid base64"""
+
+
+def decode_json_field(chunks, field, out):
+    """Decode the first string value of `field` from JSON byte chunks into out.
+
+    Returns (bytes_written, rest) where rest is the JSON body with that value
+    left empty, small enough to json.loads() for the other fields and for
+    error details. bytes_written is 0 if the field never appears.
+    """
+    key = re.compile(rb'"' + re.escape(field.encode()) + rb'"\s*:\s*"')
+    rest = bytearray()
+    buf = b''
+    pending = b''   # base64 characters not yet making up a whole 4-character group
+    state = 'seek'
+    written = 0
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf += chunk
+        if state == 'seek':
+            match = key.search(buf)
+            if match is None:
+                keep = max(len(buf) - KEY_LOOKBEHIND, 0)
+                rest += buf[:keep]
+                buf = buf[keep:]
+                continue
+            rest += buf[:match.end()]
+            buf = buf[match.end():]
+            state = 'value'
+        if state == 'value':
+            end = buf.find(b'"')
+            if end < 0:
+                # A JSON escape split across chunks waits for the rest of it
+                hold = 1 if buf.endswith(b'\\') else 0
+                data, buf = buf[:len(buf) - hold], buf[len(buf) - hold:]
+            else:
+                data, buf = buf[:end], buf[end:]
+            # Some encoders escape the '/' of the base64 alphabet
+            pending += data.replace(b'\\/', b'/')
+            usable = len(pending) - len(pending) % 4
+            written += _write_decoded(out, pending[:usable])
+            pending = pending[usable:]
+            if end < 0:
+                continue
+            if pending:
+                raise TruncatedField(f"{field} is not valid base64")
+            state = 'done'
+        if state == 'done':
+            rest += buf
+            buf = b''
+
+    if state == 'value':
+        raise TruncatedField(f"Response ended inside {field}")
+    rest += buf
+    return written, bytes(rest)
+
+
+def _write_decoded(out, data):
+    if not data:
+        return 0
+    try:
+        decoded = base64.b64decode(data, validate=True)
+    except binascii.Error as e:
+        raise TruncatedField(f"Invalid base64: {e}")
+    out.write(decoded)
+    return len(decoded)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the JSON layer: stdlib json against fast_json (orjson)
+Times the payloads the app actually encodes and decodes: a vision request body carrying a
+base64 product image, an Imagen response, a slideshow_result session blob and a /metrics document.
+
+Usage:
+    python bench_json.py
+    python bench_json.py --rounds 2000 --json
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import statistics
+
+import fast_json
+
+
+def sample_payloads():
+    image_b64 = base64.b64encode(os.urandom(600 * 1024)).decode('ascii')
+    png_b64 = base64.b64encode(os.urandom(1500 * 1024)).decode('ascii')
+    scenes = [f"Scene {i + 1}: a ceramic mug on a sunlit kitchen counter, handheld phone photo, {i}" for i in range(4)]
+    return {
+        'vision_request': {
+            'model': 'gpt-4o-mini',
+            'messages': [{'role': 'user', 'content': [
+                {'type': 'text', 'text': 'Describe this product for a UGC photo shoot.'},
+                {'type': 'image_url', 'image_url': {'url': f"data:image/jpeg;base64,{image_b64}"}},
+            ]}],
+            'max_tokens': 300,
+        },
+        'imagen_response': {'predictions': [{'bytesBase64Encoded': png_b64, 'mimeType': 'image/png'}]},
+        'slideshow_session': {
+            '_user_id': '42', '_fresh': True, '_permanent': True,
+            'prompt_result': {'original_prompt': 'a mug', 'improved_prompt': ' '.join(scenes) * 3,
+                              'tool_type': 'image_video', 'model_key': 'imagen'},
+            'slideshow_result': {'batch_id': 'a1b2c3d4e5f6', 'scene_prompts': scenes,
+                                 'image_urls': [f"/generated/ab/cd/{'0' * 64}.png"] * 4,
+                                 'thumbnails': [f"/generated/ab/cd/{'1' * 64}.webp"] * 4,
+                                 'product_description': 'A blue ceramic mug with a matte glaze. ' * 5},
+        },
+        'metrics': {f"timing.{name}.{i}": {'count': 1000 + i, 'p50_ms': 12.5 * i, 'p95_ms': 80.25 * i, 'errors': i}
+                    for i, name in enumerate(['openai.chat', 'vision', 'imagen', 'slideshow.store',
+                                              'slideshow.first_image', 'slideshow.variants'] * 8)},
+    }
+
+
+def time_call(fn, rounds):
+    """Median seconds per call over rounds"""
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def run(rounds):
+    results = {}
+    for name, payload in sample_payloads().items():
+        encoded = json.dumps(payload).encode('utf-8')
+        cases = {
+            'stdlib_dumps': lambda: json.dumps(payload).encode('utf-8'),
+            'fast_dumps': lambda: fast_json.dumps_bytes(payload),
+            'stdlib_loads': lambda: json.loads(encoded),
+            'fast_loads': lambda: fast_json.loads(encoded),
+        }
+        row = {'bytes': len(encoded)}
+        for case, fn in cases.items():
+            row[f"{case}_us"] = round(time_call(fn, rounds) * 1e6, 1)
+        row['dumps_speedup'] = round(row['stdlib_dumps_us'] / max(row['fast_dumps_us'], 0.01), 1)
+        row['loads_speedup'] = round(row['stdlib_loads_us'] / max(row['fast_loads_us'], 0.01), 1)
+        results[name] = row
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark stdlib json against the fast_json layer')
+    parser.add_argument('--rounds', type=int, default=200, help='calls timed per case')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.rounds)
+    if args.json:
+        print(json.dumps({'backend': fast_json.BACKEND, 'results': results}, indent=2))
+        return 0
+
+    print(f"fast_json backend: {fast_json.BACKEND}")
+    print(f"{'payload':<20}{'bytes':>10}{'json dumps':>13}{'fast dumps':>13}{'json loads':>13}{'fast loads':>13}  speedup")
+    for name, row in results.items():
+        print(f"{name:<20}{row['bytes']:>10}{row['stdlib_dumps_us']:>11}us{row['fast_dumps_us']:>11}us"
+              f"{row['stdlib_loads_us']:>11}us{row['fast_loads_us']:>11}us"
+              f"  {row['dumps_speedup']}x / {row['loads_speedup']}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
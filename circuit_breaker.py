@@ -0,0 +1,158 @@
+"""
+Circuit breakers for upstream AI endpoints
+A breaker opens when recent calls fail or run slow too often, so callers fail fast
+instead of waiting out the full upstream timeout
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_WINDOW = int(os.getenv('CIRCUIT_WINDOW', '20'))
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', '0.5'))
+CIRCUIT_SLOW_RATE = float(os.getenv('CIRCUIT_SLOW_RATE', '0.5'))
+CIRCUIT_SLOW_SECONDS = float(os.getenv('CIRCUIT_SLOW_SECONDS', '20'))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"Circuit '{name}' is open (retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Rolling-window breaker tripped by error rate or slow-call rate"""
+
+    def __init__(self, name, window=CIRCUIT_WINDOW, min_calls=CIRCUIT_MIN_CALLS,
+                 error_rate=CIRCUIT_ERROR_RATE, slow_rate=CIRCUIT_SLOW_RATE,
+                 slow_seconds=CIRCUIT_SLOW_SECONDS, open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self._calls = deque(maxlen=window)  # (ok, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def retry_in(self):
+        with self._lock:
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def allow(self):
+        """True if a call may go ahead; half-open lets a single probe through"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def before_call(self):
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+
+    def record(self, ok, elapsed):
+        """Record the outcome of one upstream call"""
+        slow = elapsed >= self.slow_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok and not slow:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info(f"Circuit '{self.name}' closed")
+                else:
+                    self._trip()
+                return
+
+            self._calls.append((ok, slow))
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                total = len(self._calls)
+                errors = sum(1 for call_ok, _ in self._calls if not call_ok)
+                slow_calls = sum(1 for _, call_slow in self._calls if call_slow)
+                if errors / total >= self.error_rate or slow_calls / total >= self.slow_rate:
+                    self._trip()
+
+    def release_probe(self):
+        """Give back a half-open probe slot taken by allow() when the call was never made"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self.times_opened += 1
+        logger.warning(f"Circuit '{self.name}' opened for {self.open_seconds}s")
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._calls.clear()
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            calls = list(self._calls)
+        return {
+            'state': state,
+            'recent_calls': len(calls),
+            'recent_errors': sum(1 for ok, _ in calls if not ok),
+            'recent_slow': sum(1 for _, slow in calls if slow),
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+        }
+
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name, **options):
+    """Get (or create with `options`) the process-wide breaker for an endpoint"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **options)
+            _breakers[name] = breaker
+        return breaker
+
+
+def all_stats():
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
@@ -0,0 +1,2 @@
+# Imported before any test module, so the whole pytest run uses temporary instance state
+import testing_helpers  # noqa: F401
@@ -0,0 +1,59 @@
+"""
+Per-request deadlines for multi-stage upstream pipelines
+One Deadline is created when the work starts and passed down through every stage;
+each stage caps its own timeout at the time left instead of using a fixed one,
+so the stages together can never outlive the overall budget
+"""
+
+import os
+import time
+
+# Below this many seconds left a stage is not worth starting
+MIN_STAGE_SECONDS = float(os.getenv('DEADLINE_MIN_STAGE_SECONDS', '2'))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage would start with too little of the budget left"""
+
+    def __init__(self, stage=None):
+        self.stage = stage
+        super().__init__(f"Deadline exceeded before {stage}" if stage else "Deadline exceeded")
+
+
+class Deadline:
+    """A fixed point in (monotonic) time that a chain of calls must finish by"""
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.budget = seconds
+        self.expires_at = clock() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self.clock())
+
+    def elapsed(self):
+        return self.budget - (self.expires_at - self.clock())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None, stage=None, min_seconds=MIN_STAGE_SECONDS):
+        """Seconds a stage may take: the time left, capped at the stage's own timeout.
+
+        Raises DeadlineExceeded if less than min_seconds is left.
+        """
+        remaining = self.remaining()
+        if remaining < min_seconds:
+            raise DeadlineExceeded(stage)
+        return remaining if cap is None else min(cap, remaining)
+
+    def __repr__(self):
+        return f"Deadline(remaining={self.remaining():.1f}s of {self.budget:g}s)"
+
+
+def stage_timeout(deadline, cap, stage=None):
+    """timeout= for one stage: cap alone without a deadline, else capped at the time left"""
+    if deadline is None:
+        return cap
+    return deadline.timeout(cap, stage)
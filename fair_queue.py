@@ -0,0 +1,67 @@
+"""
+Weighted fair queuing between users
+Generation work is scheduled per user rather than first come, first served: each user is a flow,
+paid users' flows weigh more, and the next item is the one with the smallest virtual finish tag.
+A user with a long backlog only ever competes with their own earlier work, so nobody can hog
+the workers, and when only one user is waiting they get all of them.
+"""
+
+import os
+import heapq
+import itertools
+
+TIER_FREE = 'free'
+TIER_PAID = 'paid'
+
+TIER_WEIGHTS = {
+    TIER_FREE: float(os.getenv('FAIR_WEIGHT_FREE', '1')),
+    TIER_PAID: float(os.getenv('FAIR_WEIGHT_PAID', '4')),
+}
+
+# Finish tags of idle flows are dropped once there are this many
+MAX_IDLE_FLOWS = 1000
+
+
+def tier_for(is_paid):
+    return TIER_PAID if is_paid else TIER_FREE
+
+
+def weight_for(tier):
+    return TIER_WEIGHTS.get(tier, TIER_WEIGHTS[TIER_FREE])
+
+
+def finish_tag(served, tier, cost=1.0):
+    """Virtual finish of a flow's next item, after it has been served `served` items"""
+    return (served + cost) / weight_for(tier)
+
+
+class FairQueue:
+    """Self-clocked weighted fair queue: pop() returns the item with the smallest finish tag.
+
+    Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._finish = {}  # flow -> finish tag of its last queued item
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+    def push(self, item, flow=None, tier=TIER_FREE, cost=1.0):
+        # A flow that has been idle restarts at the current virtual time, not where it left off
+        start = max(self._vtime, self._finish.get(flow, 0.0))
+        finish = start + cost / weight_for(tier)
+        self._finish[flow] = finish
+        heapq.heappush(self._heap, (finish, next(self._seq), item))
+
+    def pop(self):
+        finish, _, item = heapq.heappop(self._heap)
+        self._vtime = finish
+        if not self._heap:
+            self._finish.clear()
+        elif len(self._finish) > MAX_IDLE_FLOWS:
+            self._finish = {flow: tag for flow, tag in self._finish.items() if tag > self._vtime}
+        return item
+
+    def __len__(self):
+        return len(self._heap)
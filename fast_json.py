@@ -0,0 +1,105 @@
+"""
+Fast JSON encoding and decoding, using orjson when it is installed
+Used as Flask's JSON provider (jsonify, request.get_json), for the Flask-Session rows that hold
+prompt_result and slideshow_result, and for upstream request bodies and responses.
+Without orjson (pip install orjson), or with JSON_BACKEND=json, everything falls back to the
+stdlib json module with the same output shape.
+"""
+
+import os
+import json
+import pickle
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None and os.getenv('JSON_BACKEND', 'orjson') == 'orjson' else 'json'
+
+if BACKEND == 'orjson':
+    # Non-string keys are stringified like the stdlib does
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumps_bytes(obj, sort_keys=False, default=None):
+    """Compact UTF-8 JSON bytes"""
+    if BACKEND == 'orjson':
+        option = _OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass  # e.g. integers past 64 bits; let the stdlib have a go
+    return json.dumps(obj, sort_keys=sort_keys, default=default, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj, sort_keys=False, default=None):
+    return dumps_bytes(obj, sort_keys=sort_keys, default=default).decode('utf-8')
+
+
+def loads(data):
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's default provider, with the plain cases encoded and decoded by orjson.
+
+    Dates still go through Flask's default() (HTTP dates), and anything orjson
+    can't express (custom separators, indents other than 2) uses the stdlib.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if BACKEND != 'orjson':
+            return super().dumps(obj, **kwargs)
+        options = dict(kwargs)
+        sort_keys = options.pop('sort_keys', self.sort_keys)
+        default = options.pop('default', self.default)
+        indent = options.pop('indent', None)
+        options.pop('ensure_ascii', None)
+        if options.get('separators') in ((',', ':'), None):
+            options.pop('separators', None)
+        if options or indent not in (None, 2):
+            return super().dumps(obj, **kwargs)
+
+        option = _OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if BACKEND != 'orjson' or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+class SessionSerializer:
+    """Flask-Session serializer storing JSON instead of pickles.
+
+    Sessions saved as pickles (before the switch, or holding values JSON
+    can't represent) are still read and written as pickles.
+    """
+
+    def dumps(self, data):
+        try:
+            return dumps_bytes(data)
+        except (TypeError, ValueError):
+            return pickle.dumps(data)
+
+    def loads(self, value):
+        if value[:1] == b'\x80':  # pickle protocol 2+
+            return pickle.loads(value)
+        try:
+            return loads(value)
+        except ValueError:
+            # Flask-Session starts a fresh session on this
+            raise pickle.UnpicklingError('Unreadable session data')
@@ -0,0 +1,69 @@
+"""
+Serving generated files without tying a worker up for every byte
+FILE_SERVING_MODE=flask (default) returns the file through wsgi.file_wrapper, which gunicorn sends
+with os.sendfile (zero-copy); x-accel (nginx) and x-sendfile (Apache, lighttpd) return headers only
+and the front proxy sends the file, Range requests included. Generated files never change once
+written, so responses carry a strong ETag (their content hash) and an immutable Cache-Control.
+
+nginx, for FILE_SERVING_MODE=x-accel:
+    location /_protected/generated/ { internal; alias /app/static/generated/; }
+"""
+
+import os
+from urllib.parse import quote
+
+from flask import Response, request, send_file, abort
+
+FILE_SERVING_MODE = os.getenv('FILE_SERVING_MODE', 'flask')
+# Internal nginx location that maps onto the local storage root
+X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/_protected/generated').rstrip('/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+MODES = ('flask', 'x-accel', 'x-sendfile')
+
+
+def serve_file(path, root, etag, mimetype, download_name=None, public=True, mode=None):
+    """Response for an immutable file under root.
+
+    etag is a strong validator for the content (the sha256 for content-addressed
+    files). download_name makes it an attachment; public=False keeps it out of
+    shared caches (for downloads behind a login).
+    """
+    mode = mode or FILE_SERVING_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown FILE_SERVING_MODE: {mode}")
+
+    # Swept or deleted objects can still be linked from old pages
+    if not os.path.isfile(path):
+        abort(404)
+
+    if mode == 'flask':
+        # Handles If-None-Match / If-Range / Range itself; full responses go out via sendfile
+        response = send_file(path, mimetype=mimetype, as_attachment=download_name is not None,
+                             download_name=download_name, etag=etag, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    else:
+        response = Response(mimetype=mimetype)
+        response.set_etag(etag)
+        if download_name is not None:
+            response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        if mode == 'x-accel':
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = quote(f"{X_ACCEL_PREFIX}/{relative}")
+        else:
+            response.headers['X-Sendfile'] = path
+        # A matching If-None-Match gets its 304 here; Range is left to the proxy, which has the file
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response.headers.pop('X-Accel-Redirect', None)
+            response.headers.pop('X-Sendfile', None)
+
+    cache_control = response.cache_control
+    cache_control.max_age = IMMUTABLE_MAX_AGE
+    cache_control.immutable = True
+    cache_control.no_cache = None
+    if public:
+        cache_control.public = True
+    else:
+        cache_control.public = False
+        cache_control.private = True
+    return response
@@ -8,7 +8,13 @@ backlog = 2048
 
 # Worker processes - use single worker for better session handling
 workers = 1
-worker_class = "sync"
+# Threaded worker so a long-lived SSE stream (/prompt-stream) doesn't block every other request
+worker_class = "gthread"
+# Each open SSE stream or long-poll (/prompt-stream, /slideshow-job/<id>/events) holds one of these
+# threads. stream_slots.py caps them at STREAM_SLOTS per worker (default: half of GUNICORN_THREADS);
+# past the cap they answer at once with a retry delay, so the other half always serves normal pages.
+# Raise GUNICORN_THREADS (and STREAM_SLOTS with it) to keep more streams open.
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
 worker_connections = 1000
 timeout = 180  # Increased timeout for database operations
 keepalive = 2
@@ -79,6 +85,36 @@ def post_fork(server, worker):
     """Called just after a worker has been forked"""
     server.log.info("Worker spawned (pid: %s)", worker.pid)
 
+    # Fork the image variant encoders before this worker starts any threads
+    if os.getenv('SLIDESHOW_WORKER_MODE', 'embedded') == 'embedded':
+        import image_variants
+        image_variants.warm_pool()
+
+    # Open keep-alive connections to the AI APIs before the first request needs them
+    import upstream_client
+    if upstream_client.PREWARM:
+        upstream_client.warm_connections()
+
+    # Resume queued slideshow jobs when the worker runs in-process
+    from app import app, start_embedded_worker
+    start_embedded_worker()
+
+    # Load the near-duplicate prompt index without blocking the first request
+    from prompt_similarity import prompt_index, PROMPT_SIMILARITY_ENABLED
+    if PROMPT_SIMILARITY_ENABLED:
+        prompt_index.warm(app)
+
+    # Product image analyses are only looked up by the in-process slideshow worker
+    from app import SLIDESHOW_WORKER_MODE
+    from image_cache import image_cache, IMAGE_CACHE_ENABLED
+    if IMAGE_CACHE_ENABLED and SLIDESHOW_WORKER_MODE == 'embedded':
+        image_cache.warm(app)
+
+    # Expire old slideshow images and enforce storage quotas where slideshows are generated
+    if SLIDESHOW_WORKER_MODE == 'embedded':
+        from retention import sweeper
+        sweeper.start(app)
+
 def post_worker_init(worker):
     """Called just after a worker has initialized the application"""
     worker.log.info("Worker initialized")
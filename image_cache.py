@@ -0,0 +1,366 @@
+"""
+Perceptual-hash cache for product image analyses
+A re-uploaded product photo (re-compressed, resized or slightly cropped) hashes to within a
+few bits of the original, so its stored GPT-4o description is reused instead of calling
+the vision API again. Hashes are multi-index hashed per scope, so lookups stay fast as the catalog grows.
+The hash is grayscale, so a coarse hue histogram is kept with it: the same product in another
+color hashes alike but misses on color.
+Needs Pillow to decode images; without it every lookup misses.
+"""
+
+import io
+import os
+import math
+import time
+import hashlib
+import threading
+import logging
+from itertools import combinations
+from datetime import datetime, timedelta
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed: the cache is disabled
+    Image = ImageOps = None
+
+from models import db, ImageAnalysis
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_ENABLED = os.getenv('IMAGE_CACHE_ENABLED', '1') == '1'
+# Largest Hamming distance (of 64 bits) between hashes still treated as the same product photo
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv('IMAGE_CACHE_MAX_DISTANCE', '8'))
+IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', str(30 * 24 * 3600)))
+# Largest color-histogram distance (0-2) still treated as the same product colors
+IMAGE_CACHE_MAX_COLOR_DISTANCE = float(os.getenv('IMAGE_CACHE_MAX_COLOR_DISTANCE', '0.5'))
+# How often a worker picks up analyses stored by other workers
+IMAGE_CACHE_SYNC_SECONDS = float(os.getenv('IMAGE_CACHE_SYNC_SECONDS', '30'))
+
+HASH_SIZE = 8      # 8x8 lowest DCT frequencies -> 64-bit hash
+SAMPLE_SIZE = 32   # image is reduced to 32x32 grayscale before the DCT
+COLOR_BINS = 12   # hue histogram, 30 degrees a bin
+# Photos with less color than this (mostly gray) compare their few tinted pixels at this scale,
+# so JPEG chroma noise isn't blown up into a different color
+COLOR_FLOOR = 0.05
+LOAD_BATCH = 5000
+# Rows committed slightly out of created_at order are still picked up on the next sync
+SYNC_OVERLAP = timedelta(seconds=5)
+PURGE_EVERY = 200
+
+# DCT-II basis for the first HASH_SIZE frequencies: _COS[u][x] = cos((2x + 1) u pi / 2N)
+_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * SAMPLE_SIZE)) for x in range(SAMPLE_SIZE)]
+        for u in range(HASH_SIZE)]
+
+
+def perceptual_hash(image_bytes):
+    """64-bit DCT perceptual hash of an image, or None if it can't be decoded.
+
+    The image is EXIF-oriented, reduced to 32x32 grayscale and transformed
+    with a 2D DCT; each of the 8x8 lowest frequencies (minus DC) sets a bit
+    when it is above their median. Re-compression, resizing and small crops
+    only flip a few bits.
+    """
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('L', (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert('L').resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.LANCZOS)
+        pixels = list(image.getdata())
+    except Exception as e:
+        logger.info(f"Perceptual hash skipped: {e}")
+        return None
+
+    rows = [pixels[y * SAMPLE_SIZE:(y + 1) * SAMPLE_SIZE] for y in range(SAMPLE_SIZE)]
+    # Separable DCT, only for the frequencies the hash keeps
+    row_freqs = [[sum(c * p for c, p in zip(basis, row)) for basis in _COS] for row in rows]
+    coefficients = [sum(_COS[v][y] * row_freqs[y][u] for y in range(SAMPLE_SIZE))
+                    for v in range(HASH_SIZE) for u in range(HASH_SIZE)]
+
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def color_signature(image_bytes):
+    """Hue histogram of an image as a hex string, or None if it can't be decoded.
+
+    Each pixel of a 32x32 reduction adds its saturation squared times value
+    to the two hue bins around its hue, so pale and dark pixels (whose hue is
+    mostly noise) count for little. Bins are scaled to the photo's total color.
+    """
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('RGB', (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert('RGB').resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BOX)
+        pixels = list(image.convert('HSV').getdata())
+    except Exception as e:
+        logger.info(f"Color signature skipped: {e}")
+        return None
+
+    bins = [0.0] * COLOR_BINS
+    for hue, saturation, value in pixels:
+        weight = (saturation / 255) ** 2 * value / 255
+        position = hue * COLOR_BINS / 256
+        low, fraction = int(position), position - int(position)
+        bins[low] += weight * (1 - fraction)
+        bins[(low + 1) % COLOR_BINS] += weight * fraction
+    total = max(sum(bins), COLOR_FLOOR * len(pixels))
+    return bytes(round(share / total * 255) for share in bins).hex()
+
+
+def color_distance(a, b):
+    """L1 distance between two color signatures (0-2); infinite when either is missing"""
+    if not a or not b:
+        return math.inf
+    return sum(abs(x - y) for x, y in zip(bytes.fromhex(a), bytes.fromhex(b))) / 255
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _to_signed(value):
+    """64-bit unsigned hash -> signed, for a BIGINT column"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _flip_masks(bits, radius):
+    """Every mask of `bits` bits with at most `radius` bits set"""
+    masks = [0]
+    for count in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in chosen) for chosen in combinations(range(bits), count))
+    return masks
+
+
+class MultiIndexHash:
+    """Radius search over 64-bit hashes by multi-index hashing.
+
+    Each hash is split into CHUNKS 16-bit substrings, each with its own
+    table. Two hashes within distance r must agree to within r // CHUNKS
+    bits on at least one substring (pigeonhole), so a search only probes
+    the buckets near each of the query's substrings and checks the few
+    hashes it finds there, instead of walking the whole catalog.
+    """
+
+    CHUNKS = 4
+    BITS = 64 // CHUNKS
+
+    def __init__(self):
+        self._tables = [dict() for _ in range(self.CHUNKS)]  # substring -> [hash, ...]
+        self._items = {}                                     # hash -> item
+        self._masks = {}
+
+    def _substrings(self, value):
+        mask = (1 << self.BITS) - 1
+        return [(value >> (i * self.BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value, item):
+        """Insert a hash; an exact duplicate replaces the stored item"""
+        if value not in self._items:
+            for table, substring in zip(self._tables, self._substrings(value)):
+                table.setdefault(substring, []).append(value)
+        self._items[value] = item
+
+    def get(self, value, default=None):
+        return self._items.get(value, default)
+
+    def search(self, value, radius):
+        """All (distance, item) within radius of value, closest first"""
+        sub_radius = radius // self.CHUNKS
+        masks = self._masks.get(sub_radius)
+        if masks is None:
+            masks = self._masks[sub_radius] = _flip_masks(self.BITS, sub_radius)
+        seen = set()
+        found = []
+        for table, substring in zip(self._tables, self._substrings(value)):
+            for mask in masks:
+                for candidate in table.get(substring ^ mask, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = (value ^ candidate).bit_count()
+                    if distance <= radius:
+                        found.append((distance, self._items[candidate]))
+        found.sort(key=lambda hit: hit[0])
+        return found
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ImageAnalysisCache:
+    """Product descriptions keyed by perceptual hash, shared by every worker through the database"""
+
+    def __init__(self, max_distance=IMAGE_CACHE_MAX_DISTANCE, ttl=IMAGE_CACHE_TTL,
+                 sync_seconds=IMAGE_CACHE_SYNC_SECONDS, use_db=True,
+                 max_color_distance=IMAGE_CACHE_MAX_COLOR_DISTANCE):
+        self.max_distance = max_distance
+        self.max_color_distance = max_color_distance
+        self.ttl = ttl
+        self.sync_seconds = sync_seconds
+        self.use_db = use_db
+        # scope -> MultiIndexHash of hash -> [(color signature, ImageAnalysis id or description without a DB)]
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._loaded_until = None
+        self._last_sync = 0.0
+        self._sync_lock = threading.Lock()
+        self._counters = {'lookups': 0, 'hits': 0, 'stores': 0, 'db_errors': 0}
+
+    def _insert(self, scope, value, color, item):
+        # One hash can stand for the same product in several colors
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                index = self._indexes[scope] = MultiIndexHash()
+            entries = [entry for entry in index.get(value, []) if entry[1] != item]
+            index.add(value, entries + [(color, item)])
+
+    def sync(self, force=False):
+        """Load hashes stored since the last sync (by any worker)"""
+        if not self.use_db:
+            return
+        if not force and time.monotonic() - self._last_sync < self.sync_seconds:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sync = time.monotonic()
+            query = (db.session.query(ImageAnalysis.id, ImageAnalysis.scope, ImageAnalysis.phash,
+                                      ImageAnalysis.color, ImageAnalysis.created_at)
+                     .filter(ImageAnalysis.expires_at > datetime.utcnow()))
+            if self._loaded_until is not None:
+                query = query.filter(ImageAnalysis.created_at >= self._loaded_until - SYNC_OVERLAP)
+            loaded_until = self._loaded_until
+            for row_id, scope, phash, color, created_at in query.order_by(ImageAnalysis.created_at).yield_per(LOAD_BATCH):
+                self._insert(scope, _to_unsigned(phash), color, row_id)
+                loaded_until = created_at
+            self._loaded_until = loaded_until
+        except Exception as e:
+            db.session.rollback()
+            self._count('db_errors')
+            logger.warning(f"Image cache sync failed: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def warm(self, app, background=True):
+        """Load the stored hashes ahead of the first lookup (called after a worker forks)"""
+        def _warm():
+            with app.app_context():
+                self.sync(force=True)
+            logger.info(f"Image analysis cache loaded: {len(self)} hashes")
+
+        if not self.use_db:
+            return None
+        if background:
+            thread = threading.Thread(target=_warm, name='image-cache-warm', daemon=True)
+            thread.start()
+            return thread
+        _warm()
+        return None
+
+    def lookup(self, image_hash, color, scope):
+        """Return (description, distance) for the closest stored image within max_distance, or None.
+
+        Only images whose colors are within max_color_distance count: the hash alone
+        can't tell a red mug from the same mug in blue.
+        """
+        if image_hash is None:
+            return None
+        self.sync()
+        self._count('lookups')
+        with self._lock:
+            index = self._indexes.get(scope)
+            hits = index.search(image_hash, self.max_distance) if index is not None else []
+        candidates = []
+        for distance, entries in hits:
+            for stored_color, item in entries:
+                color_gap = color_distance(color, stored_color)
+                if color_gap <= self.max_color_distance:
+                    candidates.append((distance, color_gap, item))
+        candidates.sort(key=lambda candidate: candidate[:2])
+
+        for distance, _, item in candidates:
+            if not self.use_db:
+                self._count('hits')
+                return item, distance
+            try:
+                row = db.session.get(ImageAnalysis, item)
+            except Exception as e:
+                db.session.rollback()
+                self._count('db_errors')
+                logger.warning(f"Image cache read failed: {e}")
+                return None
+            if row is not None and row.expires_at > datetime.utcnow():
+                self._count('hits')
+                return row.description, distance
+        return None
+
+    def store(self, image_hash, color, scope, description):
+        """Remember the description for an image hash and color signature"""
+        if image_hash is None or not color or not description:
+            return
+        self._count('stores')
+        if not self.use_db:
+            self._insert(scope, image_hash, color, description)
+            return
+        try:
+            now = datetime.utcnow()
+            row = ImageAnalysis(phash=_to_signed(image_hash), color=color, scope=scope, description=description,
+                                created_at=now, expires_at=now + timedelta(seconds=self.ttl))
+            db.session.add(row)
+            db.session.commit()
+            self._insert(scope, image_hash, color, row.id)
+            if self._counters['stores'] % PURGE_EVERY == 0:
+                self.purge_expired()
+        except Exception as e:
+            db.session.rollback()
+            self._count('db_errors')
+            logger.warning(f"Image cache DB write failed: {e}")
+
+    def purge_expired(self):
+        """Delete expired analyses from the database (their index entries miss on lookup until restart)"""
+        try:
+            deleted = ImageAnalysis.query.filter(ImageAnalysis.expires_at < datetime.utcnow()).delete()
+            db.session.commit()
+            return deleted
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Image cache purge failed: {e}")
+            return 0
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(index) for index in self._indexes.values())
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['indexed'] = len(self)
+        counters['max_distance'] = self.max_distance
+        counters['max_color_distance'] = self.max_color_distance
+        counters['enabled'] = IMAGE_CACHE_ENABLED and Image is not None
+        return counters
+
+
+def analysis_scope(model, instructions):
+    """Cached descriptions only match for the same vision model and instructions"""
+    raw = '\x1f'.join([model or '', instructions or ''])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+# Global instance
+image_cache = ImageAnalysisCache()
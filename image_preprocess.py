@@ -0,0 +1,104 @@
+"""
+Preprocessing for product images sent to GPT-4o Vision
+Decodes the upload, applies its EXIF orientation, downsizes it to VISION_MAX_EDGE and
+re-encodes it compactly, so the vision call carries a few hundred KB instead of the raw upload.
+Pillow is optional: without it (or for files it can't decode) the original bytes go through
+unchanged, labelled with the MIME type sniffed from their magic bytes.
+"""
+
+import io
+import os
+import base64
+import logging
+from collections import namedtuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed: images are sent as uploaded
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Longest edge sent to the vision model; high detail tiles at 512px, so more than this only costs tokens
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', '1024'))
+# Images whose longest edge is at most this use detail=low (a flat ~85 tokens)
+VISION_LOW_DETAIL_EDGE = int(os.getenv('VISION_LOW_DETAIL_EDGE', '512'))
+VISION_JPEG_QUALITY = int(os.getenv('VISION_JPEG_QUALITY', '85'))
+
+EXIF_ORIENTATION = 0x0112
+
+PreparedImage = namedtuple('PreparedImage', 'data mime width height detail')
+
+# (magic bytes, offset, MIME type)
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 0, 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'image/png'),
+    (b'GIF87a', 0, 'image/gif'),
+    (b'GIF89a', 0, 'image/gif'),
+    (b'WEBP', 8, 'image/webp'),
+)
+
+
+def sniff_mime(data):
+    """MIME type from an image's magic bytes, or None if it isn't a format we know"""
+    for magic, offset, mime in _SIGNATURES:
+        if data[offset:offset + len(magic)] == magic:
+            if mime == 'image/webp' and data[:4] != b'RIFF':
+                continue
+            return mime
+    return None
+
+
+def detail_for(width, height):
+    """Vision `detail` level for an image of this size"""
+    if width and height and max(width, height) <= VISION_LOW_DETAIL_EDGE:
+        return 'low'
+    return 'high'
+
+
+def _passthrough(image_bytes):
+    return PreparedImage(image_bytes, sniff_mime(image_bytes) or 'image/jpeg', None, None, 'auto')
+
+
+def prepare_for_vision(image_bytes, max_edge=VISION_MAX_EDGE, quality=VISION_JPEG_QUALITY):
+    """Decode, orient, downsize and re-encode an upload for the vision API.
+
+    Opaque images become JPEG and images with transparency become WebP.
+    The original bytes are kept if they are already small enough and
+    re-encoding would not make them smaller.
+    """
+    if Image is None:
+        return _passthrough(image_bytes)
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        original_format, original_size = image.format, image.size
+        oriented = image.getexif().get(EXIF_ORIENTATION, 1) == 1
+        # Lets the JPEG decoder scale down by 1/2..1/8 while decoding instead of afterwards
+        image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        output = io.BytesIO()
+        if has_alpha:
+            image.convert('RGBA').save(output, format='WEBP', quality=quality, method=4)
+            mime = 'image/webp'
+        else:
+            image.convert('RGB').save(output, format='JPEG', quality=quality, optimize=True)
+            mime = 'image/jpeg'
+        data = output.getvalue()
+    except Exception as e:  # corrupt or unsupported upload: let the vision API decide
+        logger.info(f"Image preprocessing skipped: {e}")
+        return _passthrough(image_bytes)
+
+    width, height = image.size
+    unchanged = oriented and (width, height) == original_size and original_format in ('JPEG', 'PNG', 'WEBP')
+    if unchanged and len(image_bytes) <= len(data):
+        data, mime = image_bytes, sniff_mime(image_bytes) or mime
+    return PreparedImage(data, mime, width, height, detail_for(width, height))
+
+
+def data_url(prepared):
+    """data: URL for a PreparedImage, for the vision API's image_url field"""
+    return f"data:{prepared.mime};base64,{base64.b64encode(prepared.data).decode('ascii')}"
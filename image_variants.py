@@ -0,0 +1,156 @@
+"""
+Compressed variants and thumbnails for generated slideshow images
+Each Imagen PNG gets WebP (and AVIF, where Pillow can write it) copies at a few widths,
+encoded in a process pool so the encodes run in parallel and off the worker's GIL.
+The result page serves them through srcset; downloads keep the original PNG.
+"""
+
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401  registers the AVIF plugin on Pillow < 11.2
+    except ImportError:
+        pass
+except ImportError:  # Pillow not installed: pages use the original PNGs
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANTS_ENABLED = os.getenv('IMAGE_VARIANTS_ENABLED', '1') == '1'
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', '2'))
+# Thumbnail widths (px) for srcset; a full-size variant is always written too
+IMAGE_VARIANT_WIDTHS = tuple(int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '320,640').split(',') if w.strip())
+WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', '80'))
+AVIF_QUALITY = int(os.getenv('AVIF_QUALITY', '50'))
+# Variants not ready after this long are skipped; the page falls back to the PNG
+IMAGE_VARIANT_TIMEOUT = float(os.getenv('IMAGE_VARIANT_TIMEOUT', '30'))
+
+# (MIME type, Pillow format, extension, save options), best compression first for <picture>
+FORMATS = (
+    ('image/avif', 'AVIF', 'avif', {'quality': AVIF_QUALITY, 'speed': 8}),
+    ('image/webp', 'WEBP', 'webp', {'quality': WEBP_QUALITY, 'method': 4}),
+)
+
+_pool = {'pid': None, 'executor': None}
+_pool_lock = threading.Lock()
+
+
+def available_formats():
+    """The FORMATS entries this Pillow build can write"""
+    if Image is None:
+        return []
+    Image.init()
+    return [entry for entry in FORMATS if entry[1] in Image.SAVE]
+
+
+def _get_pool():
+    """The process pool for this process (rebuilt after a fork, like the upstream sessions)"""
+    with _pool_lock:
+        if _pool['pid'] != os.getpid() or _pool['executor'] is None:
+            # fork: children only need Pillow, and spawn would re-run the app's __main__ module
+            _pool['executor'] = ProcessPoolExecutor(max_workers=IMAGE_VARIANT_WORKERS,
+                                                    mp_context=multiprocessing.get_context('fork'))
+            _pool['pid'] = os.getpid()
+        return _pool['executor']
+
+
+def _discard_pool():
+    """Drop a broken pool (a child died) so the next call builds a new one"""
+    with _pool_lock:
+        executor, _pool['executor'] = _pool['executor'], None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def warm_pool():
+    """Fork the pool's processes now, before this process starts its own threads"""
+    if not IMAGE_VARIANTS_ENABLED or not available_formats():
+        return
+    _get_pool().submit(os.getpid).result()
+
+
+def render_variants(path, widths, formats):
+    """Write the variants of one image next to it (runs in a pool process).
+
+    Returns {'width', 'height', 'sources': {mime: [(filename, width), ...]}}.
+    """
+    with Image.open(path) as source:
+        source.load()
+        image = source.convert('RGBA' if 'A' in source.getbands() else 'RGB')
+    full_width, full_height = image.size
+    stem = os.path.splitext(path)[0]
+
+    targets = sorted({w for w in widths if w < full_width} | {full_width})
+    sizes = {w: image if w == full_width else image.resize((w, max(1, round(full_height * w / full_width))),
+                                                           Image.LANCZOS)
+             for w in targets}
+    sources = {}
+    for mime, pil_format, extension, options in formats:
+        entries = []
+        for width in targets:
+            output = f"{stem}-{width}.{extension}"
+            temp = f"{output}.{os.getpid()}.tmp"
+            sizes[width].save(temp, format=pil_format, **options)
+            os.replace(temp, output)
+            entries.append((os.path.basename(output), width))
+        sources[mime] = entries
+    return {'width': full_width, 'height': full_height, 'sources': sources}
+
+
+def generate_variants(paths, publish, timeout=IMAGE_VARIANT_TIMEOUT):
+    """Render variants for each PNG in paths; returns a list aligned with paths.
+
+    publish(path) stores a rendered file and returns the URL to serve it from.
+    Each entry is {'sources': [{'type', 'srcset'}], 'full': url, 'width', 'height'},
+    or None where variants are unavailable or didn't finish within timeout.
+    """
+    formats = available_formats()
+    if not IMAGE_VARIANTS_ENABLED or not formats or not paths:
+        return [None] * len(paths)
+
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(render_variants, path, IMAGE_VARIANT_WIDTHS, formats) for path in paths]
+    except Exception as e:
+        logger.warning(f"Image variant pool unavailable: {e}")
+        if isinstance(e, BrokenProcessPool):
+            _discard_pool()
+        return [None] * len(paths)
+
+    wait(futures, timeout=timeout)
+    results = []
+    for path, future in zip(paths, futures):
+        if not future.done():
+            future.cancel()
+            logger.warning(f"Image variants for {os.path.basename(path)} not ready after {timeout}s")
+            results.append(None)
+            continue
+        try:
+            rendered = future.result()
+            directory = os.path.dirname(path)
+            urls = {mime: [(publish(os.path.join(directory, name)), width) for name, width in entries]
+                    for mime, entries in rendered['sources'].items()}
+        except Exception as e:
+            logger.warning(f"Image variants for {os.path.basename(path)} failed: {e}")
+            if isinstance(e, BrokenProcessPool):
+                _discard_pool()
+            results.append(None)
+            continue
+        sources = [{'type': mime, 'srcset': ', '.join(f"{url} {width}w" for url, width in entries)}
+                   for mime, entries in urls.items()]
+        # The lightbox shows the full-size WebP, which every current browser can decode
+        full = urls.get('image/webp') or next(iter(urls.values()))
+        results.append({
+            'sources': sources,
+            'full': full[-1][0],
+            'width': rendered['width'],
+            'height': rendered['height'],
+        })
+    return results
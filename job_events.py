@@ -0,0 +1,95 @@
+"""
+Progress events for slideshow jobs
+The slideshow worker appends events (stage changes, each scene as soon as it is stored) to a table,
+and the status page follows them over SSE or long-poll. Readers in the same process as the worker
+are woken the moment an event is committed; readers of external workers poll the table.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from models import db, SlideshowJobEvent
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting reader re-checks the table when no in-process worker wakes it
+JOB_EVENT_POLL_SECONDS = float(os.getenv('JOB_EVENT_POLL_SECONDS', '0.5'))
+# Longest a long-poll request waits for news before answering empty
+JOB_EVENT_LONG_POLL_SECONDS = 20
+JOB_EVENT_TTL = timedelta(days=1)
+
+_changed = threading.Condition()
+
+
+def publish(job_id, event, data=None):
+    """Append an event and wake readers in this process; commits the session"""
+    row = SlideshowJobEvent(job_id=job_id, event=event, data=json.dumps(data or {}))
+    try:
+        db.session.add(row)
+        db.session.commit()
+    except Exception as e:  # progress is best effort; the job result is what counts
+        db.session.rollback()
+        logger.warning(f"Could not record {event} event for job {job_id}: {e}")
+        return None
+    notify()
+    return row.id
+
+
+def notify():
+    """Wake readers waiting in this process (after an event, or a job finishing)"""
+    with _changed:
+        _changed.notify_all()
+
+
+def events_after(job_id, after_id=0, limit=100):
+    """Events of a job with an id above after_id, oldest first"""
+    rows = (SlideshowJobEvent.query
+            .filter(SlideshowJobEvent.job_id == job_id, SlideshowJobEvent.id > after_id)
+            .order_by(SlideshowJobEvent.id).limit(limit).all())
+    return [{'id': row.id, 'event': row.event, 'data': json.loads(row.data) if row.data else {}} for row in rows]
+
+
+def wait(timeout):
+    """Sleep until an event is published in this process, or timeout"""
+    with _changed:
+        _changed.wait(timeout)
+
+
+def follow(job_id, after_id, job_state, timeout, poll_interval=JOB_EVENT_POLL_SECONDS):
+    """Wait for a job's next events: returns (events, state) as soon as either is available.
+
+    job_state() returns None while the job is pending or running, and the
+    terminal event (name, data) once it has finished. events is empty when
+    timeout passes with no news.
+    """
+    stop_at = time.monotonic() + timeout
+    while True:
+        # State first: once it is terminal, every event was committed before it
+        state = job_state()
+        events = events_after(job_id, after_id)
+        # Return the connection to the pool while waiting
+        db.session.rollback()
+        if events or state is not None:
+            return events, state
+        remaining = stop_at - time.monotonic()
+        if remaining <= 0:
+            return [], None
+        wait(min(poll_interval, remaining))
+
+
+def purge_old(ttl=JOB_EVENT_TTL):
+    """Delete events of jobs long finished"""
+    try:
+        deleted = (SlideshowJobEvent.query
+                   .filter(SlideshowJobEvent.created_at < datetime.utcnow() - ttl)
+                   .delete(synchronize_session=False))
+        db.session.commit()
+        return deleted
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Job event purge failed: {e}")
+        return 0
@@ -0,0 +1,280 @@
+"""
+Durable, database-backed job queue for slideshow generation
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL,
+or a compare-and-set UPDATE on SQLite, taking users' jobs in weighted fair order
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+from models import db, SlideshowJob, User
+from work_pool import wait_stats
+import fair_queue
+import job_events
+
+logger = logging.getLogger(__name__)
+
+SLIDESHOW_WORKER_POLL = float(os.getenv('SLIDESHOW_WORKER_POLL', '1.0'))
+SLIDESHOW_JOB_STALE_SECONDS = int(os.getenv('SLIDESHOW_JOB_STALE_SECONDS', '600'))
+SLIDESHOW_JOB_MAX_ATTEMPTS = int(os.getenv('SLIDESHOW_JOB_MAX_ATTEMPTS', '2'))
+# Job loops per worker process
+SLIDESHOW_WORKER_THREADS = int(os.getenv('SLIDESHOW_WORKER_THREADS', '1'))
+# How far back a user's started jobs count against their fair share
+FAIR_SHARE_WINDOW = timedelta(seconds=int(os.getenv('FAIR_SHARE_WINDOW_SECONDS', '600')))
+
+# Stale running jobs are checked every this many polls
+STALE_CHECK_EVERY = 30
+
+ACTIVE_STATUSES = (SlideshowJob.STATUS_QUEUED, SlideshowJob.STATUS_RUNNING)
+
+
+class JobError(Exception):
+    """A job failure whose message is safe to show to the user"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue(job_id, user_id, payload):
+    """Insert a queued job and return it"""
+    job = SlideshowJob(
+        id=job_id,
+        user_id=user_id,
+        status=SlideshowJob.STATUS_QUEUED,
+        payload=json.dumps(payload),
+        attempts=0,
+        created_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def get_job(job_id):
+    return db.session.get(SlideshowJob, job_id)
+
+
+def count_active_jobs(user_id):
+    """Jobs a user has queued or running (they count against the slideshow quota)"""
+    return SlideshowJob.query.filter(
+        SlideshowJob.user_id == user_id,
+        SlideshowJob.status.in_(ACTIVE_STATUSES)
+    ).count()
+
+
+def queue_depth():
+    return SlideshowJob.query.filter_by(status=SlideshowJob.STATUS_QUEUED).count()
+
+
+def _mark_claimed(job, worker_id):
+    job.status = SlideshowJob.STATUS_RUNNING
+    job.worker_id = worker_id
+    job.claimed_at = datetime.utcnow()
+    job.attempts = (job.attempts or 0) + 1
+
+
+def next_fair_job_id(window=FAIR_SHARE_WINDOW):
+    """The queued job to run next: weighted fair across users, oldest first within a user.
+
+    Each user with queued jobs is a flow whose service is the jobs they have
+    running or started within the window; the user with the smallest finish
+    tag (service / tier weight) goes next.
+    """
+    heads = (db.session.query(SlideshowJob.user_id, func.min(SlideshowJob.created_at), User.is_paid)
+             .join(User, User.id == SlideshowJob.user_id)
+             .filter(SlideshowJob.status == SlideshowJob.STATUS_QUEUED)
+             .group_by(SlideshowJob.user_id, User.is_paid)
+             .all())
+    if not heads:
+        return None
+    cutoff = datetime.utcnow() - window
+    served = dict(db.session.query(SlideshowJob.user_id, func.count(SlideshowJob.id))
+                  .filter(SlideshowJob.user_id.in_([user_id for user_id, _, _ in heads]),
+                          or_(SlideshowJob.status == SlideshowJob.STATUS_RUNNING,
+                              SlideshowJob.claimed_at >= cutoff))
+                  .group_by(SlideshowJob.user_id)
+                  .all())
+    user_id, _, _ = min(heads, key=lambda head: (
+        fair_queue.finish_tag(served.get(head[0], 0), fair_queue.tier_for(head[2])), head[1]))
+    job_id = (db.session.query(SlideshowJob.id)
+              .filter_by(user_id=user_id, status=SlideshowJob.STATUS_QUEUED)
+              .order_by(SlideshowJob.created_at)
+              .first())
+    return job_id[0] if job_id else None
+
+
+def claim_next(worker_id):
+    """Atomically claim the next queued job (see next_fair_job_id), or return None"""
+    for _ in range(5):
+        job_id = next_fair_job_id()
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        if db.engine.dialect.name == 'postgresql':
+            job = (SlideshowJob.query
+                   .filter_by(id=job_id, status=SlideshowJob.STATUS_QUEUED)
+                   .with_for_update(skip_locked=True)
+                   .first())
+            if job is None:
+                db.session.rollback()
+                continue
+            _mark_claimed(job, worker_id)
+            db.session.commit()
+            return job
+
+        # SQLite has no row locks: claim the candidate only if it is still queued
+        claimed = (SlideshowJob.query
+                   .filter_by(id=job_id, status=SlideshowJob.STATUS_QUEUED)
+                   .update({
+                       'status': SlideshowJob.STATUS_RUNNING,
+                       'worker_id': worker_id,
+                       'claimed_at': datetime.utcnow(),
+                       'attempts': SlideshowJob.attempts + 1,
+                   }, synchronize_session=False))
+        db.session.commit()
+        if claimed == 1:
+            return get_job(job_id)
+    return None
+
+
+def queue_wait_stats(window=timedelta(hours=1)):
+    """p50/p95 time from enqueue to claim per tier, over jobs claimed within the window"""
+    rows = (db.session.query(SlideshowJob.created_at, SlideshowJob.claimed_at, User.is_paid)
+            .join(User, User.id == SlideshowJob.user_id)
+            .filter(SlideshowJob.claimed_at >= datetime.utcnow() - window)
+            .all())
+    waits = {fair_queue.TIER_FREE: [], fair_queue.TIER_PAID: []}
+    for created_at, claimed_at, is_paid in rows:
+        if created_at is not None:
+            waits[fair_queue.tier_for(is_paid)].append((claimed_at - created_at).total_seconds())
+    return {tier: dict(jobs=len(samples), **wait_stats(samples)) for tier, samples in waits.items()}
+
+
+def discard_upload(job):
+    """Delete the staged upload a job ran from; called once the job can't run again"""
+    upload_path = job_payload(job).get('upload_path')
+    if not upload_path:
+        return
+    try:
+        os.remove(upload_path)
+    except OSError:
+        pass
+
+
+def complete(job, result):
+    job.status = SlideshowJob.STATUS_DONE
+    job.result = json.dumps(result)
+    job.error = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    discard_upload(job)
+    job_events.notify()
+
+
+def fail(job, message):
+    job.status = SlideshowJob.STATUS_FAILED
+    job.error = message
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    discard_upload(job)
+    job_events.notify()
+
+
+def requeue_stale(stale_seconds=SLIDESHOW_JOB_STALE_SECONDS, max_attempts=SLIDESHOW_JOB_MAX_ATTEMPTS):
+    """Recover jobs whose worker died mid-run: retry them, or fail them after max_attempts"""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    stale = SlideshowJob.query.filter(
+        SlideshowJob.status == SlideshowJob.STATUS_RUNNING,
+        SlideshowJob.claimed_at < cutoff
+    ).all()
+    failed = []
+    for job in stale:
+        if (job.attempts or 0) >= max_attempts:
+            job.status = SlideshowJob.STATUS_FAILED
+            job.error = 'Slideshow generation timed out. Please try again.'
+            job.finished_at = datetime.utcnow()
+            failed.append(job)
+        else:
+            job.status = SlideshowJob.STATUS_QUEUED
+            job.worker_id = None
+    db.session.commit()
+    for job in failed:
+        discard_upload(job)
+    return len(stale)
+
+
+def job_payload(job):
+    return json.loads(job.payload) if job.payload else {}
+
+
+def job_result(job):
+    return json.loads(job.result) if job.result else None
+
+
+def run_job(job, handler):
+    """Run one claimed job through handler(job) -> result dict and record the outcome"""
+    started = time.monotonic()
+    try:
+        result = handler(job)
+        complete(job, result)
+        logger.info(f"Slideshow job {job.id} done in {time.monotonic() - started:.1f}s")
+    except JobError as e:
+        db.session.rollback()
+        fail(job, str(e))
+        logger.info(f"Slideshow job {job.id} failed: {e}")
+    except Exception as e:
+        db.session.rollback()
+        fail(job, 'Slideshow generation failed. Please try again.')
+        logger.exception(f"Slideshow job {job.id} crashed: {e}")
+
+
+def run_worker(app, handler, worker_id=None, poll_interval=SLIDESHOW_WORKER_POLL, stop_event=None, max_jobs=None):
+    """Claim and run jobs until stop_event is set (or max_jobs have been processed)"""
+    worker_id = worker_id or default_worker_id()
+    stop_event = stop_event or threading.Event()
+    processed = 0
+    polls = 0
+    logger.info(f"Slideshow worker {worker_id} started")
+
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                if polls % STALE_CHECK_EVERY == 0:
+                    requeue_stale()
+                    job_events.purge_old()
+                polls += 1
+
+                job = claim_next(worker_id)
+                if job is None:
+                    stop_event.wait(poll_interval)
+                    continue
+                run_job(job, handler)
+                processed += 1
+        except Exception as e:
+            logger.exception(f"Slideshow worker loop error: {e}")
+            stop_event.wait(poll_interval)
+
+        if max_jobs is not None and processed >= max_jobs:
+            break
+
+    logger.info(f"Slideshow worker {worker_id} stopped after {processed} jobs")
+    return processed
+
+
+def start_workers(app, handler, count=SLIDESHOW_WORKER_THREADS, stop_event=None, name='slideshow-worker'):
+    """Run count worker loops in daemon threads and return the threads"""
+    threads = [threading.Thread(target=run_worker, args=(app, handler), kwargs={'stop_event': stop_event},
+                                name=f"{name}-{i}", daemon=True)
+               for i in range(max(count, 1))]
+    for thread in threads:
+        thread.start()
+    return threads
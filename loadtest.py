@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Load test and latency benchmark for the main PitchAI routes
+Starts mock_upstream.py and gunicorn locally (no network, no API credits), drives
+logged-in virtual users through login, prompt improvement, results and slideshow
+generation, and writes per-route throughput and p50/p95/p99 latency as JSON.
+
+Usage:
+    python loadtest.py                                    # default matrix
+    python loadtest.py --worker-classes gthread sync --workers 1 2 4 --users 20 --duration 30
+    python loadtest.py --compare loadtest_results/before.json loadtest_results/after.json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import shutil
+import signal
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(ROOT, 'loadtest_results')
+PASSWORD = 'loadtest-password'
+
+APP_PROMPTS = [
+    "Build a habit tracker app with streaks and reminders",
+    "Create a recipe sharing site where users can save favourites",
+    "Make a budgeting dashboard that imports bank CSV files",
+    "Build a booking app for a small yoga studio",
+]
+IMAGE_PROMPTS = [
+    "a white sneaker on a sunlit desk",
+    "a glass water bottle at the gym",
+    "a ceramic mug on a cozy kitchen counter",
+    "a leather backpack on a cafe table",
+]
+# A tiny JPEG-looking upload; the mock vision endpoint does not decode it
+PRODUCT_IMAGE = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + os.urandom(2048) + b'\xff\xd9'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples, measured_seconds):
+    """Throughput and latency stats (ms) for a list of (elapsed_seconds, ok, status) samples"""
+    values = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    statuses = {}
+    for _, _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, ok, _ in samples if not ok),
+        'throughput_rps': round(len(samples) / measured_seconds, 2) if measured_seconds else None,
+        'mean_ms': round(sum(values) / len(values), 1) if values else None,
+        'p50_ms': round(percentile(values, 50), 1) if values else None,
+        'p95_ms': round(percentile(values, 95), 1) if values else None,
+        'p99_ms': round(percentile(values, 99), 1) if values else None,
+        'max_ms': round(values[-1], 1) if values else None,
+        'statuses': statuses,
+    }
+
+
+class Recorder:
+    """Thread-safe per-route sample store; samples finishing during warmup are dropped
+    (except logins, which only ever happen during warmup)"""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, elapsed, ok, status, during_warmup=False):
+        if time.monotonic() < self.measure_from and not during_warmup:
+            return
+        with self.lock:
+            self.samples.setdefault(route, []).append((elapsed, ok, status))
+
+
+class VirtualUser(threading.Thread):
+    """One logged-in user looping through the main flow until the deadline"""
+
+    def __init__(self, base_url, email, recorder, deadline, slideshow_weight, think_seconds, seed,
+                 run_index=0, user_index=0):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.email = email
+        self.recorder = recorder
+        self.deadline = deadline
+        self.slideshow_weight = slideshow_weight
+        self.think_seconds = think_seconds
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.run_index = run_index
+        self.user_index = user_index
+        self.prompts_sent = 0
+
+    def prompt_tag(self):
+        """Unique across the runs of a matrix, users and prompts, so no prompt is ever served
+        from the prompt cache; drawn from the seeded rng, so the same --seed sends the same prompts"""
+        self.prompts_sent += 1
+        return f"r{self.run_index}u{self.user_index}-{self.rng.getrandbits(32):08x}-{self.prompts_sent}"
+
+    def request(self, route, method, path, during_warmup=False, **kwargs):
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False,
+                                            timeout=120, **kwargs)
+            status = response.status_code
+            # Being bounced to /login means the session was lost: that is a failure too
+            ok = status < 400 and '/login' not in response.headers.get('Location', '')
+        except requests.RequestException as e:
+            response, status, ok = None, type(e).__name__, False
+        self.recorder.record(route, time.monotonic() - started, ok, status, during_warmup)
+        return response
+
+    def run(self):
+        self.request('/login', 'POST', '/login', during_warmup=True,
+                     data={'email': self.email, 'password': PASSWORD})
+        while time.monotonic() < self.deadline:
+            prompt = f"{self.rng.choice(APP_PROMPTS)} #{self.prompt_tag()}"
+            self.request('/improve-prompt', 'POST', '/improve-prompt', data={'prompt_content': prompt, 'stream': '0'})
+            self.request('/prompt-result', 'GET', '/prompt-result')
+
+            prompt = f"{self.rng.choice(IMAGE_PROMPTS)} #{self.prompt_tag()}"
+            self.request('/improve-image-prompt', 'POST', '/improve-image-prompt',
+                         data={'prompt_content': prompt, 'model': 'midjourney', 'stream': '0'})
+            self.request('/prompt-result', 'GET', '/prompt-result')
+
+            if self.rng.random() < self.slideshow_weight:
+                self.request('/generate-slideshow', 'POST', '/generate-slideshow',
+                             data={'provider': 'imagen'},
+                             files={'product_image': ('product.jpg', PRODUCT_IMAGE, 'image/jpeg')},
+                             headers={'Accept': 'application/json'})
+            if self.think_seconds:
+                time.sleep(self.think_seconds)
+
+
+def seed_users(count, run_id):
+    """Create paid users directly in the load-test database"""
+    import app as app_module
+    from models import db, User
+
+    emails = []
+    with app_module.app.app_context():
+        for i in range(count):
+            user = User()
+            user.email = f"load-{run_id}-{i}@example.com"
+            user.set_password(PASSWORD)
+            user.is_paid = True
+            db.session.add(user)
+            emails.append(user.email)
+        db.session.commit()
+    return emails
+
+
+def start_gunicorn(env, worker_class, workers, threads, port, log_path):
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+        '--worker-class', worker_class, '--workers', str(workers), '--threads', str(threads),
+        '--bind', f'127.0.0.1:{port}', '--access-logfile', os.devnull, '--log-level', 'warning',
+        # gunicorn.conf.py sets FLASK_ENV=production, whose Secure cookies plain HTTP would drop
+        '--env', 'FLASK_ENV=loadtest', '--env', 'FLASK_DEBUG=0',
+        'app:app',
+    ]
+    with open(log_path, 'ab') as log:
+        # The app sizes its stream cap (stream_slots.py) from the thread count
+        return subprocess.Popen(command, cwd=ROOT, env=dict(env, GUNICORN_THREADS=str(threads)),
+                                stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(f"{base_url}/login", timeout=2).status_code < 500:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_once(args, env, worker_class, workers, workdir, run_index=0):
+    """One gunicorn configuration under load; returns its result dict"""
+    run_id = uuid.uuid4().hex[:8]
+    label = f"{worker_class} x{workers}" + (f" ({args.threads} threads)" if worker_class == 'gthread' else '')
+    print(f"▶ {label}: {args.users} users for {args.duration}s (+{args.warmup}s warmup)")
+
+    emails = seed_users(args.users, run_id)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log_path = os.path.join(workdir, f"gunicorn-{worker_class}-{workers}.log")
+    process = start_gunicorn(env, worker_class, workers, args.threads, port, log_path)
+    result = {'worker_class': worker_class, 'workers': workers,
+              'threads': args.threads if worker_class == 'gthread' else 1}
+    try:
+        if not wait_until_ready(base_url, process):
+            print(f"✗ gunicorn did not start, see {log_path}")
+            result['error'] = f"gunicorn did not start (log: {log_path})"
+            return result
+
+        started = time.monotonic()
+        recorder = Recorder(started + args.warmup)
+        deadline = started + args.warmup + args.duration
+        users = [VirtualUser(base_url, email, recorder, deadline, args.slideshow_weight,
+                             args.think_ms / 1000.0, seed=(args.seed or 0) * 1000 + i,
+                             run_index=run_index, user_index=i)
+                 for i, email in enumerate(emails)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        # Requests still in flight at the deadline are included, so measure to the last finish
+        measured = max(args.duration, time.monotonic() - recorder.measure_from)
+
+        all_samples = [s for samples in recorder.samples.values() for s in samples]
+        result['measured_seconds'] = round(measured, 2)
+        result['routes'] = {route: summarize(samples, measured) for route, samples in sorted(recorder.samples.items())}
+        result['total'] = summarize(all_samples, measured)
+        total = result['total']
+        print(f"  {total['count']} requests, {total['throughput_rps']} req/s, "
+              f"p50 {total['p50_ms']}ms, p95 {total['p95_ms']}ms, p99 {total['p99_ms']}ms, {total['errors']} errors")
+        return result
+    finally:
+        stop_process(process)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_mock(args):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import mock_upstream
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    mock_upstream.config.update({
+        'latency_dist': args.mock_latency_dist,
+        'latency_ms': args.mock_latency_ms,
+        'imagen_latency_ms': args.mock_imagen_latency_ms,
+        'error_rate': args.mock_error_rate,
+        'rate_limit_rate': args.mock_429_rate,
+        'image_kb': args.mock_image_kb,
+    })
+    if args.seed is not None:
+        mock_upstream._rng.seed(args.seed)
+    server = make_server('127.0.0.1', free_port(), mock_upstream.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", dict(mock_upstream.config)
+
+
+def run_matrix(args):
+    workdir = tempfile.mkdtemp(prefix='pitchai-loadtest-')
+    mock_server, mock_url, mock_config = start_mock(args)
+
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'MOCK_UPSTREAM_URL': mock_url,
+        'OPENAI_API_KEY': 'mock',
+        'GOOGLE_API_KEY': 'mock',
+        'FLASK_SECRET_KEY': env.get('FLASK_SECRET_KEY') or 'loadtest-secret',
+        'UPLOAD_STAGING_DIR': os.path.join(workdir, 'uploads'),
+        'STORAGE_LOCAL_DIR': os.path.join(workdir, 'generated'),
+        'RATE_LIMIT_FILE': os.path.join(workdir, 'rate_limits.json'),
+        'SINGLEFLIGHT_DIR': os.path.join(workdir, 'singleflight'),
+        'UPSTREAM_PREWARM': '1',
+        # Every prompt is distinct (see prompt_tag); with near-duplicate matching off too,
+        # the improve-prompt routes measure upstream calls rather than cache hits
+        'PROMPT_SIMILARITY_ENABLED': '0',
+    })
+    # The harness seeds users through the app's models, against the same database
+    os.environ.update({key: env[key] for key in ('DATABASE_URL', 'FLASK_SECRET_KEY', 'UPLOAD_STAGING_DIR')})
+
+    report = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'users': args.users,
+            'duration_seconds': args.duration,
+            'warmup_seconds': args.warmup,
+            'slideshow_weight': args.slideshow_weight,
+            'think_ms': args.think_ms,
+            'seed': args.seed,
+            'database': 'custom' if args.database_url else 'sqlite',
+            'mock_upstream': mock_config,
+            'prompt_similarity_enabled': env['PROMPT_SIMILARITY_ENABLED'] == '1',
+            'distinct_prompts': True,
+        },
+        'runs': [],
+    }
+    try:
+        for worker_class in args.worker_classes:
+            for workers in args.workers:
+                report['runs'].append(run_once(args, env, worker_class, workers, workdir,
+                                               run_index=len(report['runs'])))
+    finally:
+        mock_server.shutdown()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def compare(before_path, after_path):
+    """Print per-route p50/p95/throughput changes between two result files"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def key(run):
+        return (run['worker_class'], run['workers'], run['threads'])
+
+    before_runs = {key(run): run for run in before['runs']}
+    for run in after['runs']:
+        old = before_runs.get(key(run))
+        if old is None or 'routes' not in run or 'routes' not in old:
+            continue
+        print(f"\n{run['worker_class']} x{run['workers']} ({run['threads']} threads)")
+        print(f"  {'route':<24}{'p50 ms':>18}{'p95 ms':>18}{'req/s':>16}{'errors':>12}")
+        for route in sorted(set(run['routes']) | {'total'}):
+            new_stats = run['total'] if route == 'total' else run['routes'].get(route)
+            old_stats = old['total'] if route == 'total' else old['routes'].get(route)
+            if not new_stats or not old_stats:
+                continue
+
+            def cell(field):
+                a, b = old_stats.get(field), new_stats.get(field)
+                if a is None or b is None:
+                    return 'n/a'
+                change = f"{(b - a) / a * 100:+.0f}%" if a else ''
+                return f"{a:g}→{b:g} {change}"
+
+            print(f"  {route:<24}{cell('p50_ms'):>18}{cell('p95_ms'):>18}{cell('throughput_rps'):>16}"
+                  f"{old_stats['errors']:>5}→{new_stats['errors']:<5}")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the main PitchAI routes against mocked upstreams')
+    parser.add_argument('--worker-classes', nargs='+', default=['gthread', 'sync'])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--threads', type=int, default=int(os.getenv('GUNICORN_THREADS', 8)))
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of load before measuring')
+    parser.add_argument('--think-ms', type=float, default=0, help='pause between iterations per user')
+    parser.add_argument('--slideshow-weight', type=float, default=0.2,
+                        help='chance per iteration that a user also submits a slideshow')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    parser.add_argument('--mock-latency-dist', default='lognormal')
+    parser.add_argument('--mock-latency-ms', type=float, default=300)
+    parser.add_argument('--mock-imagen-latency-ms', type=float, default=2000)
+    parser.add_argument('--mock-error-rate', type=float, default=0)
+    parser.add_argument('--mock-429-rate', type=float, default=0)
+    parser.add_argument('--mock-image-kb', type=int, default=200)
+    parser.add_argument('--output', help='result file (default loadtest_results/<timestamp>.json)')
+    parser.add_argument('--keep-workdir', action='store_true', help='keep gunicorn logs and the test database')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        return compare(*args.compare)
+
+    report = run_matrix(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 0 if all('error' not in run for run in report['runs']) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
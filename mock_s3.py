@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an S3-compatible bucket, for trying STORAGE_BACKEND=s3 without AWS or MinIO
+Keeps objects in memory and serves the path-style PutObject, GetObject, HeadObject and
+DeleteObject calls storage.py makes. Signatures aren't checked, so presigned URLs always work
+(and never expire); response-content-disposition and response-content-type are honoured.
+
+Run it, then point the app at it:
+    python mock_s3.py
+    STORAGE_BACKEND=s3 S3_BUCKET=generated S3_ENDPOINT_URL=http://127.0.0.1:9099 \\
+        AWS_ACCESS_KEY_ID=mock AWS_SECRET_ACCESS_KEY=mock python app.py
+"""
+
+import os
+import sys
+import hashlib
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from flask import Flask, request, Response
+
+app = Flask(__name__)
+
+_objects = {}  # (bucket, key) -> {'body', 'content_type', 'cache_control', 'etag', 'modified'}
+_objects_lock = threading.Lock()
+
+
+def _error(code, status, message=''):
+    body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+            f'<Message>{message or code}</Message></Error>')
+    return Response(body if request.method != 'HEAD' else '', status=status, mimetype='application/xml')
+
+
+def decode_aws_chunked(data):
+    """Body of an aws-chunked upload (what newer botocore sends with flexible checksums)"""
+    body = bytearray()
+    position = 0
+    while True:
+        line_end = data.index(b'\r\n', position)
+        size = int(data[position:line_end].split(b';')[0], 16)
+        position = line_end + 2
+        if size == 0:
+            return bytes(body)  # trailing checksum headers follow
+        body += data[position:position + size]
+        position += size + 2
+
+
+def _headers(obj):
+    return {
+        'ETag': obj['etag'],
+        'Last-Modified': format_datetime(obj['modified'], usegmt=True),
+        'Content-Type': request.args.get('response-content-type') or obj['content_type'],
+        'Cache-Control': obj['cache_control'] or '',
+        'Content-Length': str(len(obj['body'])),
+    }
+
+
+@app.route('/<bucket>/<path:key>', methods=['PUT', 'GET', 'HEAD', 'DELETE'])
+def mock_object(bucket, key):
+    if request.method == 'PUT':
+        if 'uploadId' in request.args or 'partNumber' in request.args:
+            return _error('NotImplemented', 501, 'Multipart uploads are not supported by the mock')
+        data = request.get_data()
+        if ('aws-chunked' in request.headers.get('Content-Encoding', '')
+                or request.headers.get('x-amz-content-sha256', '').startswith('STREAMING-')):
+            data = decode_aws_chunked(data)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with _objects_lock:
+            _objects[(bucket, key)] = {
+                'body': data,
+                'content_type': request.headers.get('Content-Type', 'binary/octet-stream'),
+                'cache_control': request.headers.get('Cache-Control'),
+                'etag': etag,
+                'modified': datetime.now(timezone.utc),
+            }
+        return Response('', status=200, headers={'ETag': etag})
+
+    if request.method == 'DELETE':
+        with _objects_lock:
+            _objects.pop((bucket, key), None)
+        return Response('', status=204)
+
+    with _objects_lock:
+        obj = _objects.get((bucket, key))
+    if obj is None:
+        return _error('NoSuchKey', 404, 'The specified key does not exist.')
+    headers = _headers(obj)
+    if request.args.get('response-content-disposition'):
+        headers['Content-Disposition'] = request.args['response-content-disposition']
+    if request.headers.get('If-None-Match') == obj['etag']:
+        return Response(status=304, headers={'ETag': obj['etag']})
+    if request.method == 'HEAD':
+        response = Response(status=200, headers=headers)
+        response.automatically_set_content_length = False
+        return response
+    return Response(obj['body'], status=200, headers=headers)
+
+
+def main():
+    port = int(os.getenv('MOCK_S3_PORT', '9099'))
+    print(f"Mock S3 listening on http://127.0.0.1:{port} (any bucket name works)")
+    print(f"Point the app at it with STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:{port}")
+    app.run(host=os.getenv('MOCK_HOST', '127.0.0.1'), port=port, threaded=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
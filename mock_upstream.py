@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI and Imagen APIs, for load tests and benchmarks
+Serves the /v1/chat/completions and :predict shapes app.py uses, with configurable
+latency, error/429 injection and payload sizes, and never spends API credits.
+
+Run it, then point the app at it:
+    python mock_upstream.py
+    MOCK_UPSTREAM_URL=http://127.0.0.1:8099 OPENAI_API_KEY=mock GOOGLE_API_KEY=mock python app.py
+
+Settings come from MOCK_* environment variables and can be changed while it runs:
+    curl -X POST localhost:8099/mock/config -H 'Content-Type: application/json' -d '{"error_rate": 0.1}'
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import base64
+import random
+import struct
+import threading
+from flask import Flask, request, jsonify, Response, stream_with_context
+
+DEFAULT_CONFIG = {
+    # Latency before the response (ms): fixed | uniform | normal | lognormal | exponential
+    'latency_dist': os.getenv('MOCK_LATENCY_DIST', 'lognormal'),
+    'latency_ms': float(os.getenv('MOCK_LATENCY_MS', '800')),
+    # uniform: +/- width, normal: stddev, lognormal: sigma of the underlying normal
+    'latency_jitter': float(os.getenv('MOCK_LATENCY_JITTER', '0.5')),
+    'imagen_latency_ms': float(os.getenv('MOCK_IMAGEN_LATENCY_MS', '6000')),
+    # Delay between streamed chunks (ms), after the first one
+    'stream_chunk_ms': float(os.getenv('MOCK_STREAM_CHUNK_MS', '20')),
+    # Fraction of requests answered with a 500/503, or with a 429 + Retry-After
+    'error_rate': float(os.getenv('MOCK_ERROR_RATE', '0')),
+    'rate_limit_rate': float(os.getenv('MOCK_429_RATE', '0')),
+    'retry_after': float(os.getenv('MOCK_RETRY_AFTER', '1')),
+    # Payload sizes
+    'completion_words': int(os.getenv('MOCK_COMPLETION_WORDS', '150')),
+    'image_kb': int(os.getenv('MOCK_IMAGE_KB', '1500')),
+}
+
+WORDS = ('vivid detailed modern clean minimal natural soft light product scene user flow '
+         'responsive layout dashboard onboarding gradient texture camera angle close-up '
+         'warm tone authentic creator handheld cinematic composition background').split()
+
+app = Flask(__name__)
+config = dict(DEFAULT_CONFIG)
+_config_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+_png_cache = {}
+_rng = random.Random(int(os.getenv('MOCK_SEED')) if os.getenv('MOCK_SEED') else None)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] = _stats.get(name, 0) + 1
+
+
+def current_config():
+    with _config_lock:
+        return dict(config)
+
+
+def sample_latency(mean_ms, cfg):
+    """One latency sample in seconds from the configured distribution"""
+    dist, jitter = cfg['latency_dist'], cfg['latency_jitter']
+    if dist == 'fixed':
+        ms = mean_ms
+    elif dist == 'uniform':
+        ms = _rng.uniform(mean_ms * (1 - jitter), mean_ms * (1 + jitter))
+    elif dist == 'normal':
+        ms = _rng.gauss(mean_ms, mean_ms * jitter)
+    elif dist == 'exponential':
+        ms = _rng.expovariate(1.0 / mean_ms) if mean_ms > 0 else 0
+    else:  # lognormal: mean_ms is the median, long right tail like real APIs
+        ms = _rng.lognormvariate(math.log(mean_ms), jitter) if mean_ms > 0 else 0
+    return max(0.0, ms) / 1000.0
+
+
+def injected_failure(cfg, name):
+    """A 429 or 5xx response if this request was picked for failure injection, else None"""
+    roll = _rng.random()
+    if roll < cfg['rate_limit_rate']:
+        _count(f'{name}.429')
+        response = jsonify({'error': {'message': 'Rate limit reached (mock)', 'type': 'rate_limit_error'}})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(cfg['retry_after'])
+        return response
+    if roll < cfg['rate_limit_rate'] + cfg['error_rate']:
+        _count(f'{name}.5xx')
+        response = jsonify({'error': {'message': 'Upstream error (mock)', 'type': 'server_error'}})
+        response.status_code = _rng.choice((500, 503))
+        return response
+    return None
+
+
+def completion_text(payload, cfg):
+    """Body text for a chat completion, shaped by the request"""
+    if (payload.get('response_format') or {}).get('type') == 'json_object':
+        user_text = ' '.join(m['content'] if isinstance(m['content'], str) else
+                             ' '.join(p.get('text', '') for p in m['content'] if p.get('type') == 'text')
+                             for m in payload.get('messages', []) if m.get('role') == 'user')
+        match = re.search(r'exactly (\d+)', user_text)
+        count = int(match.group(1)) if match else 4
+        words = max(10, cfg['completion_words'] // max(1, count))
+        return json.dumps({'scenes': [f"Scene {i + 1}: " + ' '.join(_rng.choice(WORDS) for _ in range(words))
+                                      for i in range(count)]})
+    return ' '.join(_rng.choice(WORDS) for _ in range(cfg['completion_words']))
+
+
+def make_png(size_kb):
+    """A valid RGB PNG of roughly size_kb (random pixels barely compress)"""
+    cached = _png_cache.get(size_kb)
+    if cached is not None:
+        return cached
+    side = max(1, int(math.sqrt(size_kb * 1024 / 3)))
+    rows = b''.join(b'\x00' + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    png = (b'\x89PNG\r\n\x1a\n'
+           + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+           + chunk(b'IDAT', zlib.compress(rows, 1))
+           + chunk(b'IEND', b''))
+    _png_cache[size_kb] = png
+    return png
+
+
+def unauthorized(header):
+    if not request.headers.get(header):
+        return jsonify({'error': {'message': f'Missing {header} header (mock)'}}), 401
+    return None
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    denied = unauthorized('Authorization')
+    if denied:
+        return denied
+    cfg = current_config()
+    payload = request.get_json(silent=True) or {}
+    name = 'chat.stream' if payload.get('stream') else 'chat'
+    _count(name)
+
+    time.sleep(sample_latency(cfg['latency_ms'], cfg))
+    failure = injected_failure(cfg, name)
+    if failure is not None:
+        return failure
+
+    model = payload.get('model', 'gpt-4o-mini')
+    text = completion_text(payload, cfg)
+    completion_id = f"chatcmpl-mock{_rng.getrandbits(48):x}"
+
+    if payload.get('stream'):
+        def generate():
+            pieces = re.findall(r'\S+\s*', text)
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(cfg['stream_chunk_ms'] / 1000.0)
+                chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                         'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                     'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+    prompt_chars = len(json.dumps(payload.get('messages', [])))
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_chars // 4, 'completion_tokens': len(text) // 4,
+                  'total_tokens': prompt_chars // 4 + len(text) // 4},
+    })
+
+
+@app.route('/v1beta/models/<model>:predict', methods=['POST'])
+def imagen_predict(model):
+    denied = unauthorized('x-goog-api-key')
+    if denied:
+        return denied
+    cfg = current_config()
+    payload = request.get_json(silent=True) or {}
+    _count('imagen')
+
+    time.sleep(sample_latency(cfg['imagen_latency_ms'], cfg))
+    failure = injected_failure(cfg, 'imagen')
+    if failure is not None:
+        return failure
+
+    samples = int((payload.get('parameters') or {}).get('sampleCount', 1))
+    image_b64 = base64.b64encode(make_png(cfg['image_kb'])).decode('ascii')
+    return jsonify({'predictions': [{'bytesBase64Encoded': image_b64, 'mimeType': 'image/png'}
+                                    for _ in range(max(1, samples))]})
+
+
+@app.route('/mock/config', methods=['GET', 'POST'])
+def mock_config():
+    """Read or update the live settings (POST a JSON object of keys to change, or {"reset": true})"""
+    if request.method == 'POST':
+        updates = request.get_json(silent=True) or {}
+        reset = updates.pop('reset', False)
+        unknown = sorted(set(updates) - set(DEFAULT_CONFIG))
+        if unknown:
+            return jsonify({'error': f"Unknown settings: {', '.join(unknown)}"}), 400
+        with _config_lock:
+            if reset:
+                config.clear()
+                config.update(DEFAULT_CONFIG)
+            for key, value in updates.items():
+                config[key] = type(DEFAULT_CONFIG[key])(value)
+    return jsonify(current_config())
+
+
+@app.route('/mock/stats', methods=['GET', 'DELETE'])
+def mock_stats():
+    """Request and injected-failure counts since start (DELETE resets them)"""
+    with _stats_lock:
+        if request.method == 'DELETE':
+            _stats.clear()
+        return jsonify(dict(_stats))
+
+
+@app.route('/', methods=['GET', 'HEAD'])
+def mock_root():
+    # Answers the upstream client's connection pre-warm
+    return jsonify({'mock': True})
+
+
+def main():
+    port = int(os.getenv('MOCK_PORT', '8099'))
+    print(f"Mock upstream listening on http://127.0.0.1:{port}")
+    print(f"Point the app at it with MOCK_UPSTREAM_URL=http://127.0.0.1:{port}")
+    app.run(host=os.getenv('MOCK_HOST', '127.0.0.1'), port=port, threaded=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -120,4 +120,102 @@ class User(UserMixin, db.Model):
     def get_remaining_slideshows(self):
         self._reset_slideshow_if_needed()
         limit = self.PAID_SLIDESHOW_LIMIT if self.is_paid else self.FREE_SLIDESHOW_LIMIT
-        return max(0, limit - self.slideshow_generations_used)
\ No newline at end of file
+        return max(0, limit - self.slideshow_generations_used)
+
+class PromptCacheEntry(db.Model):
+    """Shared (cross-worker) tier of the prompt improvement cache"""
+    __tablename__ = 'prompt_cache'
+
+    cache_key = db.Column(db.String(64), primary_key=True)
+    tool_type = db.Column(db.String(32))
+    model_key = db.Column(db.String(32))
+    analysis = db.Column(db.Text)
+    improved = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
+    hit_count = db.Column(db.Integer, default=0)
+
+
+class PromptSignature(db.Model):
+    """MinHash signature of an improved prompt, for near-duplicate lookups"""
+    __tablename__ = 'prompt_signature'
+
+    cache_key = db.Column(db.String(64), primary_key=True)  # PromptCacheEntry holding the result
+    scope = db.Column(db.String(64), index=True)  # tool type, model and system prompt version
+    prompt = db.Column(db.Text)                    # shown when the result is offered for a similar prompt
+    signature = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, index=True)
+
+
+class ImageAnalysis(db.Model):
+    """GPT-4o description of a product photo, found again by perceptual hash"""
+    __tablename__ = 'image_analysis'
+
+    id = db.Column(db.Integer, primary_key=True)
+    phash = db.Column(db.BigInteger, index=True)  # 64-bit DCT hash, stored signed
+    color = db.Column(db.String(24))              # hue histogram (image_cache.color_signature)
+    scope = db.Column(db.String(64), index=True)  # vision model and instructions
+    description = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, index=True)
+
+
+class SlideshowJob(db.Model):
+    """Queued slideshow generation, claimed and run by a slideshow worker"""
+    __tablename__ = 'slideshow_job'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True, nullable=False)
+    status = db.Column(db.String(16), default=STATUS_QUEUED, index=True, nullable=False)
+    payload = db.Column(db.Text)  # JSON job input
+    result = db.Column(db.Text)   # JSON slideshow_result once done
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    worker_id = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class SlideshowJobEvent(db.Model):
+    """Progress event of a slideshow job (stage change or finished scene), read by the status page"""
+    __tablename__ = 'slideshow_job_event'
+
+    id = db.Column(db.Integer, primary_key=True)  # also the stream cursor (SSE event id)
+    job_id = db.Column(db.String(32), index=True, nullable=False)
+    event = db.Column(db.String(32), nullable=False)
+    data = db.Column(db.Text)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class GeneratedAsset(db.Model):
+    """A generated slideshow file (PNG or variant) and where its content lives in storage"""
+    __tablename__ = 'generated_asset'
+    __table_args__ = (db.UniqueConstraint('batch_id', 'filename'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(32), index=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    filename = db.Column(db.String(128), nullable=False)  # name the user sees and downloads
+    backend = db.Column(db.String(16), nullable=False)    # 'local' or 's3'
+    storage_key = db.Column(db.String(128), index=True, nullable=False)  # content-addressed key
+    content_type = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    sha256 = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class StorageUsage(db.Model):
+    """Running total of a user's generated-image bytes, kept in step with GeneratedAsset rows"""
+    __tablename__ = 'storage_usage'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    bytes = db.Column(db.BigInteger, default=0, nullable=False)
+    assets = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
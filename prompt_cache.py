@@ -0,0 +1,192 @@
+"""
+Content-addressed cache for AI prompt improvement results
+Tier 1 is an in-process LRU with TTL, tier 2 is a SQLAlchemy table shared by every gunicorn worker
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from models import db, PromptCacheEntry
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', '2048'))
+PROMPT_CACHE_TTL = int(os.getenv('PROMPT_CACHE_TTL', str(6 * 3600)))
+PROMPT_CACHE_DB_TTL = int(os.getenv('PROMPT_CACHE_DB_TTL', str(7 * 24 * 3600)))
+PROMPT_CACHE_DB = os.getenv('PROMPT_CACHE_DB', '1') == '1'
+
+# Expired DB rows are purged once every this many stores
+PURGE_EVERY = 200
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    """Canonical form of a prompt: NFKC, trimmed, whitespace collapsed"""
+    prompt = unicodedata.normalize('NFKC', prompt or '')
+    return _whitespace.sub(' ', prompt).strip()
+
+
+def prompt_version(*payloads):
+    """Hash everything about the upstream requests except the user's prompt.
+
+    Editing a system prompt, model, max_tokens or temperature changes the
+    version, so stale improvements are never served after a deploy.
+    """
+    fingerprint = []
+    for payload in payloads:
+        stripped = {k: v for k, v in payload.items() if k != 'messages'}
+        stripped['system'] = [m['content'] for m in payload.get('messages', []) if m.get('role') == 'system']
+        fingerprint.append(stripped)
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def make_key(prompt, tool_type, model_key, version):
+    """Cache key for a normalized prompt, tool type, model and system prompt version"""
+    raw = '\x1f'.join([tool_type or '', model_key or '', version or '', normalize_prompt(prompt)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class PromptCache:
+    """Two-tier (memory LRU + database) cache of (analysis, improved) pairs"""
+
+    def __init__(self, max_entries=PROMPT_CACHE_MAX_ENTRIES, ttl=PROMPT_CACHE_TTL,
+                 db_ttl=PROMPT_CACHE_DB_TTL, use_db=PROMPT_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_ttl = db_ttl
+        self.use_db = use_db
+        self._entries = OrderedDict()  # key -> (expires_at monotonic, (analysis, improved))
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'db_errors': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _memory_get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._counters['expirations'] += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _memory_set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def get(self, key, record_stats=True):
+        """Return a cached (analysis, improved) tuple or None"""
+        value = self._memory_get(key)
+        if value is not None:
+            if record_stats:
+                self._count('memory_hits')
+            return value
+
+        if self.use_db:
+            try:
+                entry = db.session.get(PromptCacheEntry, key)
+                if entry is not None and entry.expires_at > datetime.utcnow():
+                    value = (entry.analysis, entry.improved)
+                    entry.hit_count = (entry.hit_count or 0) + 1
+                    db.session.commit()
+                    # Never keep it in memory longer than the shared row lives
+                    remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+                    self._memory_set(key, value, ttl=min(self.ttl, max(1, remaining)))
+                    if record_stats:
+                        self._count('db_hits')
+                    return value
+            except Exception as e:
+                db.session.rollback()
+                self._count('db_errors')
+                logger.warning(f"Prompt cache DB read failed: {e}")
+
+        if record_stats:
+            self._count('misses')
+        return None
+
+    def set(self, key, analysis, improved, tool_type=None, model_key=None, record_stats=True):
+        """Store a result in both tiers"""
+        value = (analysis, improved)
+        self._memory_set(key, value)
+        # Only counted stores pace the purge; uncounted ones (stream results) never trigger it
+        purge_due = False
+        if record_stats:
+            self._count('stores')
+            purge_due = self._counters['stores'] % PURGE_EVERY == 0
+
+        if not self.use_db:
+            return
+        try:
+            entry = PromptCacheEntry(
+                cache_key=key,
+                tool_type=tool_type,
+                model_key=model_key,
+                analysis=analysis,
+                improved=improved,
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=self.db_ttl),
+                hit_count=0,
+            )
+            db.session.merge(entry)
+            db.session.commit()
+            if purge_due:
+                self.purge_expired()
+        except Exception as e:
+            db.session.rollback()
+            self._count('db_errors')
+            logger.warning(f"Prompt cache DB write failed: {e}")
+
+    def purge_expired(self):
+        """Delete expired rows from the shared tier"""
+        try:
+            deleted = PromptCacheEntry.query.filter(PromptCacheEntry.expires_at < datetime.utcnow()).delete()
+            db.session.commit()
+            return deleted
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Prompt cache purge failed: {e}")
+            return 0
+
+    def clear_memory(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for /metrics"""
+        with self._lock:
+            counters = dict(self._counters)
+            counters['memory_entries'] = len(self._entries)
+        lookups = counters['memory_hits'] + counters['db_hits'] + counters['misses']
+        counters['hit_rate'] = round((counters['memory_hits'] + counters['db_hits']) / lookups, 4) if lookups else None
+        return counters
+
+
+# Global instance
+prompt_cache = PromptCache()
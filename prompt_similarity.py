@@ -0,0 +1,360 @@
+"""
+Near-duplicate prompt detection with MinHash + LSH
+Prompts that differ only by whitespace, punctuation or a word or two land in the same
+LSH buckets, so a previous improvement can be reused instead of calling OpenAI again
+"""
+
+import os
+import re
+import time
+import struct
+import hashlib
+import threading
+import unicodedata
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import defer
+
+from models import db, PromptSignature
+
+logger = logging.getLogger(__name__)
+
+PROMPT_SIMILARITY_ENABLED = os.getenv('PROMPT_SIMILARITY_ENABLED', '1') == '1'
+# Minimum estimated Jaccard similarity (of character shingles) to reuse a result
+PROMPT_SIMILARITY_THRESHOLD = float(os.getenv('PROMPT_SIMILARITY_THRESHOLD', '0.8'))
+PROMPT_SIMILARITY_TTL = int(os.getenv('PROMPT_CACHE_DB_TTL', str(7 * 24 * 3600)))
+# How often a worker picks up signatures stored by other workers
+PROMPT_SIMILARITY_SYNC_SECONDS = float(os.getenv('PROMPT_SIMILARITY_SYNC_SECONDS', '30'))
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64      # hash functions per signature (multiple of 16)
+BANDS = 16         # LSH bands of ROWS hashes; candidates from ~0.5 similarity up
+ROWS = NUM_PERM // BANDS
+# Cap on candidates verified per lookup, keeps lookups flat as the index grows
+MAX_CANDIDATES = 32
+LOAD_BATCH = 5000
+# Overlay size (entries) below which new signatures are not merged into the band arrays
+COMPACT_MIN = 1024
+# Rows committed slightly out of created_at order are still picked up on the next sync
+SYNC_OVERLAP = timedelta(seconds=5)
+PURGE_EVERY = 200
+
+_non_word = re.compile(r'[\W_]+', re.UNICODE)
+_signature_format = f'<{NUM_PERM}I'
+SIGNATURE_BYTES = struct.calcsize(_signature_format)
+
+
+def canonical_text(prompt):
+    """Lowercase words only: punctuation and whitespace differences disappear"""
+    prompt = unicodedata.normalize('NFKC', prompt or '').lower()
+    return _non_word.sub(' ', prompt).strip()
+
+
+def shingles(prompt):
+    text = canonical_text(prompt)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(prompt):
+    """MinHash signature (NUM_PERM 32-bit values) of a prompt's character shingles.
+
+    Each 64-byte blake2b digest yields 16 independent hash values, so a shingle
+    costs NUM_PERM / 16 digests and the column minimums are taken in C by zip().
+    """
+    grams = shingles(prompt)
+    if not grams:
+        return None
+    rows = []
+    for gram in grams:
+        data = gram.encode('utf-8')
+        row = ()
+        for block in range(NUM_PERM // 16):
+            digest = hashlib.blake2b(data, digest_size=64, person=b'minhash%d' % block).digest()
+            row += struct.unpack('<16I', digest)
+        rows.append(row)
+    return tuple(min(column) for column in zip(*rows))
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity from two signatures"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+def _pack(signature):
+    return struct.pack(_signature_format, *signature)
+
+
+def _unpack(blob):
+    return struct.unpack(_signature_format, blob)
+
+
+def _merge_sorted(hashes, ids, new_hashes, new_ids):
+    """Merge new (band hash, entry id) pairs into a band's sorted arrays.
+
+    Runs between insertion points are copied as array slices, so the Python
+    loop is over the new pairs only, not the whole band.
+    """
+    if len(new_hashes) * 8 > len(hashes):
+        # Bulk load (startup sync): one sort beats many slice copies
+        all_hashes = hashes.tolist() + new_hashes
+        all_ids = ids.tolist() + new_ids
+        order = sorted(range(len(all_hashes)), key=all_hashes.__getitem__)
+        return array('q', [all_hashes[j] for j in order]), array('l', [all_ids[j] for j in order])
+    merged_hashes, merged_ids = array('q'), array('l')
+    start = 0
+    for j in sorted(range(len(new_hashes)), key=new_hashes.__getitem__):
+        position = bisect_right(hashes, new_hashes[j], start)
+        merged_hashes.extend(hashes[start:position])
+        merged_ids.extend(ids[start:position])
+        merged_hashes.append(new_hashes[j])
+        merged_ids.append(new_ids[j])
+        start = position
+    merged_hashes.extend(hashes[start:])
+    merged_ids.extend(ids[start:])
+    return merged_hashes, merged_ids
+
+
+class PromptIndex:
+    """In-memory LSH index over stored prompt signatures, persisted in the database.
+
+    Each band is a sorted array of (band hash, entry id) pairs searched with
+    bisect, which keeps 100k+ prompts to a few tens of MB per worker. New
+    entries go to a small per-band dict and are merged into the arrays once
+    that overlay grows past a fraction of the index.
+    """
+
+    def __init__(self, threshold=PROMPT_SIMILARITY_THRESHOLD, ttl=PROMPT_SIMILARITY_TTL,
+                 sync_seconds=PROMPT_SIMILARITY_SYNC_SECONDS, use_db=True):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.sync_seconds = sync_seconds
+        self.use_db = use_db
+        self._keys = []           # entry id -> cache_key (None once discarded)
+        self._scopes = []         # entry id -> scope
+        self._sigs = bytearray()  # entry id -> packed signature at id * SIGNATURE_BYTES
+        self._ids = {}            # cache_key -> entry id
+        self._prompts = {}        # cache_key -> prompt, without a database
+        self._band_hashes = [array('q') for _ in range(BANDS)]
+        self._band_ids = [array('l') for _ in range(BANDS)]
+        # Entries not yet merged into the arrays: per band, a lookup dict (band hash -> [entry ids])
+        # plus the band hashes in insertion order; entry ids from _merged_below up are pending
+        self._pending = [dict() for _ in range(BANDS)]
+        self._pending_hashes = [[] for _ in range(BANDS)]
+        self._merged_below = 0
+        self._compacting = False
+        self._lock = threading.RLock()
+        self._loaded_until = None
+        self._last_sync = 0.0
+        self._sync_lock = threading.Lock()
+        self._counters = {'lookups': 0, 'matches': 0, 'stores': 0, 'db_errors': 0}
+
+    def _band_keys(self, scope, signature):
+        return [hash((scope, band, signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+    def _insert(self, cache_key, scope, signature):
+        with self._lock:
+            if cache_key in self._ids:
+                return
+            entry_id = len(self._keys)
+            self._ids[cache_key] = entry_id
+            self._keys.append(cache_key)
+            self._scopes.append(scope)
+            self._sigs += _pack(signature)
+            for band, band_key in enumerate(self._band_keys(scope, signature)):
+                self._pending[band].setdefault(band_key, []).append(entry_id)
+                self._pending_hashes[band].append(band_key)
+
+    def _maybe_compact(self):
+        with self._lock:
+            pending_count = len(self._keys) - self._merged_below
+            if self._compacting or pending_count < max(COMPACT_MIN, len(self._ids) // 16):
+                return
+            self._compacting = True
+            first, last = self._merged_below, len(self._keys)
+            snapshot = [(self._band_hashes[band], self._band_ids[band], self._pending_hashes[band][:last - first])
+                        for band in range(BANDS)]
+        try:
+            # Built outside the lock; lookups keep using the old arrays and pending dicts meanwhile
+            new_ids = list(range(first, last))
+            rebuilt = [_merge_sorted(hashes, ids, new_hashes, new_ids) for hashes, ids, new_hashes in snapshot]
+            with self._lock:
+                for band, (hashes, ids) in enumerate(rebuilt):
+                    self._band_hashes[band] = hashes
+                    self._band_ids[band] = ids
+                    # Entries added while the arrays were being rebuilt stay pending
+                    newer = self._pending_hashes[band][last - first:]
+                    self._pending_hashes[band] = newer
+                    pending = {}
+                    for offset, band_key in enumerate(newer):
+                        pending.setdefault(band_key, []).append(last + offset)
+                    self._pending[band] = pending
+                self._merged_below = last
+        finally:
+            self._compacting = False
+
+    def discard(self, cache_key):
+        """Drop a signature whose cached result has expired"""
+        with self._lock:
+            entry_id = self._ids.pop(cache_key, None)
+            self._prompts.pop(cache_key, None)
+            if entry_id is not None:
+                # Lookups skip the slot; it is not reloaded after a restart
+                self._keys[entry_id] = None
+
+    def sync(self, force=False):
+        """Load signatures stored since the last sync (by any worker)"""
+        if not self.use_db:
+            return
+        if not force and time.monotonic() - self._last_sync < self.sync_seconds:
+            return
+        # Never make a request wait behind another thread's (possibly initial, large) load
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sync = time.monotonic()
+            query = (PromptSignature.query.options(defer(PromptSignature.prompt))
+                     .filter(PromptSignature.expires_at > datetime.utcnow()))
+            if self._loaded_until is not None:
+                query = query.filter(PromptSignature.created_at >= self._loaded_until - SYNC_OVERLAP)
+            loaded_until = self._loaded_until
+            for row in query.order_by(PromptSignature.created_at).yield_per(LOAD_BATCH):
+                self._insert(row.cache_key, row.scope, _unpack(row.signature))
+                loaded_until = row.created_at
+            self._loaded_until = loaded_until
+        except Exception as e:
+            db.session.rollback()
+            self._count('db_errors')
+            logger.warning(f"Prompt index sync failed: {e}")
+        finally:
+            self._sync_lock.release()
+        self._maybe_compact()
+
+    def warm(self, app, background=True):
+        """Load the stored index ahead of the first lookup (called after a worker forks)"""
+        def _warm():
+            with app.app_context():
+                self.sync(force=True)
+            logger.info(f"Prompt index loaded: {len(self)} signatures")
+
+        if not self.use_db:
+            return None
+        if background:
+            thread = threading.Thread(target=_warm, name='prompt-index-warm', daemon=True)
+            thread.start()
+            return thread
+        _warm()
+        return None
+
+    def find(self, prompt, scope, signature=None):
+        """Return (cache_key, similarity) of the closest stored prompt above the threshold, or None"""
+        self.sync()
+        signature = signature or minhash(prompt)
+        if signature is None:
+            return None
+        self._count('lookups')
+        hits = {}
+        with self._lock:
+            for band, band_key in enumerate(self._band_keys(scope, signature)):
+                hashes, ids = self._band_hashes[band], self._band_ids[band]
+                position = bisect_left(hashes, band_key)
+                while position < len(hashes) and hashes[position] == band_key:
+                    hits[ids[position]] = hits.get(ids[position], 0) + 1
+                    position += 1
+                for entry_id in self._pending[band].get(band_key, ()):
+                    hits[entry_id] = hits.get(entry_id, 0) + 1
+            # Entries sharing the most bands are the likeliest matches
+            candidates = [(self._keys[entry_id], self._scopes[entry_id],
+                           struct.unpack_from(_signature_format, self._sigs, entry_id * SIGNATURE_BYTES))
+                          for entry_id in sorted(hits, key=hits.get, reverse=True)[:MAX_CANDIDATES]]
+
+        best = None
+        for cache_key, candidate_scope, candidate in candidates:
+            if cache_key is None or candidate_scope != scope:
+                continue
+            score = similarity(signature, candidate)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (cache_key, score)
+        if best is not None:
+            self._count('matches')
+        return best
+
+    def add(self, prompt, scope, cache_key, signature=None):
+        """Index a prompt whose result is stored in the prompt cache under cache_key"""
+        signature = signature or minhash(prompt)
+        if signature is None:
+            return
+        self._insert(cache_key, scope, signature)
+        self._maybe_compact()
+        self._count('stores')
+        if not self.use_db:
+            self._prompts[cache_key] = prompt
+            return
+        try:
+            db.session.merge(PromptSignature(
+                cache_key=cache_key,
+                scope=scope,
+                prompt=prompt,
+                signature=_pack(signature),
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=self.ttl),
+            ))
+            db.session.commit()
+            if self._counters['stores'] % PURGE_EVERY == 0:
+                self.purge_expired()
+        except Exception as e:
+            db.session.rollback()
+            self._count('db_errors')
+            logger.warning(f"Prompt index DB write failed: {e}")
+
+    def prompt_for(self, cache_key):
+        """The prompt indexed under cache_key, or None if it isn't known"""
+        if not self.use_db:
+            return self._prompts.get(cache_key)
+        try:
+            row = db.session.get(PromptSignature, cache_key)
+        except Exception as e:
+            db.session.rollback()
+            self._count('db_errors')
+            logger.warning(f"Prompt index read failed: {e}")
+            return None
+        return row.prompt if row is not None else None
+
+    def purge_expired(self):
+        """Delete expired signatures from the database"""
+        try:
+            deleted = PromptSignature.query.filter(PromptSignature.expires_at < datetime.utcnow()).delete()
+            db.session.commit()
+            return deleted
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Prompt index purge failed: {e}")
+            return 0
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def __len__(self):
+        return len(self._ids)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['indexed'] = len(self._ids)
+        counters['threshold'] = self.threshold
+        return counters
+
+
+def prompt_scope(tool_type, model_key, version):
+    """Near-duplicates only match within one tool type, model and system prompt version"""
+    raw = '\x1f'.join([tool_type or '', model_key or '', version or ''])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+# Global instance
+prompt_index = PromptIndex()
@@ -0,0 +1,220 @@
+"""
+Token-bucket rate limiter for upstream AI model budgets
+Buckets live in a small lock-protected file, so every gunicorn worker (and every
+thread inside it) draws from the same requests-per-minute and tokens-per-minute budget
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: buckets are per-process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_FILE = os.getenv('RATE_LIMIT_FILE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'rate_limits.json'))
+# How long a caller may queue for budget before the request is sent anyway
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '10'))
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+
+# Per-model budgets (requests/min, tokens/min); None means that dimension is unlimited.
+# Override with RATE_LIMIT_<MODEL>_RPM / _TPM, e.g. RATE_LIMIT_GPT_4O_TPM=60000
+DEFAULT_LIMITS = {
+    'gpt-3.5-turbo': (3500, 200000),
+    'gpt-4o': (500, 30000),
+    'gpt-4o-mini': (500, 200000),
+    'imagen-4.0': (20, None),
+}
+
+# Rough prompt-token cost of one image in a vision request (high detail, 512px tiles)
+IMAGE_TOKEN_ESTIMATE = int(os.getenv('RATE_LIMIT_IMAGE_TOKENS', '765'))
+# A detail=low image is a flat 85 tokens
+LOW_DETAIL_IMAGE_TOKENS = 85
+CHARS_PER_TOKEN = 4
+
+
+def _env_limit(model, kind, default):
+    value = os.getenv(f"RATE_LIMIT_{model.upper().replace('-', '_').replace('.', '_')}_{kind}")
+    if value is None:
+        return default
+    return float(value) if value.strip() else None
+
+
+def load_limits():
+    return {model: (_env_limit(model, 'RPM', rpm), _env_limit(model, 'TPM', tpm))
+            for model, (rpm, tpm) in DEFAULT_LIMITS.items()}
+
+
+def model_for_request(url, payload):
+    """Budget name for an upstream call: the chat model, or the Imagen model from the URL"""
+    model = (payload or {}).get('model') if isinstance(payload, dict) else None
+    if not model:
+        path = urlsplit(url).path
+        if '/models/' in path:
+            model = path.split('/models/', 1)[1].split(':', 1)[0]
+    if not model:
+        return None
+    # Longest prefix wins so gpt-4o-mini is not billed as gpt-4o
+    for name in sorted(DEFAULT_LIMITS, key=len, reverse=True):
+        if model.startswith(name):
+            return name
+    return None
+
+
+def estimate_tokens(payload):
+    """Estimate prompt + completion tokens for a chat completion payload"""
+    if not isinstance(payload, dict):
+        return 0
+    chars = 0
+    image_tokens = 0
+    for message in payload.get('messages') or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'text':
+                    chars += len(part.get('text', ''))
+                elif part.get('type') == 'image_url':
+                    low = (part.get('image_url') or {}).get('detail') == 'low'
+                    image_tokens += LOW_DETAIL_IMAGE_TOKENS if low else IMAGE_TOKEN_ESTIMATE
+    prompt_tokens = chars // CHARS_PER_TOKEN + image_tokens
+    return prompt_tokens + int(payload.get('max_tokens') or 0)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets shared through a locked file.
+
+    clock is wall-clock time (bucket timestamps are shared between processes)
+    and sleep waits on it; tests pass a simulated pair.
+    """
+
+    def __init__(self, path=RATE_LIMIT_FILE, limits=None, max_wait=RATE_LIMIT_MAX_WAIT,
+                 clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.limits = limits if limits is not None else load_limits()
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+        self._thread_lock = threading.Lock()
+        self._local_state = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def _read_state(self, handle):
+        handle.seek(0)
+        raw = handle.read()
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _write_state(self, handle, state):
+        handle.seek(0)
+        handle.truncate()
+        handle.write(json.dumps(state))
+        handle.flush()
+
+    def _with_state(self, update):
+        """Run update(state) under both the thread lock and the cross-process file lock"""
+        with self._thread_lock:
+            if fcntl is None:
+                return update(self._local_state)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a+') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    state = self._read_state(handle)
+                    result = update(state)
+                    self._write_state(handle, state)
+                    return result
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _try_take(self, model, tokens):
+        """Take one request and `tokens` from the model's buckets, or return seconds to wait"""
+        rpm, tpm = self.limits[model]
+
+        def update(state):
+            now = self.clock()
+            buckets = state.setdefault(model, {})
+            needs = []
+            for kind, limit, amount in (('requests', rpm, 1), ('tokens', tpm, tokens)):
+                if not limit:
+                    continue
+                # A single request bigger than the whole budget may only wait for a full bucket
+                amount = min(amount, limit)
+                level, updated = buckets.get(kind, (limit, now))
+                level = min(limit, level + (now - updated) * limit / 60.0)
+                buckets[kind] = (level, now)
+                needs.append((kind, limit, amount, level))
+            wait = max([(amount - level) * 60.0 / limit for _, limit, amount, level in needs if level < amount],
+                       default=0.0)
+            if wait == 0.0:
+                for kind, limit, amount, level in needs:
+                    buckets[kind] = (level - amount, now)
+            return wait
+
+        return self._with_state(update)
+
+    def acquire(self, model, tokens=0, max_wait=None):
+        """Block until the model has budget for one request of `tokens`; returns seconds waited.
+
+        Callers queue instead of failing: if the budget does not free up within
+        max_wait, the request goes ahead anyway and the upstream 429 handling
+        takes over.
+        """
+        if model not in self.limits:
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else max_wait
+        started = self.clock()
+        while True:
+            try:
+                wait = self._try_take(model, tokens)
+            except OSError as e:
+                logger.warning(f"Rate limiter unavailable, not limiting {model}: {e}")
+                return 0.0
+            waited = max(self.clock() - started, 0.0)
+            if wait == 0.0:
+                self._record(model, waited, overflow=False)
+                return waited
+            if waited + wait > max_wait:
+                logger.warning(f"Rate limit budget for {model} exhausted, sending without waiting {wait:.1f}s")
+                self._record(model, waited, overflow=True)
+                return waited
+            self.sleep(wait)
+
+    def acquire_for_request(self, url, payload, max_wait=None):
+        """Acquire budget for an upstream POST, inferring model and token cost from it"""
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        model = model_for_request(url, payload)
+        if model is None:
+            return 0.0
+        return self.acquire(model, estimate_tokens(payload), max_wait=max_wait)
+
+    def _record(self, model, waited, overflow):
+        with self._stats_lock:
+            stats = self._stats.setdefault(model, {'acquired': 0, 'waited': 0, 'wait_seconds': 0.0, 'overflow': 0})
+            stats['acquired'] += 1
+            if waited > 0.001:
+                stats['waited'] += 1
+                stats['wait_seconds'] = round(stats['wait_seconds'] + waited, 3)
+            if overflow:
+                stats['overflow'] += 1
+
+    def stats(self):
+        """Per-model acquire/wait counters for this process"""
+        with self._stats_lock:
+            return {model: dict(values) for model, values in self._stats.items()}
+
+
+# Global limiter instance
+rate_limiter = RateLimiter()
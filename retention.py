@@ -0,0 +1,274 @@
+"""
+Retention and per-user storage quotas for generated slideshow images
+A background sweeper deletes batches older than their owner's plan keeps them, then evicts the
+oldest batches of users over their quota. Rows go in bulk with DELETE ... RETURNING, so each
+sweeper only uncounts and unlinks what it actually deleted and several can run side by side.
+"""
+
+import os
+import time
+import random
+import shutil
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, GeneratedAsset, StorageUsage
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', '1') == '1'
+RETENTION_FREE_DAYS = float(os.getenv('RETENTION_FREE_DAYS', '7'))
+RETENTION_PAID_DAYS = float(os.getenv('RETENTION_PAID_DAYS', '90'))
+STORAGE_QUOTA_FREE_BYTES = int(os.getenv('STORAGE_QUOTA_FREE_BYTES', str(100 * 1024 * 1024)))
+STORAGE_QUOTA_PAID_BYTES = int(os.getenv('STORAGE_QUOTA_PAID_BYTES', str(2 * 1024 * 1024 * 1024)))
+RETENTION_SWEEP_SECONDS = float(os.getenv('RETENTION_SWEEP_SECONDS', '600'))
+
+# Batches removed per DELETE statement
+SWEEP_BATCH = 200
+# Per-batch directories written before the storage backends; swept by mtime with the paid retention
+LEGACY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'generated')
+LEGACY_BATCH_NAME_LENGTH = 12
+
+
+def retention_for(is_paid):
+    return timedelta(days=RETENTION_PAID_DAYS if is_paid else RETENTION_FREE_DAYS)
+
+
+def quota_for(is_paid):
+    return STORAGE_QUOTA_PAID_BYTES if is_paid else STORAGE_QUOTA_FREE_BYTES
+
+
+def _bump_usage(user_id, size, count):
+    return (StorageUsage.query.filter_by(user_id=user_id)
+            .update({'bytes': StorageUsage.bytes + size, 'assets': StorageUsage.assets + count,
+                     'updated_at': datetime.utcnow()}, synchronize_session=False))
+
+
+def add_usage(user_id, size, count):
+    """Adjust a user's running totals inside the caller's transaction (negative to release)"""
+    if user_id is None or not count:
+        return
+    if _bump_usage(user_id, size, count):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(StorageUsage(user_id=user_id, bytes=size, assets=count, updated_at=datetime.utcnow()))
+    except IntegrityError:  # another worker created the row first
+        _bump_usage(user_id, size, count)
+
+
+def usage_bytes(user_id):
+    return db.session.query(StorageUsage.bytes).filter_by(user_id=user_id).scalar() or 0
+
+
+def rebuild_usage():
+    """Recompute every user's totals from GeneratedAsset (for a fresh usage table, or after drift)"""
+    totals = (db.session.query(GeneratedAsset.user_id, func.sum(GeneratedAsset.size), func.count(GeneratedAsset.id))
+              .filter(GeneratedAsset.user_id.isnot(None))
+              .group_by(GeneratedAsset.user_id).all())
+    StorageUsage.query.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.session.add_all([StorageUsage(user_id=user_id, bytes=size or 0, assets=count, updated_at=now)
+                        for user_id, size, count in totals])
+    db.session.commit()
+    return len(totals)
+
+
+def delete_batches(batch_ids):
+    """Delete the batches' rows in one statement, release their usage and unlink unreferenced objects.
+
+    Returns (assets deleted, bytes released, objects deleted).
+    """
+    if not batch_ids:
+        return 0, 0, 0
+    deleted = db.session.execute(
+        delete(GeneratedAsset).where(GeneratedAsset.batch_id.in_(list(batch_ids)))
+        .returning(GeneratedAsset.user_id, GeneratedAsset.size, GeneratedAsset.backend, GeneratedAsset.storage_key)
+        .execution_options(synchronize_session=False)
+    ).all()
+    released = {}
+    for user_id, size, _, _ in deleted:
+        total = released.setdefault(user_id, [0, 0])
+        total[0] += size or 0
+        total[1] += 1
+    for user_id, (size, count) in released.items():
+        add_usage(user_id, -size, -count)
+    db.session.commit()
+
+    # Content-addressed objects can be shared; only unlink those no remaining row points at
+    objects = {(backend, key) for _, _, backend, key in deleted}
+    still_used = {key for (key,) in db.session.query(GeneratedAsset.storage_key)
+                  .filter(GeneratedAsset.storage_key.in_([key for _, key in objects])).distinct()}
+    unlinked = 0
+    for backend, key in objects:
+        if key in still_used:
+            continue
+        try:
+            get_storage(backend).delete(key)
+            unlinked += 1
+        except Exception as e:
+            logger.warning(f"Could not delete stored object {key}: {e}")
+    return len(deleted), sum(size for size, _ in released.values()), unlinked
+
+
+def expired_batch_ids(is_paid, limit=SWEEP_BATCH, now=None):
+    """Batches past the retention of their owner's plan (ownerless batches count as free)"""
+    cutoff = (now or datetime.utcnow()) - retention_for(is_paid)
+    query = (db.session.query(GeneratedAsset.batch_id)
+             .outerjoin(User, User.id == GeneratedAsset.user_id)
+             .filter(GeneratedAsset.created_at < cutoff))
+    if is_paid:
+        query = query.filter(User.is_paid.is_(True))
+    else:
+        query = query.filter(or_(User.id.is_(None), User.is_paid.isnot(True)))
+    return [batch_id for (batch_id,) in query.distinct().limit(limit)]
+
+
+def enforce_quota(user_id):
+    """Evict a user's oldest batches until they are within quota; their newest batch is always kept"""
+    user = db.session.get(User, user_id)
+    if user is None:
+        return []
+    over = usage_bytes(user_id) - quota_for(user.is_paid)
+    if over <= 0:
+        return []
+    batches = (db.session.query(GeneratedAsset.batch_id, func.sum(GeneratedAsset.size))
+               .filter(GeneratedAsset.user_id == user_id)
+               .group_by(GeneratedAsset.batch_id)
+               .order_by(func.max(GeneratedAsset.created_at)).all())
+    evicted = []
+    for batch_id, size in batches[:-1]:
+        if over <= 0:
+            break
+        evicted.append(batch_id)
+        over -= size or 0
+    for start in range(0, len(evicted), SWEEP_BATCH):
+        delete_batches(evicted[start:start + SWEEP_BATCH])
+    return evicted
+
+
+def users_over_quota():
+    query = (db.session.query(StorageUsage.user_id).join(User, User.id == StorageUsage.user_id)
+             .filter(or_(
+                 (User.is_paid.is_(True)) & (StorageUsage.bytes > STORAGE_QUOTA_PAID_BYTES),
+                 (User.is_paid.isnot(True)) & (StorageUsage.bytes > STORAGE_QUOTA_FREE_BYTES))))
+    return [user_id for (user_id,) in query]
+
+
+def sweep_legacy_dirs(root=LEGACY_DIR, now=None):
+    """Remove pre-storage-backend batch directories older than the paid retention"""
+    cutoff = (now or time.time()) - retention_for(True).total_seconds()
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        # Shard directories of the local backend have two-character names
+        if len(entry.name) != LEGACY_BATCH_NAME_LENGTH or not entry.is_dir(follow_symlinks=False):
+            continue
+        if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class RetentionSweeper:
+    """Periodic expiry and quota enforcement, with counters for /metrics"""
+
+    def __init__(self, interval=RETENTION_SWEEP_SECONDS):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = {'pid': None, 'thread': None}
+        self._usage_checked = False
+        self._counters = {'sweeps': 0, 'batches_expired': 0, 'batches_evicted': 0, 'assets_deleted': 0,
+                          'bytes_released': 0, 'objects_deleted': 0, 'legacy_dirs_deleted': 0, 'errors': 0,
+                          'last_sweep_seconds': None, 'last_sweep_at': None}
+
+    def _add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self._counters[name] += amount
+
+    def _delete(self, batch_ids, counter):
+        assets, size, objects = delete_batches(batch_ids)
+        self._add(**{counter: len(batch_ids)}, assets_deleted=assets, bytes_released=size, objects_deleted=objects)
+
+    def sweep(self, now=None):
+        """Run one pass: expire old batches, evict over-quota users, clear legacy directories"""
+        started = time.monotonic()
+        if not self._usage_checked:
+            if StorageUsage.query.first() is None and GeneratedAsset.query.first() is not None:
+                logger.info(f"Storage usage rebuilt for {rebuild_usage()} users")
+            self._usage_checked = True
+
+        for is_paid in (False, True):
+            while True:
+                batch_ids = expired_batch_ids(is_paid, now=now)
+                if not batch_ids:
+                    break
+                self._delete(batch_ids, 'batches_expired')
+                if len(batch_ids) < SWEEP_BATCH:
+                    break
+
+        for user_id in users_over_quota():
+            evicted = enforce_quota(user_id)
+            self._add(batches_evicted=len(evicted))
+
+        self._add(legacy_dirs_deleted=sweep_legacy_dirs(now=now.timestamp() if now else None), sweeps=1)
+        with self._lock:
+            self._counters['last_sweep_seconds'] = round(time.monotonic() - started, 3)
+            self._counters['last_sweep_at'] = datetime.utcnow().isoformat()
+
+    def _run(self, app, stop_event):
+        # Spread the workers' sweeps apart
+        stop_event.wait(random.uniform(0, min(self.interval, 60)))
+        while not stop_event.is_set():
+            try:
+                with app.app_context():
+                    self.sweep()
+            except Exception as e:
+                db.session.rollback()
+                self._add(errors=1)
+                logger.exception(f"Retention sweep failed: {e}")
+            stop_event.wait(self.interval)
+
+    def start(self, app, stop_event=None):
+        """Sweep in a daemon thread of this process (called after a worker forks)"""
+        if not RETENTION_ENABLED:
+            return None
+        with self._lock:
+            thread = self._thread['thread']
+            if self._thread['pid'] == os.getpid() and thread is not None and thread.is_alive():
+                return thread
+            thread = threading.Thread(target=self._run, args=(app, stop_event or threading.Event()),
+                                      name='retention-sweeper', daemon=True)
+            thread.start()
+            self._thread.update(pid=os.getpid(), thread=thread)
+            return thread
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = RETENTION_ENABLED
+        stats['retention_days'] = {'free': RETENTION_FREE_DAYS, 'paid': RETENTION_PAID_DAYS}
+        stats['quota_bytes'] = {'free': STORAGE_QUOTA_FREE_BYTES, 'paid': STORAGE_QUOTA_PAID_BYTES}
+        try:
+            total_bytes, total_assets, users = db.session.query(
+                func.coalesce(func.sum(StorageUsage.bytes), 0), func.coalesce(func.sum(StorageUsage.assets), 0),
+                func.count(StorageUsage.user_id)).one()
+            stats.update(stored_bytes=int(total_bytes), stored_assets=int(total_assets), users_with_files=users,
+                         users_over_quota=len(users_over_quota()))
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Storage usage query failed: {e}")
+        return stats
+
+
+# Global instance
+sweeper = RetentionSweeper()
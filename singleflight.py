@@ -0,0 +1,166 @@
+"""
+Single-flight coalescing of identical concurrent calls
+The first caller for a key (the leader) runs the call; callers arriving while it is
+in flight wait and share its result instead of repeating the work
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: coalescing is per-process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_DIR = os.getenv('SINGLEFLIGHT_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'singleflight'))
+# A shared result older than this when a follower reads it is ignored (it belongs to an earlier call)
+SHARED_RESULT_TTL = float(os.getenv('SINGLEFLIGHT_RESULT_TTL', '30'))
+SWEEP_EVERY = 100
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key, across threads and optionally workers"""
+
+    def __init__(self, shared_dir=SINGLEFLIGHT_DIR, result_ttl=SHARED_RESULT_TTL):
+        self.shared_dir = shared_dir
+        self.result_ttl = result_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {'leaders': 0, 'followers': 0, 'shared_leaders': 0, 'shared_followers': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def do(self, key, fn):
+        """Run fn() once for all threads calling with `key` at the same time; return (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self._counters['leaders'] += 1
+            else:
+                call.followers += 1
+                leader = False
+                self._counters['followers'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def do_shared(self, key, fn, encode, decode):
+        """Like do(), but also coalesces with other worker processes on this host.
+
+        The leader holds an exclusive flock on a per-key lock file while it runs
+        and publishes encode(result) next to it; a worker that finds the lock
+        taken waits for it and decodes the published result. If nothing usable
+        was published (the leader failed, or encode() declined), the follower
+        runs fn() itself.
+        """
+        if fcntl is None:
+            return self.do(key, fn)
+        return self.do(key, lambda: self._cross_process(key, fn, encode, decode))
+
+    def _cross_process(self, key, fn, encode, decode):
+        os.makedirs(self.shared_dir, exist_ok=True)
+        lock_path = os.path.join(self.shared_dir, f"{key}.lock")
+        result_path = os.path.join(self.shared_dir, f"{key}.json")
+        with open(lock_path, 'a+') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waited_from = time.time()
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                result = self._read_shared(result_path, waited_from)
+                if result is not None:
+                    self._count('shared_followers')
+                    return decode(result)
+                return fn()
+
+            try:
+                self._count('shared_leaders')
+                os.utime(lock_path)  # keeps sweep() away from a key that is in use
+                result = fn()
+                self._publish(result_path, encode(result))
+                return result
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                if self._counters['shared_leaders'] % SWEEP_EVERY == 0:
+                    self.sweep()
+
+    def _publish(self, result_path, payload):
+        if payload is None:
+            return
+        temp_path = f"{result_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({'published_at': time.time(), 'result': payload}, f)
+            os.replace(temp_path, result_path)
+        except OSError as e:
+            logger.warning(f"Single-flight publish failed: {e}")
+
+    def _read_shared(self, result_path, not_before):
+        try:
+            with open(result_path) as f:
+                published = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Only a result published while we were waiting belongs to the call we joined
+        published_at = published.get('published_at', 0)
+        if published_at < not_before - 1 or time.time() - published_at > self.result_ttl:
+            return None
+        return published.get('result')
+
+    def sweep(self, max_age=None):
+        """Delete lock and result files no call has touched recently"""
+        max_age = max_age or max(60.0, self.result_ttl * 2)
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            for name in os.listdir(self.shared_dir):
+                path = os.path.join(self.shared_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        except OSError:
+            pass
+        return removed
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters['in_flight'] = len(self._calls)
+        return counters
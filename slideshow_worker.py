@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Slideshow worker for PitchAI
+Claims queued slideshow jobs from the database and runs the generation pipeline,
+so the web process never blocks on vision/Imagen calls.
+
+Run one or more of these alongside gunicorn (SLIDESHOW_WORKER_MODE=external):
+    python slideshow_worker.py
+"""
+
+import os
+import sys
+import signal
+import logging
+import threading
+
+# The web app's embedded worker must not also start inside this process
+os.environ['SLIDESHOW_WORKER_MODE'] = 'external'
+
+from app import app, process_slideshow_job
+import image_variants
+from image_cache import image_cache, IMAGE_CACHE_ENABLED
+from retention import sweeper
+import job_queue
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        print(f"Slideshow worker received signal {signum}, finishing current job...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    print("Starting PitchAI slideshow worker...")
+    image_variants.warm_pool()
+    if IMAGE_CACHE_ENABLED:
+        image_cache.warm(app, background=False)
+    sweeper.start(app, stop_event=stop_event)
+    threads = job_queue.start_workers(app, process_slideshow_job, stop_event=stop_event)
+    # Join with a timeout so the main thread keeps handling signals
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Storage backends for generated images
+Objects are content-addressed (sha256, sharded two levels deep) and written by streaming.
+Reads hand out URLs - /generated/<key> for local disk (sent by sendfile or the front proxy,
+see file_serving.py), a public or presigned URL for S3 - so image bytes never pass through Python.
+
+STORAGE_BACKEND=local (default) keeps files under static/generated; STORAGE_BACKEND=s3
+uses any S3-compatible service (AWS, MinIO, R2) and needs boto3.
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+STORAGE_LOCAL_DIR = os.getenv('STORAGE_LOCAL_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'static', 'generated'))
+# Served by the app's /generated route (see file_serving.py), or directly by a proxy pointed at STORAGE_LOCAL_DIR
+STORAGE_LOCAL_URL = os.getenv('STORAGE_LOCAL_URL', '/generated').rstrip('/')
+
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None  # e.g. http://127.0.0.1:9000 for MinIO
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+S3_PREFIX = os.getenv('S3_PREFIX', 'generated/')
+# Set when the bucket is public or behind a CDN; otherwise reads get presigned URLs
+S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL', '').rstrip('/')
+S3_PRESIGN_SECONDS = int(os.getenv('S3_PRESIGN_SECONDS', '3600'))
+
+CHUNK_SIZE = 1024 * 1024
+# Objects are immutable (their key is their hash), so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+StoredObject = namedtuple('StoredObject', 'key size sha256 content_type')
+
+_CONTENT_TYPES = {
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
+    'webp': 'image/webp', 'avif': 'image/avif', 'gif': 'image/gif',
+}
+
+
+class StorageError(Exception):
+    """A storage backend is misconfigured or unavailable"""
+
+
+def content_key(digest, extension):
+    """Sharded key for a sha256 hex digest: ab/cd/abcd....ext"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension.lstrip('.').lower()}"
+
+
+def content_type_for(extension):
+    return _CONTENT_TYPES.get(extension.lstrip('.').lower(), 'application/octet-stream')
+
+
+def _copy_hashing(stream, out):
+    """Copy stream to out in chunks; return (sha256 hex, bytes copied)"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+        out.write(chunk)
+    return digest.hexdigest(), size
+
+
+class LocalStorage:
+    """Content-addressed files on local disk"""
+
+    name = 'local'
+    permanent_urls = True
+
+    def __init__(self, root=STORAGE_LOCAL_DIR, url_prefix=STORAGE_LOCAL_URL):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def local_path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Key outside storage root: {key}")
+        return path
+
+    def put(self, stream, extension, content_type=None):
+        """Stream an object in; identical content is stored once"""
+        temp_dir = os.path.join(self.root, '.incoming')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                digest, size = _copy_hashing(stream, out)
+            key = content_key(digest, extension)
+            path = self.local_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return StoredObject(key, size, digest, content_type or content_type_for(extension))
+
+    def put_file(self, path, content_type=None):
+        with open(path, 'rb') as f:
+            return self.put(f, os.path.splitext(path)[1], content_type)
+
+    def url(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def download_url(self, key, filename):
+        # Downloads of local files go through the app, which sets Content-Disposition itself
+        return self.url(key)
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class S3Storage:
+    """Content-addressed objects in an S3-compatible bucket"""
+
+    name = 's3'
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION, prefix=S3_PREFIX,
+                 public_url=S3_PUBLIC_URL, presign_seconds=S3_PRESIGN_SECONDS, client=None):
+        if not bucket:
+            raise StorageError("S3_BUCKET is not set")
+        if client is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError:
+                raise StorageError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                  config=Config(signature_version='s3v4', retries={'mode': 'standard'}))
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url.rstrip('/')
+        self.presign_seconds = presign_seconds
+
+    @property
+    def permanent_urls(self):
+        return bool(self.public_url)
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def put(self, stream, extension, content_type=None):
+        """Stream an object in; identical content is uploaded once.
+
+        The key depends on the content hash, so the stream is spooled (in
+        memory up to CHUNK_SIZE, then on disk) while hashing, then uploaded.
+        """
+        content_type = content_type or content_type_for(extension)
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as spool:
+            digest, size = _copy_hashing(stream, spool)
+            key = content_key(digest, extension)
+            if not self.exists(key):
+                spool.seek(0)
+                self.client.upload_fileobj(spool, self.bucket, self._object_key(key), ExtraArgs={
+                    'ContentType': content_type,
+                    'CacheControl': IMMUTABLE_CACHE_CONTROL,
+                })
+        return StoredObject(key, size, digest, content_type)
+
+    def put_file(self, path, content_type=None):
+        with open(path, 'rb') as f:
+            return self.put(f, os.path.splitext(path)[1], content_type)
+
+    def _presign(self, key, **params):
+        params.update(Bucket=self.bucket, Key=self._object_key(key))
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.presign_seconds)
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{self._object_key(key)}"
+        return self._presign(key)
+
+    def download_url(self, key, filename):
+        return self._presign(key, ResponseContentDisposition=f'attachment; filename="{filename}"')
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return True
+
+
+def build_storage(backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend == 'local':
+        return LocalStorage()
+    if backend == 's3':
+        return S3Storage()
+    raise StorageError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+_storage = {'pid': None, 'backends': {}}
+_storage_lock = threading.Lock()
+
+
+def get_storage(backend=None):
+    """The backend named (default: STORAGE_BACKEND), one per process since S3 clients aren't fork-safe"""
+    backend = backend or STORAGE_BACKEND
+    with _storage_lock:
+        if _storage['pid'] != os.getpid():
+            _storage['backends'] = {}
+            _storage['pid'] = os.getpid()
+        if backend not in _storage['backends']:
+            _storage['backends'][backend] = build_storage(backend)
+        return _storage['backends'][backend]
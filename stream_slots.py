@@ -0,0 +1,48 @@
+"""
+Cap on requests that hold a web thread open: SSE streams and long-polls
+Under gunicorn's gthread worker each one occupies one of the worker's threads until it ends,
+so without a cap a handful of open status pages would leave no thread for anything else.
+Past the cap, those requests answer at once with a retry hint and the browser polls again later.
+"""
+
+import os
+import threading
+
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '8'))
+# Threads per worker that streams and long-polls may hold; the rest stay free for normal requests
+STREAM_SLOTS = int(os.getenv('STREAM_SLOTS', str(max(1, GUNICORN_THREADS // 2))))
+# Seconds a refused client waits before asking again
+STREAM_RETRY_SECONDS = float(os.getenv('STREAM_RETRY_SECONDS', '3'))
+
+
+class StreamSlots:
+    """Counts open long-lived requests against a limit; try_acquire() never blocks"""
+
+    def __init__(self, limit=STREAM_SLOTS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._open = 0
+        self._counters = {'granted': 0, 'refused': 0}
+
+    def try_acquire(self):
+        with self._lock:
+            if self._open >= self.limit:
+                self._counters['refused'] += 1
+                return False
+            self._open += 1
+            self._counters['granted'] += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open = max(self._open - 1, 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(open=self._open, limit=self.limit)
+        return stats
+
+
+# Global instance, per worker process
+stream_slots = StreamSlots()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for decoding base64 JSON fields from a streamed body
+"""
+
+import io
+import os
+import sys
+import json
+import base64
+from b64_stream import decode_json_field, TruncatedField
+
+
+def chunked(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_decodes_across_any_chunking():
+    """The image comes out byte-identical whatever the chunk boundaries, and the rest still parses"""
+    print("Testing chunked decode...")
+    image = b'\x89PNG\r\n\x1a\n' + os.urandom(5000)
+    body = json.dumps({'predictions': [{'bytesBase64Encoded': base64.b64encode(image).decode(),
+                                        'mimeType': 'image/png'}]}).encode()
+    escaped = body.replace(b'/', b'\\/')
+    for data in (body, escaped):
+        for size in (1, 3, 7, 64, 1000, len(data)):
+            out = io.BytesIO()
+            written, rest = decode_json_field(chunked(data, size), 'bytesBase64Encoded', out)
+            assert out.getvalue() == image and written == len(image), size
+            assert json.loads(rest) == {'predictions': [{'bytesBase64Encoded': '', 'mimeType': 'image/png'}]}
+    print("✓ Decoded identically at chunk sizes 1 to full body")
+
+
+def test_missing_and_truncated_fields():
+    print("Testing missing and truncated fields...")
+    out = io.BytesIO()
+    body = b'{"error": {"code": 400, "message": "prompt blocked"}}'
+    written, rest = decode_json_field(chunked(body, 5), 'bytesBase64Encoded', out)
+    assert written == 0 and rest == body and out.getvalue() == b''
+
+    for body in (b'{"predictions": [{"bytesBase64Encoded": "iVBORw0KGgo', b'{"bytesBase64Encoded": "iVBORw0KGg"}'):
+        try:
+            decode_json_field(chunked(body, 4), 'bytesBase64Encoded', io.BytesIO())
+            assert False, "truncated value accepted"
+        except TruncatedField:
+            pass
+    print("✓ Missing field left the body intact, truncated values raised")
+
+
+def main():
+    tests = [test_decodes_across_any_chunking, test_missing_and_truncated_fields]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Test script for upstream circuit breakers and retry backoff
+No network needed: sessions and sleeps are replaced with fakes
+"""
+
+import sys
+import time
+import requests
+import upstream_client
+from circuit_breaker import CircuitBreaker, CircuitOpenError, OPEN, HALF_OPEN, CLOSED
+from deadline import Deadline, DeadlineExceeded
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Returns queued responses (or raises queued exceptions) in order"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_breaker_trips_and_recovers():
+    """Error rate opens the breaker; a good half-open probe closes it"""
+    print("Testing breaker state machine...")
+    breaker = CircuitBreaker('test', window=10, min_calls=4, error_rate=0.5, open_seconds=0.1)
+    for ok in (True, False, False, True):
+        breaker.record(ok, 0.1)
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+
+    time.sleep(0.15)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is True
+    assert breaker.allow() is False  # only one probe at a time
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    print("✓ Breaker opens, probes and closes")
+
+
+def test_breaker_trips_on_latency():
+    """Slow successful calls also open the breaker"""
+    print("Testing slow-call tripping...")
+    breaker = CircuitBreaker('slow', window=10, min_calls=3, slow_rate=0.5, slow_seconds=1)
+    for _ in range(3):
+        breaker.record(True, 5)
+    assert breaker.state == OPEN
+    try:
+        breaker.before_call()
+        assert False, "expected CircuitOpenError"
+    except CircuitOpenError:
+        pass
+    print("✓ Latency trips the breaker")
+
+
+def test_retry_after_honoured():
+    """A 429 with Retry-After is retried after exactly that delay"""
+    print("Testing Retry-After handling...")
+    url = 'https://retry.test/v1/chat/completions'
+    session = FakeSession([FakeResponse(429, {'Retry-After': '2'}), FakeResponse(200)])
+    sleeps = []
+    original_get, original_sleep = upstream_client.get_session, upstream_client.time.sleep
+    upstream_client.get_session = lambda u: session
+    upstream_client.time.sleep = sleeps.append
+    try:
+        response = upstream_client.post(url, json={})
+    finally:
+        upstream_client.get_session, upstream_client.time.sleep = original_get, original_sleep
+    assert response.status_code == 200
+    assert session.calls == 2
+    assert sleeps == [2.0]
+    print("✓ Retry-After respected")
+
+
+def test_jittered_backoff_and_no_read_retry():
+    """Connection errors back off with jitter; read timeouts are not replayed"""
+    print("Testing jittered backoff...")
+    for attempt in range(5):
+        delay = upstream_client.backoff_delay(attempt)
+        assert 0 <= delay <= min(upstream_client.MAX_BACKOFF, upstream_client.BACKOFF_FACTOR * 2 ** attempt)
+
+    url = 'https://timeout.test/v1/chat/completions'
+    session = FakeSession([requests.ReadTimeout('slow'), FakeResponse(200)])
+    original_get = upstream_client.get_session
+    upstream_client.get_session = lambda u: session
+    try:
+        upstream_client.post(url, json={})
+        assert False, "expected ReadTimeout"
+    except requests.ReadTimeout:
+        pass
+    finally:
+        upstream_client.get_session = original_get
+    assert session.calls == 1
+    print("✓ Backoff jittered, read timeouts not retried")
+
+
+def test_open_circuit_fails_fast():
+    """Once the endpoint's breaker is open, post() never touches the network"""
+    print("Testing fail-fast...")
+    url = 'https://down.test/v1/chat/completions'
+    breaker = upstream_client.breaker_for(url)
+    for _ in range(breaker.min_calls):
+        breaker.record(False, 0.1)
+    session = FakeSession([FakeResponse(200)])
+    original_get = upstream_client.get_session
+    upstream_client.get_session = lambda u: session
+    try:
+        started = time.monotonic()
+        upstream_client.post(url, json={})
+        assert False, "expected CircuitOpenError"
+    except CircuitOpenError:
+        assert time.monotonic() - started < 0.05
+    finally:
+        upstream_client.get_session = original_get
+        breaker.reset()
+    assert session.calls == 0
+    assert upstream_client.is_available(url)
+    print("✓ Open circuit fails fast")
+
+
+def test_expired_deadline_keeps_half_open_probe():
+    """A deadline that runs out before a half-open probe is sent doesn't wedge the breaker"""
+    print("Testing deadline during half-open...")
+    url = 'https://recovering.test/v1/chat/completions'
+    breaker = upstream_client.breaker_for(url)
+    for _ in range(breaker.min_calls):
+        breaker.record(False, 0.1)
+    breaker._opened_at -= breaker.open_seconds
+    assert breaker.state == HALF_OPEN
+    session = FakeSession([FakeResponse(200)])
+    original_get = upstream_client.get_session
+    upstream_client.get_session = lambda u: session
+    try:
+        try:
+            upstream_client.post(url, json={}, deadline=Deadline(0.0))
+            assert False, "expected DeadlineExceeded"
+        except DeadlineExceeded:
+            pass
+        assert session.calls == 0 and breaker.state == HALF_OPEN
+        # The probe slot is still free: the next call goes through and closes the breaker
+        assert upstream_client.post(url, json={}).status_code == 200
+        assert breaker.state == CLOSED
+    finally:
+        upstream_client.get_session = original_get
+        breaker.reset()
+    print("✓ Probe slot released, breaker recovered")
+
+
+def main():
+    tests = [test_breaker_trips_and_recovers, test_breaker_trips_on_latency, test_retry_after_honoured,
+             test_jittered_backoff_and_no_read_retry, test_open_circuit_fails_fast,
+             test_expired_deadline_keeps_half_open_probe]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for deadline propagation through the slideshow pipeline
+Checks that stage timeouts shrink to the time left, retries stop at the deadline,
+and slideshow generation returns the images that finished in time
+"""
+
+import sys
+import time
+import requests
+import upstream_client
+import app as app_module
+from deadline import Deadline, DeadlineExceeded, stage_timeout
+
+
+class RecordingSession:
+    """Fake pooled session answering every POST with a fixed status, recording the timeouts it got"""
+
+    def __init__(self, status=200, retry_after=None):
+        self.status = status
+        self.retry_after = retry_after
+        self.timeouts = []
+
+    def post(self, url, headers=None, json=None, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        response = requests.Response()
+        response.status_code = self.status
+        response.url = url
+        response._content = b'{}'
+        if self.retry_after is not None:
+            response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+
+def test_deadline_basics():
+    """Stage timeouts are capped at the time left and refuse to start when it runs out"""
+    print("Testing Deadline...")
+    now = [100.0]
+    deadline = Deadline(10, clock=lambda: now[0])
+    assert deadline.timeout(30) == 10
+    assert deadline.timeout(5) == 5
+    assert stage_timeout(None, 25) == 25
+    now[0] += 7
+    assert stage_timeout(deadline, 25) == 3
+    now[0] += 2
+    try:
+        deadline.timeout(30, stage='Imagen')
+        assert False, "expected DeadlineExceeded"
+    except DeadlineExceeded as e:
+        assert e.stage == 'Imagen'
+    now[0] += 5
+    assert deadline.expired and deadline.remaining() == 0
+    print("✓ Deadline shrinks stage timeouts")
+
+
+def test_upstream_attempts_capped():
+    """Each attempt's timeout is cut to the deadline, and retries that can't fit are skipped"""
+    print("Testing upstream calls under a deadline...")
+    session = RecordingSession()
+    original = upstream_client.get_session
+    upstream_client.get_session = lambda url: session
+    url = 'https://deadline.test/v1/chat/completions'
+    try:
+        upstream_client.post(url, json={'n': 1}, timeout=90, deadline=Deadline(3))
+        connect, read = session.timeouts[-1]
+        assert read <= 3 and connect <= 3, session.timeouts[-1]
+
+        # A 503 asking for a 5s wait is returned as-is when only 3s are left
+        session.status, session.retry_after = 503, 5
+        started = time.monotonic()
+        response = upstream_client.post(url, json={'n': 2}, timeout=90, deadline=Deadline(3))
+        assert response.status_code == 503 and time.monotonic() - started < 1
+        assert len(session.timeouts) == 2
+
+        try:
+            upstream_client.post(url, json={'n': 3}, timeout=90, deadline=Deadline(0.5))
+            assert False, "expected DeadlineExceeded"
+        except DeadlineExceeded:
+            pass
+        assert len(session.timeouts) == 2
+    finally:
+        upstream_client.get_session = original
+        upstream_client.breaker_for(url).reset()
+    print("✓ Attempts capped at the deadline")
+
+
+def test_slideshow_returns_partial_images():
+    """Images still pending at the deadline are dropped; finished ones are returned"""
+    print("Testing partial slideshow at the deadline...")
+    original = app_module.generate_image_imagen
+
+    def fake_imagen(prompt, deadline=None):
+        time.sleep(0.05 if prompt != 'slow' else 5)
+        return prompt.encode()
+
+    app_module.generate_image_imagen = fake_imagen
+    try:
+        started = time.monotonic()
+        images, errors = app_module.generate_slideshow_images(['a', 'slow', 'b', 'c', 'd', 'e'], 'imagen',
+                                                              deadline=Deadline(0.5))
+        elapsed = time.monotonic() - started
+    finally:
+        app_module.generate_image_imagen = original
+
+    assert elapsed < 1.0, elapsed
+    assert images == [b'a', None, b'b', b'c', b'd', b'e'], images
+    assert errors and 'Timed out' in errors[0]
+    print(f"✓ 5 of 6 images returned after {elapsed:.2f}s")
+
+
+def main():
+    tests = [test_deadline_basics, test_upstream_attempts_capped, test_slideshow_returns_partial_images]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
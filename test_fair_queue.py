@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script for weighted fair scheduling of slideshow work between users
+"""
+
+import sys
+import time
+import uuid
+import threading
+import job_queue
+from fair_queue import FairQueue, TIER_FREE, TIER_PAID
+from work_pool import BoundedPool
+from app import app
+from testing_helpers import make_user
+
+
+def test_paid_flows_get_their_weight():
+    """With both tiers backlogged, a paid user is served four times as often as a free one"""
+    print("Testing weighted dispatch...")
+    queue = FairQueue()
+    for i in range(20):
+        queue.push(('free', i), flow='free-user', tier=TIER_FREE)
+        queue.push(('paid', i), flow='paid-user', tier=TIER_PAID)
+    first = [queue.pop()[0] for _ in range(10)]
+    assert first.count('paid') == 8 and first.count('free') == 2, first
+    print("✓ Paid flow got 4x the service")
+
+
+def test_backlog_does_not_block_newcomers():
+    """A user who queued a lot first doesn't delay the next user's first item"""
+    print("Testing hog isolation...")
+    queue = FairQueue()
+    for i in range(12):
+        queue.push(('hog', i), flow=1)
+    queue.pop()
+    queue.push(('newcomer', 0), flow=2)
+    order = [queue.pop()[0] for _ in range(3)]
+    assert 'newcomer' in order[:2], order
+    print("✓ Newcomer served within one item of the hog")
+
+
+def test_pool_dispatches_fairly():
+    print("Testing fair pool dispatch...")
+    pool = BoundedPool('test', max_workers=1, max_queued=10)
+    release = threading.Event()
+    order = []
+    blocker = pool.submit(release.wait, 5)
+    time.sleep(0.05)
+    hog = pool.submit_all([(order.append, ('hog',), {}) for _ in range(5)], flow='hog', tier=TIER_FREE)
+    paid = pool.submit_all([(order.append, ('paid',), {})], flow='paid', tier=TIER_PAID)
+    release.set()
+    for future in [blocker] + hog + paid:
+        future.result(timeout=5)
+    assert order.index('paid') <= 1, order
+    stats = pool.stats()
+    assert stats['tiers'][TIER_PAID]['wait_p95_ms'] is not None
+    assert stats['tiers'][TIER_FREE]['wait_p95_ms'] is not None
+    print("✓ Paid call jumped the hog's backlog")
+
+
+def test_claims_are_fair_between_users():
+    """Workers take a light user's job before the rest of a heavy user's backlog, paid before free"""
+    print("Testing fair job claims...")
+    hog, light, paid = make_user('fair'), make_user('fair'), make_user('fair', is_paid=True)
+    ours = {}
+    with app.app_context():
+        for user_id in (hog, hog, hog, light, paid):
+            job_id = uuid.uuid4().hex
+            job_queue.enqueue(job_id, user_id, {})
+            ours[job_id] = user_id
+            time.sleep(0.01)
+
+        claimed = []
+        for _ in range(20):
+            job = job_queue.claim_next('test-worker')
+            if job is None:
+                break
+            if job.id in ours:
+                claimed.append(ours[job.id])
+                job_queue.complete(job, {})
+            else:
+                job_queue.fail(job, 'test cleanup')
+        assert claimed == [paid, hog, light, hog, hog], claimed
+
+        waits = job_queue.queue_wait_stats()
+        assert waits[TIER_PAID]['jobs'] >= 1 and waits[TIER_PAID]['wait_p95_ms'] is not None
+        assert waits[TIER_FREE]['jobs'] >= 4
+    print("✓ Claimed in weighted fair order")
+
+
+def main():
+    tests = [test_paid_flows_get_their_weight, test_backlog_does_not_block_newcomers,
+             test_pool_dispatches_fairly, test_claims_are_fair_between_users]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test script for the fast JSON layer (Flask provider, session serializer, stdlib fallback)
+"""
+
+import sys
+import json
+import pickle
+import uuid
+from decimal import Decimal
+from datetime import datetime
+import fast_json
+from flask.json.provider import DefaultJSONProvider
+from fast_json import FastJSONProvider, SessionSerializer
+from app import app
+
+
+def test_provider_matches_flask_output():
+    """jsonify output parses to what Flask's stdlib provider produces, dates included"""
+    print("Testing Flask JSON provider...")
+    payload = {'b': 1, 'a': [1.5, None, True], 'when': datetime(2024, 5, 1, 12, 30),
+               'price': Decimal('9.99'), 'id': uuid.UUID(int=7), 'name': 'café'}
+    with app.app_context():
+        fast = FastJSONProvider(app)
+        expected = json.loads(DefaultJSONProvider(app).dumps(payload))
+        assert json.loads(fast.dumps(payload)) == expected
+        assert expected['when'] == 'Wed, 01 May 2024 12:30:00 GMT'
+        assert json.loads(fast.dumps({3: 'int key'})) == {'3': 'int key'}
+        assert list(json.loads(fast.dumps(payload))) == sorted(expected)  # keys sorted, like Flask
+        assert fast.loads(b'{"x": [1, 2]}') == {'x': [1, 2]}
+        assert fast.dumps({'a': 1}, indent=4) == json.dumps({'a': 1}, indent=4)
+
+        response = app.test_client().get('/health')
+        assert response.is_json and response.get_json() is not None
+    print("✓ Same documents as the stdlib provider")
+
+
+def test_session_serializer_reads_old_pickles():
+    print("Testing session serializer...")
+    serializer = SessionSerializer()
+    session = {'_user_id': '5', '_fresh': True, 'prompt_result': {'improved_prompt': 'a brass lamp'},
+               '_flashes': [('info', 'Saved')]}
+    stored = serializer.dumps(session)
+    assert stored.startswith(b'{')
+    assert serializer.loads(stored)['_flashes'] == [['info', 'Saved']]
+    assert serializer.loads(pickle.dumps(session)) == session
+
+    odd = {'login': datetime(2024, 1, 1), 'tags': {'a'}}
+    assert serializer.loads(serializer.dumps(odd)) == odd  # JSON can't hold a set: kept as a pickle
+    try:
+        serializer.loads(b'{not json')
+        assert False, "garbage accepted"
+    except pickle.UnpicklingError:
+        pass
+    print("✓ JSON rows written, pickled rows still read")
+
+
+def test_stdlib_fallback():
+    """Without orjson every helper gives the same results through the stdlib"""
+    print("Testing stdlib fallback...")
+    payload = {'z': [1, 2, {'y': 'é'}], 'a': None, '1': 2}
+    fast = (fast_json.dumps(payload, sort_keys=True), fast_json.loads(b'{"a": [1]}'))
+    original = fast_json.BACKEND
+    fast_json.BACKEND = 'json'
+    try:
+        slow = (fast_json.dumps(payload, sort_keys=True), fast_json.loads(b'{"a": [1]}'))
+        with app.app_context():
+            assert json.loads(FastJSONProvider(app).dumps(payload)) == {'z': [1, 2, {'y': 'é'}], 'a': None, '1': 2}
+    finally:
+        fast_json.BACKEND = original
+    assert fast == slow, (fast, slow)
+    assert fast_json.dumps(2 ** 70) == str(2 ** 70)  # past orjson's range: stdlib takes it
+    print("✓ Stdlib fallback gives identical output")
+
+
+def main():
+    tests = [test_provider_matches_flask_output, test_session_serializer_reads_old_pickles, test_stdlib_fallback]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for serving generated files (sendfile, X-Accel-Redirect, X-Sendfile)
+"""
+
+import io
+import sys
+import uuid
+import file_serving
+from storage import get_storage
+from app import app, db, User
+from models import GeneratedAsset
+
+BODY = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 8
+
+
+def stored_file():
+    return get_storage('local').put(io.BytesIO(BODY + uuid.uuid4().bytes), 'png')
+
+
+def test_flask_mode_caching_and_ranges():
+    """Stored files get a strong ETag, immutable caching, 304s and byte ranges"""
+    print("Testing sendfile mode...")
+    stored = stored_file()
+    client = app.test_client()
+    try:
+        response = client.get(f'/generated/{stored.key}')
+        assert response.status_code == 200
+        assert response.headers['ETag'] == f'"{stored.sha256}"'
+        cache_control = response.headers['Cache-Control']
+        assert 'immutable' in cache_control and 'public' in cache_control and 'max-age=31536000' in cache_control
+        assert response.headers['Content-Type'] == 'image/png'
+        assert response.data.startswith(BODY)
+        response.close()
+
+        response = client.get(f'/generated/{stored.key}', headers={'If-None-Match': f'"{stored.sha256}"'})
+        assert response.status_code == 304 and not response.data
+
+        response = client.get(f'/generated/{stored.key}', headers={'Range': 'bytes=8-15'})
+        assert response.status_code == 206
+        assert response.data == bytes(range(8))
+        assert response.headers['Content-Range'] == f'bytes 8-15/{stored.size}'
+        response.close()
+
+        assert client.get('/generated/../../app.py').status_code == 404
+    finally:
+        get_storage('local').delete(stored.key)
+    # Once the sweeper has deleted the object, old URLs are a 404, not a 500
+    for mode in file_serving.MODES:
+        original = file_serving.FILE_SERVING_MODE
+        file_serving.FILE_SERVING_MODE = mode
+        try:
+            assert client.get(f'/generated/{stored.key}').status_code == 404, mode
+        finally:
+            file_serving.FILE_SERVING_MODE = original
+    print("✓ ETag, immutable, 304 and 206")
+
+
+def test_proxy_modes():
+    """x-accel and x-sendfile hand the file to the proxy and keep the caching headers"""
+    print("Testing proxy modes...")
+    stored = stored_file()
+    local = get_storage('local')
+    client = app.test_client()
+    original = file_serving.FILE_SERVING_MODE
+    try:
+        file_serving.FILE_SERVING_MODE = 'x-accel'
+        response = client.get(f'/generated/{stored.key}')
+        assert response.status_code == 200 and response.data == b''
+        assert response.headers['X-Accel-Redirect'] == f'/_protected/generated/{stored.key}'
+        assert response.headers['ETag'] == f'"{stored.sha256}"'
+        assert 'immutable' in response.headers['Cache-Control']
+        response = client.get(f'/generated/{stored.key}', headers={'If-None-Match': f'"{stored.sha256}"'})
+        assert response.status_code == 304 and 'X-Accel-Redirect' not in response.headers
+
+        file_serving.FILE_SERVING_MODE = 'x-sendfile'
+        response = client.get(f'/generated/{stored.key}')
+        assert response.headers['X-Sendfile'] == local.local_path(stored.key)
+        assert response.data == b''
+    finally:
+        file_serving.FILE_SERVING_MODE = original
+        local.delete(stored.key)
+    print("✓ Proxy headers set")
+
+
+def test_download_is_private_attachment():
+    print("Testing download headers...")
+    stored = stored_file()
+    with app.app_context():
+        user = User()
+        user.email = f"serving-{uuid.uuid4().hex[:8]}@example.com"
+        user.set_password('testpassword123')
+        db.session.add(user)
+        db.session.commit()
+        batch_id = uuid.uuid4().hex[:12]
+        db.session.add(GeneratedAsset(batch_id=batch_id, user_id=user.id, filename='scene_1.png', backend='local',
+                                      storage_key=stored.key, content_type=stored.content_type, size=stored.size,
+                                      sha256=stored.sha256))
+        db.session.commit()
+        user_id = user.id
+
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'test-secret-key'
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    original = file_serving.FILE_SERVING_MODE
+    try:
+        for mode in ('flask', 'x-accel'):
+            file_serving.FILE_SERVING_MODE = mode
+            response = client.get(f'/download-image/{batch_id}/scene_1.png')
+            assert response.status_code == 200, (mode, response.status_code)
+            assert 'attachment; filename=scene_1.png' in response.headers['Content-Disposition']
+            cache_control = response.headers['Cache-Control']
+            assert 'private' in cache_control and 'public' not in cache_control and 'immutable' in cache_control
+            response.close()
+    finally:
+        file_serving.FILE_SERVING_MODE = original
+        get_storage('local').delete(stored.key)
+    print("✓ Private attachment in both modes")
+
+
+def main():
+    tests = [test_flask_mode_caching_and_ranges, test_proxy_modes, test_download_is_private_attachment]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Test script for the perceptual-hash product analysis cache
+Upstream OpenAI calls are replaced with local fakes; the hashing checks need Pillow
+"""
+
+import io
+import sys
+import time
+import uuid
+import random
+import app as app_module
+import upstream_client
+import image_cache as image_cache_module
+from image_cache import (ImageAnalysisCache, MultiIndexHash, perceptual_hash, color_signature, color_distance,
+                         analysis_scope, hamming)
+
+
+def product_photo(seed, size=(1200, 900)):
+    from PIL import Image, ImageDraw, ImageFilter
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y, w = rng.randrange(size[0]), rng.randrange(size[1]), rng.randrange(50, 500)
+        draw.ellipse([x, y, x + w, y + w * rng.random() + 20], fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image.filter(ImageFilter.GaussianBlur(3))
+
+
+def mug_photo(color):
+    """The same mug, drawn in color on a fixed background"""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (1000, 800), (235, 230, 220))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([420, 300, 560, 520], fill=color)
+    draw.ellipse([530, 350, 620, 460], outline=color, width=20)
+    return image
+
+
+def encode(image, quality=90, fmt='JPEG'):
+    output = io.BytesIO()
+    image.save(output, format=fmt, quality=quality)
+    return output.getvalue()
+
+
+def test_hash_tolerates_edits():
+    """Re-compression, resizing and a small crop stay within the threshold; other photos don't"""
+    print("Testing perceptual hash tolerance...")
+    if image_cache_module.Image is None:
+        print("✓ Skipped (Pillow not installed)")
+        return
+    photo = product_photo(1)
+    original, original_color = perceptual_hash(encode(photo)), color_signature(encode(photo))
+    width, height = photo.size
+    edits = [
+        encode(photo, quality=40),
+        encode(photo.resize((600, 450))),
+        encode(photo, fmt='PNG'),
+        encode(photo.crop((int(width * 0.03), int(height * 0.03), int(width * 0.97), int(height * 0.97)))),
+    ]
+    for edited in edits:
+        distance = hamming(original, perceptual_hash(edited))
+        assert distance <= image_cache_module.IMAGE_CACHE_MAX_DISTANCE, distance
+        color_gap = color_distance(original_color, color_signature(edited))
+        assert color_gap <= image_cache_module.IMAGE_CACHE_MAX_COLOR_DISTANCE, color_gap
+    others = [hamming(original, perceptual_hash(encode(product_photo(seed)))) for seed in range(2, 12)]
+    assert min(others) > image_cache_module.IMAGE_CACHE_MAX_DISTANCE, others
+    assert perceptual_hash(b'not an image') is None and color_signature(b'not an image') is None
+    print(f"✓ Edits stay close, other products are {min(others)}+ bits away")
+
+
+def test_multi_index_search():
+    """Radius search finds exactly what a linear scan finds, fast at 100k hashes"""
+    print("Testing multi-index hash search at 100k...")
+    rng = random.Random(7)
+    index = MultiIndexHash()
+    hashes = [rng.getrandbits(64) for _ in range(100000)]
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+    assert len(index) == 100000
+
+    queries = []
+    for i in range(100):
+        value = hashes[i]
+        for bit in rng.sample(range(64), rng.randrange(0, 10)):
+            value ^= 1 << bit
+        queries.append(value)
+
+    started = time.perf_counter()
+    results = [index.search(query, 8) for query in queries]
+    per_lookup_ms = (time.perf_counter() - started) / len(queries) * 1000
+    for query, found in zip(queries[:10], results):
+        expected = sorted((hamming(query, value), i) for i, value in enumerate(hashes) if hamming(query, value) <= 8)
+        assert sorted(found) == expected
+    assert per_lookup_ms < 10, per_lookup_ms
+    print(f"✓ {per_lookup_ms:.2f}ms per lookup")
+
+
+def test_cache_persists_across_restarts():
+    """A fresh cache (new worker) finds descriptions stored by another"""
+    print("Testing persistence...")
+    scope = analysis_scope('gpt-4o', uuid.uuid4().hex)
+    value = random.getrandbits(64)  # covers hashes that don't fit a signed BIGINT
+    color = bytes([200, 55] + [0] * 10).hex()
+    with app_module.app.app_context():
+        ImageAnalysisCache().store(value | (1 << 63), color, scope, 'A white leather sneaker')
+        restarted = ImageAnalysisCache()
+        hit = restarted.lookup((value | (1 << 63)) ^ 0b101, color, scope)
+        assert hit == ('A white leather sneaker', 2), hit
+        assert restarted.lookup(value | (1 << 63), color, analysis_scope('gpt-4o', 'other')) is None
+    print("✓ Descriptions reloaded from the database")
+
+
+def test_reupload_skips_vision():
+    """The same product re-uploaded (re-compressed) reuses the stored description"""
+    print("Testing reuse without an upstream call...")
+    if image_cache_module.Image is None:
+        print("✓ Skipped (Pillow not installed)")
+        return
+    calls = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'choices': [{'message': {'content': f"description {len(calls)}"}}]}
+
+    def fake_post(url, headers=None, json=None, timeout=None, **kwargs):
+        calls.append(url)
+        return FakeResponse()
+
+    photo = product_photo(random.randrange(1000, 10 ** 9))
+    original_post, original_key, original_cache = upstream_client.post, app_module.OPENAI_API_KEY, app_module.image_cache
+    upstream_client.post = fake_post
+    app_module.OPENAI_API_KEY = 'test-key'
+    app_module.image_cache = ImageAnalysisCache(use_db=False)
+    try:
+        with app_module.app.app_context():
+            first = app_module.analyze_product_image(encode(photo))
+            second = app_module.analyze_product_image(encode(photo.resize((800, 600)), quality=50))
+            third = app_module.analyze_product_image(encode(product_photo(3)))
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY, app_module.image_cache = original_post, original_key, original_cache
+
+    assert first == second == 'description 1'
+    assert third == 'description 2' and len(calls) == 2
+    print("✓ Re-upload served from cache")
+
+
+def test_recolored_product_misses():
+    """The same product in another color hashes alike but gets its own description"""
+    print("Testing recolored product...")
+    if image_cache_module.Image is None:
+        print("✓ Skipped (Pillow not installed)")
+        return
+    red, blue = encode(mug_photo((200, 30, 40))), encode(mug_photo((30, 60, 200)))
+    assert hamming(perceptual_hash(red), perceptual_hash(blue)) <= image_cache_module.IMAGE_CACHE_MAX_DISTANCE
+    assert color_distance(color_signature(red), color_signature(blue)) > image_cache_module.IMAGE_CACHE_MAX_COLOR_DISTANCE
+
+    descriptions = iter(['A red ceramic mug', 'A blue ceramic mug'])
+
+    class FakeResponse:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'choices': [{'message': {'content': next(descriptions)}}]}
+
+    original_post, original_key, original_cache = upstream_client.post, app_module.OPENAI_API_KEY, app_module.image_cache
+    upstream_client.post = lambda url, **kwargs: FakeResponse()
+    app_module.OPENAI_API_KEY = 'test-key'
+    app_module.image_cache = ImageAnalysisCache(use_db=False)
+    try:
+        with app_module.app.app_context():
+            results = [app_module.analyze_product_image(photo)
+                       for photo in (red, blue, encode(mug_photo((30, 60, 200)), quality=50))]
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY, app_module.image_cache = original_post, original_key, original_cache
+
+    assert results == ['A red ceramic mug', 'A blue ceramic mug', 'A blue ceramic mug'], results
+    print("✓ Blue mug analyzed again, then reused")
+
+
+def main():
+    tests = [test_hash_tolerates_edits, test_multi_index_search,
+             test_cache_persists_across_restarts, test_reupload_skips_vision, test_recolored_product_misses]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test script for vision image preprocessing
+MIME sniffing and the no-Pillow fallback always run; the resize checks need Pillow
+"""
+
+import io
+import sys
+import image_preprocess
+import rate_limiter
+from image_preprocess import prepare_for_vision, sniff_mime, data_url
+from rate_limiter import estimate_tokens
+
+
+def make_image(size, mode='RGB', orientation=None, fmt='JPEG'):
+    from PIL import Image
+    image = Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40))
+    output = io.BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[image_preprocess.EXIF_ORIENTATION] = orientation
+        image.save(output, format=fmt, exif=exif)
+    else:
+        image.save(output, format=fmt)
+    return output.getvalue()
+
+
+def test_sniff_and_fallback():
+    """Magic bytes decide the MIME type; undecodable uploads pass through unchanged"""
+    print("Testing MIME sniffing and fallback...")
+    assert sniff_mime(b'\xff\xd8\xff\xe0rest') == 'image/jpeg'
+    assert sniff_mime(b'\x89PNG\r\n\x1a\nrest') == 'image/png'
+    assert sniff_mime(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert sniff_mime(b'GIF89a...') == 'image/gif'
+    assert sniff_mime(b'%PDF-1.7') is None
+
+    prepared = prepare_for_vision(b'\x89PNG\r\n\x1a\nnot really a png')
+    assert prepared.data == b'\x89PNG\r\n\x1a\nnot really a png'
+    assert prepared.mime == 'image/png' and prepared.detail == 'auto'
+    assert data_url(prepared).startswith('data:image/png;base64,')
+    print("✓ Sniffing and fallback work")
+
+
+def test_low_detail_tokens():
+    """detail=low images are budgeted at 85 tokens instead of the high-detail estimate"""
+    print("Testing vision token estimates...")
+    def payload(detail):
+        return {'messages': [{'role': 'user', 'content': [
+            {'type': 'image_url', 'image_url': {'url': 'data:,', 'detail': detail}}]}]}
+    assert estimate_tokens(payload('low')) == 85
+    assert estimate_tokens(payload('high')) == rate_limiter.IMAGE_TOKEN_ESTIMATE
+    print("✓ Token estimates follow the detail level")
+
+
+def test_downscale_and_orient():
+    """Large uploads are shrunk to the max edge, EXIF-rotated, and given the right MIME/detail"""
+    print("Testing downscale and orientation...")
+    if image_preprocess.Image is None:
+        print("✓ Skipped (Pillow not installed)")
+        return
+
+    big = make_image((4000, 3000))
+    prepared = prepare_for_vision(big, max_edge=1024)
+    assert (prepared.width, prepared.height) == (1024, 768)
+    assert prepared.mime == 'image/jpeg' and prepared.detail == 'high'
+    assert len(prepared.data) < len(big)
+
+    # Orientation 6 = rotate 90° clockwise on display
+    rotated = prepare_for_vision(make_image((800, 400), orientation=6), max_edge=1024)
+    assert (rotated.width, rotated.height) == (400, 800)
+
+    transparent = prepare_for_vision(make_image((300, 200), mode='RGBA', fmt='PNG'))
+    assert transparent.detail == 'low'
+    assert transparent.mime in ('image/webp', 'image/png')
+    assert sniff_mime(transparent.data) == transparent.mime
+    print("✓ Uploads downscaled and oriented")
+
+
+def main():
+    tests = [test_sniff_and_fallback, test_low_detail_tokens, test_downscale_and_orient]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script for WebP/AVIF variants of generated slideshow images
+Needs Pillow for the encoding checks; the page fallback runs either way
+"""
+
+import os
+import sys
+import uuid
+import random
+import tempfile
+import image_variants
+from app import app, db, User
+
+
+def write_png(path, size=(1024, 1024)):
+    from PIL import Image, ImageDraw
+    rng = random.Random(path)
+    image = Image.new('RGB', size, (240, 240, 240))
+    draw = ImageDraw.Draw(image)
+    for _ in range(30):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse([x, y, x + rng.randrange(20, 300), y + rng.randrange(20, 300)],
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = Image.blend(image, Image.effect_noise(size, 30).convert('RGB'), 0.15)
+    image.save(path)
+
+
+def test_variants_written():
+    """Each PNG gets smaller WebP copies at every srcset width; broken files fall back to None"""
+    print("Testing variant generation...")
+    if not image_variants.available_formats():
+        print("✓ Skipped (Pillow not installed)")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        png = os.path.join(tmp, 'scene_0.png')
+        write_png(png)
+        broken = os.path.join(tmp, 'scene_1.png')
+        with open(broken, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\nnot really')
+
+        published = []
+
+        def publish(path):
+            published.append(os.path.basename(path))
+            return f"/files/{os.path.basename(path)}"
+
+        variant, missing = image_variants.generate_variants([png, broken], publish)
+        assert missing is None
+        assert (variant['width'], variant['height']) == (1024, 1024)
+        webp = next(source for source in variant['sources'] if source['type'] == 'image/webp')
+        assert webp['srcset'] == ('/files/scene_0-320.webp 320w, '
+                                  '/files/scene_0-640.webp 640w, '
+                                  '/files/scene_0-1024.webp 1024w')
+        assert variant['full'] == '/files/scene_0-1024.webp'
+        assert 'scene_0-640.webp' in published
+
+        png_size = os.path.getsize(png)
+        for width in (320, 640, 1024):
+            size = os.path.getsize(os.path.join(tmp, f'scene_0-{width}.webp'))
+            assert size < png_size / 4, (width, size, png_size)
+        assert not [name for name in os.listdir(tmp) if name.endswith('.tmp')]
+    print("✓ Variants written and much smaller than the PNG")
+
+
+def test_result_page_uses_srcset():
+    """The result page offers the variants via <picture>/srcset and downloads the PNG"""
+    print("Testing result page markup...")
+    with app.app_context():
+        user = User()
+        user.email = f"variants-{uuid.uuid4().hex[:8]}@example.com"
+        user.set_password('testpassword123')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    variant = {'sources': [{'type': 'image/webp', 'srcset': '/static/generated/b1/scene_2-320.webp 320w'}],
+               'full': '/static/generated/b1/scene_2-1024.webp', 'width': 1024, 'height': 1024}
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'test-secret-key'
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+        sess['slideshow_result'] = {
+            'images': ['/static/generated/b1/scene_2.png', '/static/generated/b1/scene_3.png'],
+            'image_variants': [variant, None],
+            'image_files': ['scene_2.png', 'scene_3.png'],
+            'scene_prompts': ['a', 'b', 'c', 'd'], 'product_description': 'x', 'provider': 'Imagen',
+            'provider_key': 'imagen', 'batch_id': 'b1', 'original_prompt': '', 'improved_prompt': '',
+            'num_generated': 2, 'num_failed': 2,
+        }
+    page = client.get('/slideshow-result').get_data(as_text=True)
+    assert 'srcset="/static/generated/b1/scene_2-320.webp 320w"' in page
+    assert 'data-full="/static/generated/b1/scene_2-1024.webp"' in page
+    assert '/download-image/b1/scene_2.png' in page and '/download-image/b1/scene_3.png' in page
+    assert page.count('<picture>') == 1
+    print("✓ srcset used, originals downloaded")
+
+
+def main():
+    tests = [test_variants_written, test_result_page_uses_srcset]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
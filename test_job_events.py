@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for progressive slideshow delivery (job events over long-poll and SSE)
+Upstream AI calls are replaced with local fakes, no network needed
+"""
+
+import io
+import sys
+import time
+import uuid
+import threading
+from testing_helpers import make_user, logged_in_client  # before app: temporary storage, uploads and DB
+import app as app_module
+import job_queue
+import job_events
+from app import app, db
+from stream_slots import StreamSlots
+
+
+def slow_imagen(prompt, deadline=None, dest=None):
+    # Scene 0 is ready at once, the others take a while
+    if not prompt.endswith(' 0'):
+        time.sleep(0.6)
+    with open(dest, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + prompt.encode() + uuid.uuid4().bytes)
+    return dest
+
+
+def run_job_in_background(job_id):
+    def run():
+        with app.app_context():
+            job = job_queue.get_job(job_id)
+            job_queue._mark_claimed(job, 'test-worker')
+            db.session.commit()
+            job_queue.run_job(job, app_module.process_slideshow_job)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_first_scene_arrives_before_the_job_finishes():
+    """Long-poll clients see stages and the first scene while the other images are still generating"""
+    print("Testing progressive delivery...")
+    user_id = make_user('events')
+    client = logged_in_client(user_id)
+    originals = (app_module.SLIDESHOW_WORKER_MODE, app_module.analyze_product_image,
+                 app_module.generate_ugc_scene_prompts, app_module.generate_image_imagen)
+    app_module.SLIDESHOW_WORKER_MODE = 'external'
+    app_module.analyze_product_image = lambda image_bytes, deadline=None: 'A blue ceramic mug'
+    app_module.generate_ugc_scene_prompts = lambda desc, prompt, num_scenes=4, deadline=None: [f'scene {i}' for i in range(num_scenes)]
+    app_module.generate_image_imagen = slow_imagen
+    thread = None
+    try:
+        response = client.post('/generate-slideshow', data={
+            'provider': 'imagen',
+            'product_image': (io.BytesIO(b'\xff\xd8\xff\xe0fakejpeg'), 'product.jpg'),
+        }, headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+        job_id = response.get_json()['job_id']
+        events_url = f'/slideshow-job/{job_id}/events'
+
+        empty = client.get(f'{events_url}?wait=0').get_json()
+        assert empty == {'events': [], 'last_id': 0, 'status': 'running'}, empty
+
+        thread = run_job_in_background(job_id)
+        seen, last_id, first_scene_status = [], 0, None
+        for _ in range(40):
+            data = client.get(f'{events_url}?after={last_id}&wait=5').get_json()
+            seen.extend(data['events'])
+            last_id = data['last_id']
+            if first_scene_status is None and any(e['event'] == 'scene' for e in seen):
+                first_scene_status = data['status']
+            if data['status'] != 'running':
+                break
+        assert first_scene_status == 'running', first_scene_status
+        assert data['status'] == 'done' and data['result_url'].endswith(job_id)
+
+        stages = [e['data']['stage'] for e in seen if e['event'] == 'stage']
+        assert stages == ['vision', 'scene_prompts', 'images', 'finishing'], stages
+        scene_events = [e['data'] for e in seen if e['event'] == 'scene']
+        assert scene_events[0]['index'] == 0 and scene_events[0]['completed'] == 1
+        assert sorted(e['index'] for e in scene_events) == [0, 1, 2, 3]
+        assert client.get(scene_events[0]['url']).status_code == 200
+
+        result = client.get(data['result_url']).get_data(as_text=True)
+        for event in scene_events:
+            assert event['url'] in result
+    finally:
+        if thread is not None:
+            thread.join(timeout=10)
+        (app_module.SLIDESHOW_WORKER_MODE, app_module.analyze_product_image,
+         app_module.generate_ugc_scene_prompts, app_module.generate_image_imagen) = originals
+    print("✓ First scene delivered while the job was still running")
+
+
+def test_sse_replays_from_last_event_id():
+    """The SSE stream carries event ids, resumes after Last-Event-ID and ends with the outcome"""
+    print("Testing SSE stream...")
+    user_id = make_user('events')
+    job_id = uuid.uuid4().hex
+    with app.app_context():
+        job_queue.enqueue(job_id, user_id, {})
+        ids = [job_events.publish(job_id, 'stage', {'stage': 'vision'}),
+               job_events.publish(job_id, 'stage', {'stage': 'scene_prompts'}),
+               job_events.publish(job_id, 'scene', {'index': 0, 'url': '/generated/x.png'})]
+        job_queue.fail(job_queue.get_job(job_id), 'Upstream exploded')
+
+    client = logged_in_client(user_id)
+    response = client.get(f'/slideshow-job/{job_id}/events',
+                          headers={'Accept': 'text/event-stream', 'Last-Event-ID': str(ids[0])})
+    assert response.headers['Content-Type'].startswith('text/event-stream')
+    body = response.get_data(as_text=True)
+    assert 'vision' not in body
+    assert f'id: {ids[1]}\nevent: stage' in body and f'id: {ids[2]}\nevent: scene' in body
+    assert body.rstrip().endswith('event: failed\ndata: {"error": "Upstream exploded"}'), body
+
+    other = logged_in_client(make_user('events'))
+    assert other.get(f'/slideshow-job/{job_id}/events').status_code == 404
+    print("✓ Resumed after Last-Event-ID, ended with the outcome")
+
+
+def test_streams_capped():
+    """Past the stream cap, SSE and long-polls answer at once with a retry delay; a slot is freed on close"""
+    print("Testing stream cap...")
+    user_id = make_user('events')
+    job_id = uuid.uuid4().hex
+    with app.app_context():
+        job_queue.enqueue(job_id, user_id, {})
+        job_events.publish(job_id, 'stage', {'stage': 'vision'})
+
+    client = logged_in_client(user_id)
+    original_slots = app_module.stream_slots
+    app_module.stream_slots = slots = StreamSlots(1)
+    try:
+        assert slots.try_acquire()  # another page's stream holds the only slot
+        started = time.monotonic()
+        body = client.get(f'/slideshow-job/{job_id}/events', headers={'Accept': 'text/event-stream'}).get_data(as_text=True)
+        assert body.startswith(f'retry: {int(app_module.STREAM_RETRY_SECONDS * 1000)}\n')
+        assert 'event: stage' in body and 'event: busy' in body
+        polled = client.get(f'/slideshow-job/{job_id}/events?after=0&wait=20').get_json()
+        assert polled['retry_after'] == app_module.STREAM_RETRY_SECONDS and len(polled['events']) == 1
+        assert time.monotonic() - started < 5
+        slots.release()
+
+        with app.app_context():
+            job_queue.fail(job_queue.get_job(job_id), 'Upstream exploded')
+        response = client.get(f'/slideshow-job/{job_id}/events', headers={'Accept': 'text/event-stream'},
+                              buffered=True)
+        assert 'event: failed' in response.get_data(as_text=True)
+        stats = slots.stats()
+        assert stats['open'] == 0 and stats['granted'] == 2 and stats['refused'] == 2, stats
+    finally:
+        app_module.stream_slots = original_slots
+    print("✓ Refused streams retry later, held slots are released")
+
+
+def main():
+    tests = [test_first_scene_arrives_before_the_job_finishes, test_sse_replays_from_last_event_id,
+             test_streams_capped]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
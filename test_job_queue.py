@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Test script for the slideshow job queue and worker
+Upstream AI calls are replaced with local fakes, no network needed
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import uuid
+import threading
+from testing_helpers import make_user, logged_in_client  # before app: temporary storage, uploads and DB
+import app as app_module
+import job_queue
+from app import app, db, SlideshowJob
+
+
+def test_claim_is_exclusive():
+    """Concurrent workers never claim the same job twice"""
+    print("Testing exclusive job claims...")
+    user_id = make_user('jobs')
+    with app.app_context():
+        job_ids = [uuid.uuid4().hex for _ in range(5)]
+        for job_id in job_ids:
+            job_queue.enqueue(job_id, user_id, {'n': job_id})
+
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(name):
+        with app.app_context():
+            while True:
+                job = job_queue.claim_next(name)
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job.id)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    mine = [j for j in claimed if j in job_ids]
+    assert sorted(mine) == sorted(job_ids), f"claimed {mine}"
+    print("✓ Each job claimed exactly once")
+
+
+def test_stale_jobs_requeued():
+    """A running job whose worker died goes back to the queue"""
+    print("Testing stale job recovery...")
+    user_id = make_user('jobs')
+    with app.app_context():
+        job = job_queue.enqueue(uuid.uuid4().hex, user_id, {})
+        job.status = SlideshowJob.STATUS_RUNNING
+        job.attempts = 1
+        job.claimed_at = job.created_at.replace(year=2000)
+        db.session.commit()
+        job_queue.requeue_stale(stale_seconds=60, max_attempts=2)
+        assert job_queue.get_job(job.id).status == SlideshowJob.STATUS_QUEUED
+        job_queue.fail(job_queue.get_job(job.id), 'test cleanup')
+    print("✓ Stale job requeued")
+
+
+def fake_imagen(prompt, deadline=None, dest=None):
+    with open(dest, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + prompt.encode())
+    return dest
+
+
+def test_route_enqueues_and_worker_completes():
+    """/generate-slideshow returns at once; the worker produces the result"""
+    print("Testing enqueue + worker round trip...")
+    user_id = make_user('jobs')
+    client = logged_in_client(user_id)
+    originals = (app_module.SLIDESHOW_WORKER_MODE, app_module.analyze_product_image,
+                 app_module.generate_ugc_scene_prompts, app_module.generate_image_imagen)
+    app_module.SLIDESHOW_WORKER_MODE = 'external'
+    app_module.analyze_product_image = lambda image_bytes, deadline=None: 'A white leather sneaker'
+    app_module.generate_ugc_scene_prompts = lambda desc, prompt, num_scenes=4, deadline=None: [f'scene {i}' for i in range(num_scenes)]
+    app_module.generate_image_imagen = fake_imagen
+    try:
+        started = time.monotonic()
+        response = client.post('/generate-slideshow', data={
+            'provider': 'imagen',
+            'product_image': (io.BytesIO(b'\xff\xd8\xff\xe0fakejpeg'), 'product.jpg'),
+        }, headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+        assert response.status_code == 202, response.status_code
+        assert time.monotonic() - started < 1.0
+        job_id = response.get_json()['job_id']
+        assert client.get(f'/slideshow-job/{job_id}').get_json()['status'] == 'queued'
+
+        # Older leftover jobs may be claimed first; keep going until ours has run
+        for _ in range(20):
+            job_queue.run_worker(app, app_module.process_slideshow_job, poll_interval=0.01, max_jobs=1)
+            status = client.get(f'/slideshow-job/{job_id}').get_json()
+            if status['status'] not in ('queued', 'running'):
+                break
+        assert status['status'] == 'done', status
+        page = client.get(status['result_url'])
+        assert page.status_code == 200
+        assert b'scene 3' in page.data
+    finally:
+        (app_module.SLIDESHOW_WORKER_MODE, app_module.analyze_product_image,
+         app_module.generate_ugc_scene_prompts, app_module.generate_image_imagen) = originals
+    print("✓ Job queued, processed and rendered")
+
+
+def test_staged_upload_removed_when_job_ends():
+    """The staged upload is deleted once a job fails, including jobs given up on as stale"""
+    print("Testing staged upload cleanup...")
+    user_id = make_user('jobs')
+    client = logged_in_client(user_id)
+    originals = (app_module.SLIDESHOW_WORKER_MODE, app_module.analyze_product_image)
+    app_module.SLIDESHOW_WORKER_MODE = 'external'
+    app_module.analyze_product_image = lambda image_bytes, deadline=None: None
+    try:
+        response = client.post('/generate-slideshow', data={
+            'provider': 'imagen',
+            'product_image': (io.BytesIO(b'\xff\xd8\xff\xe0fakejpeg'), 'product.jpg'),
+        }, headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+        job_id = response.get_json()['job_id']
+        with app.app_context():
+            job = job_queue.get_job(job_id)
+            upload_path = job_queue.job_payload(job)['upload_path']
+            assert os.path.exists(upload_path)
+            job_queue._mark_claimed(job, 'test-worker')
+            db.session.commit()
+            job_queue.run_job(job, app_module.process_slideshow_job)
+            assert job_queue.get_job(job_id).status == SlideshowJob.STATUS_FAILED
+        assert not os.path.exists(upload_path)
+    finally:
+        app_module.SLIDESHOW_WORKER_MODE, app_module.analyze_product_image = originals
+
+    staged = tempfile.NamedTemporaryFile(suffix='.upload', delete=False)
+    staged.close()
+    with app.app_context():
+        job = job_queue.enqueue(uuid.uuid4().hex, user_id, {'upload_path': staged.name})
+        job.status = SlideshowJob.STATUS_RUNNING
+        job.attempts = 2
+        job.claimed_at = job.created_at.replace(year=2000)
+        db.session.commit()
+        job_queue.requeue_stale(stale_seconds=60, max_attempts=2)
+        assert job_queue.get_job(job.id).status == SlideshowJob.STATUS_FAILED
+    assert not os.path.exists(staged.name)
+    print("✓ Staged uploads removed on failure and on giving up")
+
+
+def main():
+    tests = [test_claim_is_exclusive, test_stale_jobs_requeued, test_route_enqueues_and_worker_completes,
+             test_staged_upload_removed_when_job_ends]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
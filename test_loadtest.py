@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the load-test harness
+Covers the stats and comparison helpers; the full run needs gunicorn and is driven by hand
+"""
+
+import os
+import sys
+import json
+import tempfile
+import loadtest
+
+
+def test_percentiles_and_summary():
+    """Nearest-rank percentiles and per-route summaries come out as expected"""
+    print("Testing percentiles and summaries...")
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) in (50, 51)
+    assert loadtest.percentile(values, 95) == 95
+    assert loadtest.percentile(values, 100) == 100
+    assert loadtest.percentile([], 50) is None
+
+    samples = [(i / 1000.0, i != 7, 200 if i != 7 else 500) for i in range(1, 101)]
+    summary = loadtest.summarize(samples, 10)
+    assert summary['count'] == 100 and summary['errors'] == 1
+    assert summary['throughput_rps'] == 10
+    assert summary['p95_ms'] == 95 and summary['max_ms'] == 100
+    assert summary['statuses'] == {'200': 99, '500': 1}
+    assert loadtest.summarize([], 10)['p50_ms'] is None
+    print("✓ Stats computed correctly")
+
+
+def test_recorder_drops_warmup():
+    """Samples before the measurement window are dropped unless flagged as warmup-only"""
+    print("Testing warmup handling...")
+    recorder = loadtest.Recorder(measure_from=float('inf'))
+    recorder.record('/improve-prompt', 0.1, True, 302)
+    recorder.record('/login', 0.1, True, 302, during_warmup=True)
+    assert list(recorder.samples) == ['/login']
+    print("✓ Warmup samples dropped")
+
+
+def test_compare_output():
+    """--compare lines up runs by worker class and count"""
+    print("Testing result comparison...")
+    run = {'worker_class': 'gthread', 'workers': 1, 'threads': 8}
+    before = {'runs': [dict(run, routes={'/login': {'p50_ms': 100, 'p95_ms': 200, 'throughput_rps': 5, 'errors': 0}},
+                            total={'p50_ms': 100, 'p95_ms': 200, 'throughput_rps': 5, 'errors': 0})]}
+    after = {'runs': [dict(run, routes={'/login': {'p50_ms': 50, 'p95_ms': 100, 'throughput_rps': 10, 'errors': 0}},
+                           total={'p50_ms': 50, 'p95_ms': 100, 'throughput_rps': 10, 'errors': 0})]}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for name, data in (('before.json', before), ('after.json', after)):
+            paths.append(os.path.join(tmp, name))
+            with open(paths[-1], 'w') as f:
+                json.dump(data, f)
+        assert loadtest.compare(*paths) == 0
+    print("✓ Comparison printed")
+
+
+def test_prompt_tags_follow_the_seed():
+    """The same seed sends the same prompts; other users and runs never repeat them"""
+    print("Testing seeded prompt tags...")
+
+    def tags(seed, run_index, user_index):
+        user = loadtest.VirtualUser('http://test', 'load@example.com', None, 0, 0, 0, seed=seed,
+                                    run_index=run_index, user_index=user_index)
+        return [user.prompt_tag() for _ in range(5)]
+
+    assert tags(1, 0, 0) == tags(1, 0, 0)
+    assert tags(2, 0, 0) != tags(1, 0, 0)
+    assert len(set(tags(1, 0, 0) + tags(1, 0, 1) + tags(1, 1, 0))) == 15
+    print("✓ Prompt tags reproducible and distinct")
+
+
+def main():
+    tests = [test_percentiles_and_summary, test_recorder_drops_warmup, test_compare_output,
+             test_prompt_tags_follow_the_seed]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Test script for the local mock upstream server
+Runs mock_upstream.py on a local port and drives the real app helpers against it
+"""
+
+import os
+import sys
+import uuid
+import tempfile
+import threading
+from werkzeug.serving import make_server
+import requests
+import app as app_module
+import upstream_client
+import mock_upstream
+
+FAST = {'latency_dist': 'fixed', 'latency_ms': 5, 'imagen_latency_ms': 5, 'stream_chunk_ms': 0,
+        'image_kb': 20, 'completion_words': 30, 'error_rate': 0, 'rate_limit_rate': 0, 'retry_after': 0}
+
+
+def start_mock():
+    server = make_server('127.0.0.1', 0, mock_upstream.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def configure(base, **settings):
+    response = requests.post(f"{base}/mock/config", json=dict(FAST, **settings), timeout=5)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+class PointedAtMock:
+    """Temporarily point app.py's upstream URLs and keys at the mock"""
+
+    def __init__(self, base):
+        self.base = base
+
+    def __enter__(self):
+        self.saved = (app_module.OPENAI_CHAT_URL, app_module.IMAGEN_PREDICT_URL,
+                      app_module.OPENAI_API_KEY, app_module.GOOGLE_API_KEY)
+        app_module.OPENAI_CHAT_URL = f"{self.base}/v1/chat/completions"
+        app_module.IMAGEN_PREDICT_URL = f"{self.base}/v1beta/models/imagen-4.0-generate-001:predict"
+        app_module.OPENAI_API_KEY = app_module.GOOGLE_API_KEY = 'mock'
+        return self
+
+    def __exit__(self, *exc):
+        (app_module.OPENAI_CHAT_URL, app_module.IMAGEN_PREDICT_URL,
+         app_module.OPENAI_API_KEY, app_module.GOOGLE_API_KEY) = self.saved
+
+
+def test_app_helpers_against_mock():
+    """Every upstream helper in app.py works end to end against the mock"""
+    print("Testing app helpers against the mock...")
+    server, base = start_mock()
+    try:
+        configure(base)
+        with PointedAtMock(base), app_module.app.app_context():
+            analysis, improved = app_module.improve_prompt_with_ai(f"Build a habit tracker {uuid.uuid4().hex}")
+            assert analysis and improved
+            assert app_module.analyze_product_image(b'\xff\xd8\xff\xe0fake')
+            scenes = app_module.generate_ugc_scene_prompts('a white sneaker', 'cozy morning light', num_scenes=3)
+            assert len(scenes) == 3 and scenes[0].startswith('Scene 1')
+            image = app_module.generate_image_imagen('a white sneaker on a desk')
+            assert image.startswith(b'\x89PNG') and len(image) > 15 * 1024
+            dest = os.path.join(tempfile.mkdtemp(), 'scene_0.png')
+            assert app_module.generate_image_imagen('a white sneaker on a desk', dest=dest) == dest
+            with open(dest, 'rb') as f:
+                streamed = f.read()
+            assert streamed.startswith(b'\x89PNG') and len(streamed) > 15 * 1024
+
+            deltas = []
+            text = app_module.stream_chat_completion(
+                {'model': 'gpt-3.5-turbo', 'messages': [{'role': 'user', 'content': 'hi'}]},
+                app_module.openai_headers(), 10, 'mock.stream', deltas.append, threading.Event())
+            assert text and len(deltas) == 30
+        stats = requests.get(f"{base}/mock/stats", timeout=5).json()
+        assert stats['imagen'] == 2 and stats['chat.stream'] == 1
+    finally:
+        server.shutdown()
+    print("✓ Chat, JSON mode, vision, streaming and Imagen shapes served")
+
+
+def test_failure_injection():
+    """Injected 429s carry Retry-After, injected errors are 5xx, bad keys get 401"""
+    print("Testing failure injection...")
+    server, base = start_mock()
+    url = f"{base}/v1/chat/completions"
+    body = {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': 'hi'}]}
+    try:
+        configure(base, rate_limit_rate=1.0, retry_after=0)
+        response = requests.post(url, json=body, headers={'Authorization': 'Bearer mock'}, timeout=5)
+        assert response.status_code == 429 and response.headers['Retry-After'] == '0.0'
+
+        configure(base, error_rate=1.0)
+        response = requests.post(url, json=body, headers={'Authorization': 'Bearer mock'}, timeout=5)
+        assert response.status_code in (500, 503)
+
+        assert requests.post(url, json=body, timeout=5).status_code == 401
+        assert requests.post(f"{base}/mock/config", json={'nope': 1}, timeout=5).status_code == 400
+    finally:
+        server.shutdown()
+        upstream_client.breaker_for(url).reset()
+    print("✓ Failures injected as configured")
+
+
+def test_latency_distributions():
+    """Each latency distribution yields non-negative samples around the configured value"""
+    print("Testing latency distributions...")
+    for dist in ('fixed', 'uniform', 'normal', 'lognormal', 'exponential'):
+        cfg = dict(FAST, latency_dist=dist, latency_jitter=0.3)
+        samples = [mock_upstream.sample_latency(200, cfg) for _ in range(2000)]
+        assert min(samples) >= 0
+        median = sorted(samples)[len(samples) // 2]
+        assert 0.1 < median < 0.3, (dist, median)
+    print("✓ Latency distributions sane")
+
+
+def main():
+    tests = [test_app_helpers_against_mock, test_failure_injection, test_latency_distributions]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
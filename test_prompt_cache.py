@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script for the prompt improvement cache
+Covers key normalization, LRU eviction, TTL expiry and the shared DB tier
+"""
+
+import sys
+import time
+import uuid
+from app import app
+from prompt_cache import PromptCache, make_key, normalize_prompt, prompt_version, PURGE_EVERY
+
+
+def test_key_normalization():
+    """Whitespace-only differences map to the same key"""
+    print("Testing cache key normalization...")
+    assert normalize_prompt('  Build   a\n\ttodo app ') == 'Build a todo app'
+    v = prompt_version({'model': 'gpt-3.5-turbo', 'messages': [{'role': 'system', 'content': 'x'}]})
+    assert make_key('Build  a todo app', 'app_builder', None, v) == make_key('Build a todo app\n', 'app_builder', None, v)
+    assert make_key('Build a todo app', 'image_video', 'flux', v) != make_key('Build a todo app', 'image_video', 'dalle3', v)
+    v2 = prompt_version({'model': 'gpt-3.5-turbo', 'messages': [{'role': 'system', 'content': 'y'}]})
+    assert v != v2
+    print("✓ Keys normalized and versioned")
+
+
+def test_lru_eviction_and_ttl():
+    """Memory tier evicts least recently used entries and expires old ones"""
+    print("Testing LRU eviction and TTL...")
+    cache = PromptCache(max_entries=2, ttl=60, use_db=False)
+    cache.set('a', 'A1', 'A2')
+    cache.set('b', 'B1', 'B2')
+    assert cache.get('a') == ('A1', 'A2')  # 'a' is now most recently used
+    cache.set('c', 'C1', 'C2')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()['evictions'] == 1
+
+    short = PromptCache(max_entries=10, ttl=0.05, use_db=False)
+    short.set('x', 'X1', 'X2')
+    time.sleep(0.1)
+    assert short.get('x') is None
+    assert short.stats()['expirations'] == 1
+    print("✓ LRU and TTL working")
+
+
+def test_db_tier_shared():
+    """A second cache instance (another worker) finds entries through the DB"""
+    print("Testing shared DB tier...")
+    key = uuid.uuid4().hex
+    with app.app_context():
+        worker_a = PromptCache(use_db=True)
+        worker_b = PromptCache(use_db=True)
+        worker_a.set(key, 'analysis', 'improved', tool_type='app_builder')
+        assert worker_b.get(key) == ('analysis', 'improved')
+        stats = worker_b.stats()
+        assert stats['db_hits'] == 1 and stats['memory_hits'] == 0
+        assert worker_b.get(key) == ('analysis', 'improved')
+        assert worker_b.stats()['memory_hits'] == 1
+    print("✓ DB tier shared between instances")
+
+
+def test_uncounted_stores_never_purge():
+    """Stream results (record_stats=False) don't trigger the expired-row purge"""
+    print("Testing purge pacing...")
+    with app.app_context():
+        cache = PromptCache(use_db=True)
+        purges = []
+        cache.purge_expired = lambda: purges.append(1) or 0
+        for _ in range(3):
+            cache.set(f"stream:{uuid.uuid4().hex}", 'a', 'b', tool_type='stream', record_stats=False)
+        assert purges == [] and cache.stats()['stores'] == 0
+        cache._counters['stores'] = PURGE_EVERY - 1
+        cache.set(uuid.uuid4().hex, 'a', 'b', tool_type='app_builder')
+        assert purges == [1]
+        cache.set(f"stream:{uuid.uuid4().hex}", 'a', 'b', tool_type='stream', record_stats=False)
+        assert purges == [1]
+    print("✓ Only counted stores purge")
+
+
+def main():
+    tests = [test_key_normalization, test_lru_eviction_and_ttl, test_db_tier_shared, test_uncounted_stores_never_purge]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
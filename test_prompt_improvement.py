@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script for the AI prompt improvement pipeline
+Upstream OpenAI calls are replaced with local fakes, no network needed
+"""
+
+import sys
+import time
+import app as app_module
+import upstream_client
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.content_text = content
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return {'choices': [{'message': {'content': self.content_text}}]}
+
+
+def fake_post_factory(delay=0.3, fail_on=None):
+    """Build a fake upstream_client.post that sleeps, then echoes the system prompt kind"""
+    def fake_post(url, headers=None, json=None, timeout=None, **kwargs):
+        time.sleep(delay)
+        system = json['messages'][0]['content']
+        kind = 'analysis' if 'analyz' in system.lower() else 'improved'
+        if kind == fail_on:
+            return FakeResponse('', status_code=500)
+        return FakeResponse(f" {kind} text ")
+    return fake_post
+
+
+def test_calls_run_concurrently():
+    """Analysis and improvement overlap instead of running back to back"""
+    print("Testing concurrent analysis/improvement calls...")
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post = fake_post_factory(delay=0.3)
+    app_module.OPENAI_API_KEY = 'test-key'
+    try:
+        with app_module.app.app_context():
+            started = time.monotonic()
+            analysis, improved = app_module.improve_prompt_with_ai(f'Build me a todo app {time.time()}')
+            elapsed = time.monotonic() - started
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+
+    assert analysis == 'analysis text'
+    assert improved == 'improved text'
+    assert elapsed < 0.55, f"calls took {elapsed:.2f}s, expected them to overlap"
+    stats = upstream_client.timing_stats()
+    assert stats['app_prompt.analysis']['count'] >= 1
+    assert stats['app_prompt.total']['count'] >= 1
+    print(f"✓ Both calls finished in {elapsed:.2f}s")
+
+
+def test_partial_result_on_failure():
+    """A failed analysis call still returns the improved prompt"""
+    print("Testing partial results...")
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post = fake_post_factory(delay=0.01, fail_on='analysis')
+    app_module.OPENAI_API_KEY = 'test-key'
+    try:
+        with app_module.app.app_context():
+            analysis, improved = app_module.improve_image_prompt_with_ai(f'a red sneaker on a table {time.time()}', 'flux')
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+
+    assert analysis is None
+    assert improved == 'improved text'
+    print("✓ Partial result returned")
+
+
+def test_calls_share_the_deadline():
+    """Both calls get the same Deadline, so in-flight retries stop when the shared budget runs out"""
+    print("Testing shared deadline...")
+    seen = []
+
+    def fake_post(url, headers=None, json=None, timeout=None, deadline=None, **kwargs):
+        seen.append(deadline)
+        return FakeResponse(' text ')
+
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post, app_module.OPENAI_API_KEY = fake_post, 'test-key'
+    try:
+        with app_module.app.app_context():
+            app_module.improve_prompt_with_ai(f'Build me a notes app {time.time()}')
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+
+    assert len(seen) == 2 and seen[0] is seen[1] and seen[0] is not None
+    assert seen[0].budget == app_module.OPENAI_PROMPT_DEADLINE
+    print("✓ One deadline passed to both calls")
+
+
+def main():
+    tests = [test_calls_run_concurrently, test_partial_result_on_failure, test_calls_share_the_deadline]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Test script for near-duplicate prompt detection (MinHash + LSH)
+Upstream OpenAI calls are replaced with local fakes, no network needed
+"""
+
+import sys
+import time
+import uuid
+import random
+import struct
+import app as app_module
+import upstream_client
+from app import app, db, User
+from prompt_similarity import PromptIndex, minhash, similarity, prompt_scope
+from testing_helpers import make_user, logged_in_client
+
+BASE_PROMPT = ("Build a todo app with React and a Node backend that lets users share "
+               "lists with friends and get reminders by email")
+
+
+def test_near_duplicates_match():
+    """Whitespace, punctuation and a one-word edit still match; other prompts do not"""
+    print("Testing near-duplicate matching...")
+    index = PromptIndex(use_db=False)
+    scope = prompt_scope('app_builder', None, 'v1')
+    index.add(BASE_PROMPT, scope, 'base')
+
+    variants = [
+        "  build a TODO app, with React and a Node backend that lets users share lists with friends and get reminders by email!!",
+        BASE_PROMPT.replace('todo app', 'simple todo app'),
+    ]
+    for variant in variants:
+        match = index.find(variant, scope)
+        assert match is not None and match[0] == 'base', (variant, match)
+
+    assert index.find("A cinematic photo of a red sneaker on a wooden desk", scope) is None
+    # Same prompt under another tool type / system prompt version never matches
+    assert index.find(BASE_PROMPT, prompt_scope('image_video', 'flux', 'v1')) is None
+    assert index.find(BASE_PROMPT, prompt_scope('app_builder', None, 'v2')) is None
+    print("✓ Near-duplicates matched, unrelated prompts ignored")
+
+
+def test_lookup_stays_fast_at_100k():
+    """Index lookups stay sub-millisecond with 100k stored prompts"""
+    print("Testing lookup latency at 100k entries...")
+    index = PromptIndex(use_db=False)
+    rng = random.Random(7)
+    for i in range(100000):
+        index._insert(f"k{i}", 'scope', struct.unpack('<64I', rng.getrandbits(2048).to_bytes(256, 'little')))
+    index.add(BASE_PROMPT, 'scope', 'target')
+    assert len(index) == 100001
+
+    query = minhash(BASE_PROMPT.replace('email', 'e-mail'))
+    started = time.perf_counter()
+    for _ in range(200):
+        match = index.find(None, 'scope', signature=query)
+    per_lookup = (time.perf_counter() - started) / 200
+    assert match is not None and match[0] == 'target'
+    assert per_lookup < 0.001, f"{per_lookup * 1000:.3f}ms per lookup"
+    print(f"✓ {per_lookup * 1e6:.0f}µs per lookup")
+
+
+def test_index_persists_across_restarts():
+    """A fresh index (new worker) loads stored signatures from the database"""
+    print("Testing persistence...")
+    prompt = f"{BASE_PROMPT} {uuid.uuid4().hex}"
+    scope = prompt_scope('app_builder', None, uuid.uuid4().hex)
+    with app_module.app.app_context():
+        PromptIndex().add(prompt, scope, uuid.uuid4().hex)
+        restarted = PromptIndex()
+        match = restarted.find(prompt + ' please', scope)
+    assert match is not None
+    assert similarity(minhash(prompt), minhash(prompt)) == 1.0
+    print("✓ Signatures reloaded from the database")
+
+
+def test_near_duplicate_skips_openai():
+    """A near-duplicate prompt is answered from the stored improvement"""
+    print("Testing reuse without an upstream call...")
+    calls = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, text):
+            self.text = text
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'choices': [{'message': {'content': self.text}}]}
+
+    def fake_post(url, headers=None, json=None, timeout=None, **kwargs):
+        calls.append(url)
+        return FakeResponse(f"result {len(calls)}")
+
+    marker = uuid.uuid4().hex
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post = fake_post
+    app_module.OPENAI_API_KEY = 'test-key'
+    try:
+        with app_module.app.app_context():
+            first = app_module.improve_prompt_with_ai(f"{BASE_PROMPT} {marker}")
+            second = app_module.improve_prompt_with_ai(f"{BASE_PROMPT}, {marker}!")
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+
+    assert len(calls) == 2, calls  # analysis + improvement for the first prompt only
+    assert second == first
+    print("✓ Near-duplicate served from cache")
+
+
+def test_changed_adjective_is_offered():
+    """A prompt differing by one adjective is offered the stored result, free, with a regenerate option"""
+    print("Testing near-duplicate offer...")
+    calls = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, text):
+            self.text = text
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'choices': [{'message': {'content': self.text}}]}
+
+    def fake_post(url, headers=None, json=None, timeout=None, **kwargs):
+        calls.append(url)
+        return FakeResponse(f"result {len(calls)}")
+
+    marker = uuid.uuid4().hex  # long enough that earlier runs' prompts aren't near-duplicates
+    red = (f"a photo of a red sneaker on a sunlit wooden desk next to a laptop and a coffee cup, "
+           f"soft morning light, shallow depth of field, product shot {marker}")
+    blue = red.replace('red sneaker', 'blue sneaker')
+    user_id = make_user('similar')
+    client = logged_in_client(user_id)
+
+    def charged():
+        with app.app_context():
+            return db.session.get(User, user_id).analysis_count
+
+    def improve(prompt, **form):
+        return client.post('/improve-image-prompt', data=dict(prompt_content=prompt, model='flux', stream='0', **form))
+
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post, app_module.OPENAI_API_KEY = fake_post, 'test-key'
+    try:
+        improve(red)
+        assert len(calls) == 2 and charged() == 1, (calls, charged())
+
+        improve(blue)
+        with client.session_transaction() as sess:
+            offered = sess['prompt_result']
+        assert len(calls) == 2 and charged() == 1, (calls, charged())
+        assert offered['similar_to']['prompt'] == red and offered['improved_prompt'] == 'result 2', offered
+        page = client.get('/prompt-result').get_data(as_text=True)
+        assert 'Regenerate for my prompt' in page and 'name="regenerate"' in page
+
+        improve(blue, regenerate='1')
+        with client.session_transaction() as sess:
+            regenerated = sess['prompt_result']
+        assert len(calls) == 4 and charged() == 2, (calls, charged())
+        assert 'similar_to' not in regenerated and regenerated['improved_prompt'] in ('result 3', 'result 4')
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+    print("✓ Near-duplicate offered for free, regenerated on request")
+
+
+def main():
+    tests = [test_near_duplicates_match, test_lookup_stays_fast_at_100k,
+             test_index_persists_across_restarts, test_near_duplicate_skips_openai, test_changed_adjective_is_offered]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
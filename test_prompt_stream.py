@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test script for streamed prompt improvement (/prompt-stream)
+Checks SSE output and that the quota is charged once, and never for a stream that sent nothing
+"""
+
+import sys
+import time
+import uuid
+import json
+import app as app_module
+import upstream_client
+from work_pool import BoundedPool, prompt_stream_pool
+from stream_slots import StreamSlots
+from app import app, db, User
+from testing_helpers import make_user, logged_in_client
+
+
+class FakeStreamResponse:
+    """Mimics a requests streaming response for an OpenAI chat completion"""
+
+    def __init__(self, tokens, delay=0.0):
+        self.tokens = tokens
+        self.delay = delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        for token in self.tokens:
+            time.sleep(self.delay)
+            yield 'data: ' + json.dumps({'choices': [{'delta': {'content': token}}]})
+            yield ''
+        yield 'data: [DONE]'
+
+
+def fake_stream_post(delay=0.0):
+    def fake_post(url, headers=None, json=None, timeout=None, **kwargs):
+        assert json.get('stream') is True and kwargs.get('stream') is True
+        system = json['messages'][0]['content'].lower()
+        tokens = ['Analysis ', 'here'] if 'analyz' in system else ['Better ', 'prompt ', 'here']
+        return FakeStreamResponse(tokens, delay)
+    return fake_post
+
+
+def make_client():
+    """Create a throwaway user and a logged-in test client with a pending stream"""
+    user_id = make_user('stream')
+    client = logged_in_client(user_id, {
+        'original_prompt': f'Build a habit tracker {uuid.uuid4().hex}',
+        'improved_prompt': '',
+        'ai_analysis': None,
+        'rule_analysis': app_module.rule_based_prompt_analysis('Build a habit tracker'),
+        'tool_type': 'app_builder',
+        'pending': True,
+        'stream_id': uuid.uuid4().hex,
+    })
+    return client, user_id
+
+
+def analysis_count(user_id):
+    with app.app_context():
+        return db.session.get(User, user_id).analysis_count
+
+
+def test_stream_completes_and_charges_once():
+    """A finished stream emits tokens, charges once, and replays on reconnect for free"""
+    print("Testing completed stream...")
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post, app_module.OPENAI_API_KEY = fake_stream_post(), 'test-key'
+    try:
+        client, user_id = make_client()
+        body = client.get('/prompt-stream').get_data(as_text=True)
+        assert body.startswith('event: reset')  # clears text shown before a reconnect
+        assert 'event: improved' in body and 'event: analysis' in body
+        assert 'Better prompt here' in body.split('event: done')[1]
+        assert analysis_count(user_id) == 1
+
+        client.get('/prompt-stream').get_data(as_text=True)
+        assert analysis_count(user_id) == 1
+
+        page = client.get('/prompt-result').get_data(as_text=True)
+        assert 'Better prompt here' in page
+        assert client.get('/prompt-stream').status_code == 204
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+    print("✓ Stream charged exactly once")
+
+
+def test_aborted_stream_not_charged():
+    """Closing the stream before any token was sent leaves the quota untouched"""
+    print("Testing aborted stream...")
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post, app_module.OPENAI_API_KEY = fake_stream_post(delay=1.5), 'test-key'
+    try:
+        client, user_id = make_client()
+        response = client.get('/prompt-stream', buffered=False)
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'event: reset')
+        assert next(chunks).startswith(b': keep-alive')
+        response.close()
+        assert analysis_count(user_id) == 0
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+    print("✓ Aborted stream not charged")
+
+
+def test_partial_stream_charged_once():
+    """A client that leaves after the first token is charged, and a reconnect isn't charged again"""
+    print("Testing partial stream...")
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post, app_module.OPENAI_API_KEY = fake_stream_post(delay=0.05), 'test-key'
+    try:
+        client, user_id = make_client()
+        submitted = prompt_stream_pool.stats()['submitted']
+        response = client.get('/prompt-stream', buffered=False)
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'event: reset')
+        assert b'"delta"' in next(chunks)
+        response.close()
+        assert analysis_count(user_id) == 1
+        # Streams run on their own pool, not the executor synchronous improvements use
+        assert prompt_stream_pool.stats()['submitted'] == submitted + 2
+
+        body = client.get('/prompt-stream').get_data(as_text=True)
+        assert 'event: done' in body
+        assert analysis_count(user_id) == 1
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+    print("✓ Charged on first token, once")
+
+
+def test_busy_stream_pool_refuses_without_charge():
+    print("Testing full stream pool...")
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    original_pool = app_module.prompt_stream_pool
+    upstream_client.post, app_module.OPENAI_API_KEY = fake_stream_post(), 'test-key'
+    app_module.prompt_stream_pool = BoundedPool('prompt-stream', 1, 0)
+    try:
+        client, user_id = make_client()
+        body = client.get('/prompt-stream').get_data(as_text=True)
+        assert 'event: failed' in body and app_module.PROMPT_STREAM_BUSY_MESSAGE in body
+        assert analysis_count(user_id) == 0
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+        app_module.prompt_stream_pool = original_pool
+    print("✓ Refused with a message, not charged")
+
+
+def test_stream_cap_asks_to_retry():
+    """With every stream slot taken, the browser is told to reconnect later, uncharged and without upstream calls"""
+    print("Testing stream cap...")
+    calls = []
+    original_post, original_key, original_slots = upstream_client.post, app_module.OPENAI_API_KEY, app_module.stream_slots
+    upstream_client.post = lambda *args, **kwargs: calls.append(args)
+    app_module.OPENAI_API_KEY = 'test-key'
+    app_module.stream_slots = StreamSlots(0)
+    try:
+        client, user_id = make_client()
+        body = client.get('/prompt-stream').get_data(as_text=True)
+        assert '\nretry: ' in body and 'event: busy' in body and 'event: done' not in body
+        assert analysis_count(user_id) == 0 and calls == []
+        assert app_module.stream_slots.stats()['refused'] == 1
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+        app_module.stream_slots = original_slots
+    print("✓ Asked to retry, not charged")
+
+
+def test_second_live_stream_refused():
+    """A reconnect while the same stream is still running is told to retry, without new upstream calls"""
+    print("Testing duplicate stream...")
+    calls = []
+    original_post, original_key = upstream_client.post, app_module.OPENAI_API_KEY
+    upstream_client.post = lambda *args, **kwargs: calls.append(args)
+    app_module.OPENAI_API_KEY = 'test-key'
+    try:
+        client, user_id = make_client()
+        with client.session_transaction() as sess:
+            stream_key = app_module.stream_key_for(sess['prompt_result']['stream_id'])
+        app_module._live_streams.add(stream_key)  # the first connection hasn't noticed it was dropped yet
+        try:
+            body = client.get('/prompt-stream').get_data(as_text=True)
+        finally:
+            app_module._live_streams.discard(stream_key)
+        assert body.startswith('retry: ') and 'event: busy' in body and 'event: reset' not in body
+        assert analysis_count(user_id) == 0 and calls == []
+    finally:
+        upstream_client.post, app_module.OPENAI_API_KEY = original_post, original_key
+    print("✓ Duplicate stream refused")
+
+
+def main():
+    tests = [test_stream_completes_and_charges_once, test_aborted_stream_not_charged, test_partial_stream_charged_once,
+             test_busy_stream_pool_refuses_without_charge, test_stream_cap_asks_to_retry, test_second_live_stream_refused]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
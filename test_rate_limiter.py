@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared upstream token-bucket rate limiter
+Uses a temporary bucket file; no network needed
+"""
+
+import os
+import sys
+import tempfile
+import multiprocessing
+from rate_limiter import RateLimiter, model_for_request, estimate_tokens
+
+
+def temp_bucket_file():
+    handle, path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    return path
+
+
+def test_model_resolution():
+    """Chat payloads map by model name, Imagen by URL"""
+    print("Testing model resolution...")
+    chat_url = 'https://api.openai.com/v1/chat/completions'
+    assert model_for_request(chat_url, {'model': 'gpt-4o-mini'}) == 'gpt-4o-mini'
+    assert model_for_request(chat_url, {'model': 'gpt-4o'}) == 'gpt-4o'
+    assert model_for_request(chat_url, {'model': 'gpt-3.5-turbo-0125'}) == 'gpt-3.5-turbo'
+    imagen_url = 'https://generativelanguage.googleapis.com/v1beta/models/imagen-4.0-generate-001:predict'
+    assert model_for_request(imagen_url, {'instances': []}) == 'imagen-4.0'
+    assert model_for_request('https://example.com/other', {}) is None
+    print("✓ Models resolved")
+
+
+def test_token_estimate():
+    """Text chars, images and max_tokens all count towards TPM"""
+    print("Testing token estimate...")
+    payload = {
+        'messages': [
+            {'role': 'system', 'content': 'x' * 400},
+            {'role': 'user', 'content': [
+                {'type': 'text', 'text': 'y' * 40},
+                {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,AAAA'}},
+            ]},
+        ],
+        'max_tokens': 200,
+    }
+    assert estimate_tokens(payload) == 100 + 10 + 765 + 200
+    print("✓ Token estimate correct")
+
+
+class FakeClock:
+    """Simulated wall clock: sleeping advances it instantly"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_requests_queue_instead_of_failing():
+    """Once RPM is spent the caller waits for the bucket to refill"""
+    print("Testing RPM queuing...")
+    clock = FakeClock()
+    limiter = RateLimiter(path=temp_bucket_file(), limits={'gpt-4o': (120, None)}, max_wait=5,
+                          clock=clock, sleep=clock.sleep)
+    for _ in range(120):
+        assert limiter.acquire('gpt-4o') == 0.0
+    waited = limiter.acquire('gpt-4o')
+    # 120/min refills one request every 0.5s
+    assert abs(waited - 0.5) < 1e-6 and clock.sleeps == [waited], (waited, clock.sleeps)
+    assert limiter.stats()['gpt-4o']['waited'] == 1
+    print(f"✓ Queued {waited:.2f}s (simulated) for budget")
+
+
+def test_tpm_budget_and_overflow():
+    """Token budget is enforced; past max_wait the request goes out anyway"""
+    print("Testing TPM budget...")
+    clock = FakeClock()
+    limiter = RateLimiter(path=temp_bucket_file(), limits={'gpt-4o': (None, 6000)}, max_wait=0.2,
+                          clock=clock, sleep=clock.sleep)
+    assert limiter.acquire('gpt-4o', tokens=6000) == 0.0
+    assert limiter.acquire('gpt-4o', tokens=3000) == 0.0  # needs 30s of refill, far beyond max_wait
+    assert clock.sleeps == []
+    assert limiter.stats()['gpt-4o']['overflow'] == 1
+    print("✓ TPM enforced, overflow does not error")
+
+
+def _drain(path, results):
+    # A frozen clock: no refill while the two processes drain the bucket
+    limiter = RateLimiter(path=path, limits={'imagen-4.0': (60, None)}, max_wait=0, clock=lambda: 1_000_000.0)
+    results.put(sum(1 for _ in range(40) if limiter._try_take('imagen-4.0', 0) == 0.0))
+
+
+def test_budget_shared_across_processes():
+    """Two worker processes draw from one bucket"""
+    print("Testing cross-process sharing...")
+    path = temp_bucket_file()
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_drain, args=(path, results)) for _ in range(2)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    granted = results.get() + results.get()
+    assert granted == 60, granted  # 80 attempts, 60/min budget
+    print(f"✓ {granted} of 80 requests granted across 2 processes")
+
+
+def main():
+    tests = [test_model_resolution, test_token_estimate, test_requests_queue_instead_of_failing,
+             test_tpm_budget_and_overflow, test_budget_shared_across_processes]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
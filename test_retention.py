@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test script for generated-image retention and storage quotas
+"""
+
+import io
+import os
+import sys
+import time
+import uuid
+import tempfile
+from datetime import datetime, timedelta
+import retention
+from storage import get_storage
+from app import app, db
+from models import GeneratedAsset
+from testing_helpers import make_user
+
+
+def add_batch(user_id, age_days, content=None, size=1000):
+    """Store one file as a batch created age_days ago, counted in the user's usage"""
+    stored = get_storage('local').put(io.BytesIO(content or os.urandom(size)), 'png')
+    batch_id = uuid.uuid4().hex[:12]
+    db.session.add(GeneratedAsset(batch_id=batch_id, user_id=user_id, filename='scene_0.png', backend='local',
+                                  storage_key=stored.key, content_type=stored.content_type, size=stored.size,
+                                  sha256=stored.sha256,
+                                  created_at=datetime.utcnow() - timedelta(days=age_days)))
+    retention.add_usage(user_id, stored.size, 1)
+    db.session.commit()
+    return batch_id, stored.key
+
+
+def test_expiry_by_plan():
+    """Old batches go after the free retention for free users, but paid users keep them"""
+    print("Testing retention by plan...")
+    free_id, paid_id = make_user('retention'), make_user('retention', is_paid=True)
+    local = get_storage('local')
+    with app.app_context():
+        shared = os.urandom(500)
+        old_free, old_key = add_batch(free_id, retention.RETENTION_FREE_DAYS + 1, content=shared)
+        new_free, new_key = add_batch(free_id, 0, content=shared)
+        old_paid, _ = add_batch(paid_id, retention.RETENTION_FREE_DAYS + 1)
+        assert old_key == new_key  # same content, one object
+        assert retention.usage_bytes(free_id) == 1000
+
+        expired = retention.expired_batch_ids(False, limit=100000)
+        assert old_free in expired and new_free not in expired and old_paid not in expired
+        assert old_paid not in retention.expired_batch_ids(True, limit=100000)
+
+        assert retention.delete_batches([old_free]) == (1, 500, 0)
+        assert local.exists(old_key), "object still used by another batch was deleted"
+        assert retention.usage_bytes(free_id) == 500
+        # A second sweeper deleting the same batch changes nothing
+        assert retention.delete_batches([old_free]) == (0, 0, 0)
+        assert retention.usage_bytes(free_id) == 500
+
+        assert retention.delete_batches([new_free, old_paid]) == (2, 1500, 2)
+        assert not local.exists(new_key)
+        assert retention.usage_bytes(free_id) == 0 and retention.usage_bytes(paid_id) == 0
+    print("✓ Expired per plan, shared objects kept, counters exact")
+
+
+def test_quota_evicts_oldest_first():
+    print("Testing quota eviction...")
+    user_id = make_user('retention')
+    original = retention.STORAGE_QUOTA_FREE_BYTES
+    retention.STORAGE_QUOTA_FREE_BYTES = 2500
+    try:
+        with app.app_context():
+            batches = [add_batch(user_id, age)[0] for age in (3, 2, 1, 0)]
+            assert user_id in retention.users_over_quota()
+            assert retention.enforce_quota(user_id) == batches[:2]
+            remaining = {b for (b,) in db.session.query(GeneratedAsset.batch_id).filter_by(user_id=user_id)}
+            assert remaining == set(batches[2:])
+            assert retention.usage_bytes(user_id) == 2000
+            assert user_id not in retention.users_over_quota()
+
+            # The newest batch stays even when it alone is over quota
+            retention.STORAGE_QUOTA_FREE_BYTES = 10
+            assert retention.enforce_quota(user_id) == [batches[2]]
+            assert retention.usage_bytes(user_id) == 1000
+            retention.delete_batches([batches[3]])
+    finally:
+        retention.STORAGE_QUOTA_FREE_BYTES = original
+    print("✓ Oldest batches evicted, newest kept")
+
+
+def test_sweep_and_legacy_dirs():
+    """A sweep runs end to end, reports metrics and clears old per-batch directories"""
+    print("Testing sweep...")
+    with tempfile.TemporaryDirectory() as tmp:
+        old_batch = os.path.join(tmp, 'abcdef123456')
+        new_batch = os.path.join(tmp, '654321fedcba')
+        shard = os.path.join(tmp, 'ab')
+        for path in (old_batch, new_batch, shard):
+            os.makedirs(path)
+        long_ago = time.time() - retention.retention_for(True).total_seconds() - 3600
+        os.utime(old_batch, (long_ago, long_ago))
+        os.utime(shard, (long_ago, long_ago))
+        assert retention.sweep_legacy_dirs(root=tmp) == 1
+        assert sorted(os.listdir(tmp)) == ['654321fedcba', 'ab']
+
+    sweeper = retention.RetentionSweeper()
+    with app.app_context():
+        sweeper.sweep()
+        stats = sweeper.stats()
+    assert stats['sweeps'] == 1 and stats['errors'] == 0
+    assert 'stored_bytes' in stats and 'users_over_quota' in stats
+    print("✓ Sweep ran and reported metrics")
+
+
+def main():
+    tests = [test_expiry_by_plan, test_quota_evicts_oldest_first, test_sweep_and_legacy_dirs]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
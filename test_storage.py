@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test script for the generated-image storage backends
+The S3 backend runs against mock_s3.py and is skipped without boto3
+"""
+
+import io
+import os
+import sys
+import uuid
+import tempfile
+import threading
+import urllib.request
+from werkzeug.serving import make_server
+import storage
+import mock_s3
+from app import app, db, User
+from models import GeneratedAsset
+
+
+def test_local_content_addressed():
+    """Objects land under a sharded sha256 key, once per distinct content"""
+    print("Testing local storage...")
+    with tempfile.TemporaryDirectory() as tmp:
+        local = storage.LocalStorage(root=tmp, url_prefix='/static/generated/')
+        first = local.put(io.BytesIO(b'image-bytes' * 1000), '.PNG')
+        again = local.put(io.BytesIO(b'image-bytes' * 1000), 'png')
+        assert first == again
+        assert first.key == f"{first.sha256[:2]}/{first.sha256[2:4]}/{first.sha256}.png", first.key
+        assert first.size == 11000 and first.content_type == 'image/png'
+        assert local.url(first.key) == f"/static/generated/{first.key}"
+        with local.open(first.key) as f:
+            assert f.read() == b'image-bytes' * 1000
+        assert os.listdir(os.path.join(tmp, '.incoming')) == []
+
+        try:
+            local.local_path('../outside.png')
+            assert False, "path outside the root accepted"
+        except ValueError:
+            pass
+        assert local.delete(first.key) and not local.exists(first.key)
+    print("✓ Sharded, deduplicated and streamed")
+
+
+def test_s3_against_mock():
+    """Puts, presigned reads and deletes work against an S3-compatible server"""
+    print("Testing S3 storage...")
+    try:
+        import boto3
+    except ImportError:
+        print("✓ Skipped (boto3 not installed)")
+        return
+    server = make_server('127.0.0.1', 0, mock_s3.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = boto3.client('s3', endpoint_url=f"http://127.0.0.1:{server.server_port}", region_name='us-east-1',
+                              aws_access_key_id='mock', aws_secret_access_key='mock')
+        s3 = storage.S3Storage(bucket='generated', client=client)
+        assert not s3.permanent_urls
+        body = os.urandom(3 * storage.CHUNK_SIZE // 2)  # spills the spool to disk
+        stored = s3.put(io.BytesIO(body), 'png')
+        assert s3.exists(stored.key)
+        assert s3.put(io.BytesIO(body), 'png') == stored
+
+        with urllib.request.urlopen(s3.url(stored.key)) as response:
+            assert response.read() == body
+            assert response.headers['Content-Type'] == 'image/png'
+            assert 'immutable' in response.headers['Cache-Control']
+        with urllib.request.urlopen(s3.download_url(stored.key, 'scene_0.png')) as response:
+            assert response.headers['Content-Disposition'] == 'attachment; filename="scene_0.png"'
+
+        public = storage.S3Storage(bucket='generated', client=client, public_url='https://cdn.example.com/')
+        assert public.url(stored.key) == f"https://cdn.example.com/generated/{stored.key}"
+
+        s3.delete(stored.key)
+        assert not s3.exists(stored.key)
+    finally:
+        server.shutdown()
+    print("✓ S3 round trip")
+
+
+def test_download_checks_owner():
+    """Downloads of stored images are attachments, and only for the user who generated them"""
+    print("Testing image download...")
+    with app.app_context():
+        owner, other = User(), User()
+        for user in (owner, other):
+            user.email = f"storage-{uuid.uuid4().hex[:8]}@example.com"
+            user.set_password('testpassword123')
+            db.session.add(user)
+        db.session.commit()
+        stored = storage.get_storage('local').put(io.BytesIO(b'\x89PNG\r\n\x1a\n' + os.urandom(64)), 'png')
+        batch_id = uuid.uuid4().hex[:12]
+        db.session.add(GeneratedAsset(batch_id=batch_id, user_id=owner.id, filename='scene_0.png', backend='local',
+                                      storage_key=stored.key, content_type=stored.content_type, size=stored.size,
+                                      sha256=stored.sha256))
+        db.session.commit()
+        owner_id, other_id = owner.id, other.id
+
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'test-secret-key'
+    try:
+        for user_id, expected in ((owner_id, 200), (other_id, 302)):
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['_user_id'] = str(user_id)
+                sess['_fresh'] = True
+            response = client.get(f'/download-image/{batch_id}/scene_0.png')
+            assert response.status_code == expected, (user_id, response.status_code)
+            if expected == 200:
+                assert 'attachment; filename=scene_0.png' in response.headers['Content-Disposition']
+                assert response.data.startswith(b'\x89PNG')
+            response.close()
+    finally:
+        storage.get_storage('local').delete(stored.key)
+    print("✓ Owner downloads, others don't")
+
+
+def main():
+    tests = [test_local_content_addressed, test_s3_against_mock, test_download_checks_owner]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
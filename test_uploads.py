@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script for size-capped, streaming upload handling
+Checks that oversized or non-image uploads are refused before they are buffered or stored
+"""
+
+import io
+import os
+import sys
+import tempfile
+from werkzeug.datastructures import FileStorage
+import app as app_module
+import uploads
+from app import app, SlideshowJob
+from uploads import UploadRejected, save_image_upload
+from testing_helpers import make_user, logged_in_client
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + b'\x00' * 4096 + b'\xff\xd9'
+
+
+class ExplodingStream(io.BytesIO):
+    """Request body that fails the test if anything reads it"""
+
+    def read(self, *args):
+        raise AssertionError("request body was read")
+
+    readline = readinto = read
+
+
+def uploads_client():
+    user_id = make_user('uploads')
+    return logged_in_client(user_id), user_id
+
+
+def test_rejected_by_content_length():
+    """A body declared larger than the cap gets a 413 without being read"""
+    print("Testing Content-Length rejection...")
+    client, _ = uploads_client()
+    response = client.post('/generate-slideshow', input_stream=ExplodingStream(),
+                           environ_overrides={'CONTENT_LENGTH': str(uploads.MAX_UPLOAD_BYTES * 3)},
+                           content_type='multipart/form-data; boundary=xyz',
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 413, response.status_code
+    assert 'too large' in response.get_json()['error']
+
+    response = client.post('/generate-slideshow', input_stream=ExplodingStream(),
+                           environ_overrides={'CONTENT_LENGTH': str(uploads.MAX_UPLOAD_BYTES * 3)},
+                           content_type='multipart/form-data; boundary=xyz')
+    assert response.status_code == 302
+    print("✓ Oversized request refused from its headers")
+
+
+def test_non_image_rejected():
+    """A file that isn't a JPEG/PNG/WebP is refused and nothing is staged or queued"""
+    print("Testing magic-byte check...")
+    client, user_id = uploads_client()
+    original_mode = app_module.SLIDESHOW_WORKER_MODE
+    app_module.SLIDESHOW_WORKER_MODE = 'external'
+    staged = set(os.listdir(app_module.UPLOAD_STAGING_DIR))
+    try:
+        response = client.post('/generate-slideshow', data={
+            'provider': 'imagen',
+            'product_image': (io.BytesIO(b'%PDF-1.7 not an image'), 'product.jpg'),
+        }, headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+    finally:
+        app_module.SLIDESHOW_WORKER_MODE = original_mode
+    assert response.status_code == 415, response.status_code
+    assert set(os.listdir(app_module.UPLOAD_STAGING_DIR)) == staged
+    with app.app_context():
+        assert SlideshowJob.query.filter_by(user_id=user_id).count() == 0
+    print("✓ Non-image refused")
+
+
+def test_streamed_copy():
+    """Uploads are copied in chunks; an oversized one leaves no partial file behind"""
+    print("Testing streamed copy...")
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, 'ok.upload')
+        mime = save_image_upload(FileStorage(io.BytesIO(JPEG), 'product.jpg'), dest)
+        assert mime == 'image/jpeg'
+        with open(dest, 'rb') as f:
+            assert f.read() == JPEG
+
+        big = JPEG + b'\x00' * (300 * 1024)
+        try:
+            save_image_upload(FileStorage(io.BytesIO(big), 'big.jpg'), os.path.join(tmp, 'big.upload'),
+                              max_upload_bytes=256 * 1024)
+            assert False, "expected UploadRejected"
+        except UploadRejected as e:
+            assert e.status == 413
+        assert os.listdir(tmp) == ['ok.upload'], os.listdir(tmp)
+    print("✓ Streamed copy capped")
+
+
+def main():
+    tests = [test_rejected_by_content_length, test_non_image_rejected, test_streamed_copy]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
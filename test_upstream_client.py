@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared upstream HTTP client
+Checks that sessions are pooled per host, rebuilt after a fork,
+and that identical concurrent requests are coalesced
+"""
+
+import os
+import json as jsonlib
+import sys
+import time
+import tempfile
+import threading
+import multiprocessing
+import requests
+import upstream_client
+from singleflight import SingleFlight
+
+
+class CountingSession:
+    """Fake pooled session: slow JSON responses, counting how often the network is hit"""
+
+    def __init__(self, delay=0.2, counter_path=None):
+        self.delay = delay
+        self.counter_path = counter_path
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, headers=None, data=None, timeout=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+        if self.counter_path:
+            with open(self.counter_path, 'a') as f:
+                f.write('x')
+        time.sleep(self.delay)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = b'{"echo": %d}' % jsonlib.loads(data)['n']
+        return response
+
+
+def with_fake_session(session):
+    original = upstream_client.get_session
+    upstream_client.get_session = lambda url: session
+    return original
+
+
+def test_session_reused_per_host():
+    """Calls to the same host share one pooled session"""
+    print("Testing per-host session pooling...")
+    a = upstream_client.get_session('https://api.openai.com/v1/chat/completions')
+    b = upstream_client.get_session('https://api.openai.com/v1/models')
+    c = upstream_client.get_session('https://generativelanguage.googleapis.com/v1beta/models/x:predict')
+    assert a is b
+    assert a is not c
+    adapter = a.get_adapter('https://api.openai.com')
+    assert adapter._pool_maxsize == upstream_client.POOL_MAXSIZE
+    print("✓ Sessions pooled per host")
+
+
+def test_sessions_rebuilt_after_fork():
+    """A new pid never inherits pooled sockets from the parent"""
+    print("Testing fork safety...")
+    before = upstream_client.get_session('https://api.openai.com')
+    upstream_client._sessions_pid = -1  # simulate running in a forked child
+    after = upstream_client.get_session('https://api.openai.com')
+    assert before is not after
+    print("✓ Sessions rebuilt after fork")
+
+
+def test_timeout_normalization():
+    """Scalar timeouts become (connect, read) tuples"""
+    print("Testing timeout normalization...")
+    assert upstream_client._normalize_timeout(90) == (upstream_client.CONNECT_TIMEOUT, 90)
+    assert upstream_client._normalize_timeout(2) == (2, 2)
+    assert upstream_client._normalize_timeout((1, 3)) == (1, 3)
+    print("✓ Timeouts normalized")
+
+
+def test_identical_requests_coalesced():
+    """Concurrent identical POSTs share one upstream call; different bodies do not"""
+    print("Testing single-flight coalescing across threads...")
+    session = CountingSession()
+    original = with_fake_session(session)
+    url = 'https://coalesce.test/v1/chat/completions'
+    results = []
+
+    def call(n):
+        results.append(upstream_client.post(url, headers={'Authorization': 'Bearer k'}, json={'n': n}).json())
+
+    try:
+        threads = [threading.Thread(target=call, args=(1,)) for _ in range(5)]
+        threads.append(threading.Thread(target=call, args=(2,)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Streams are never shared
+        upstream_client.post(url, json={'n': 3}, stream=True)
+    finally:
+        upstream_client.get_session = original
+
+    assert session.calls == 3, session.calls  # n=1 once, n=2 once, the stream once
+    assert results.count({'echo': 1}) == 5
+    assert results.count({'echo': 2}) == 1
+    assert upstream_client.singleflight_stats()['followers'] >= 4
+    print("✓ 6 concurrent requests made 2 upstream calls")
+
+
+def test_leader_error_shared():
+    """Followers see the leader's exception rather than retrying themselves"""
+    print("Testing error propagation...")
+    flight = SingleFlight()
+    started = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise requests.ReadTimeout('slow upstream')
+
+    def follower():
+        started.wait()
+        try:
+            flight.do('key', lambda: 'should not run')
+        except requests.ReadTimeout as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    try:
+        flight.do('key', failing)
+    except requests.ReadTimeout as e:
+        errors.append(e)
+    thread.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+    print("✓ Leader error shared")
+
+
+def _shared_worker(shared_dir, counter_path, results):
+    upstream_client._singleflight = SingleFlight(shared_dir=shared_dir)
+    upstream_client.SINGLEFLIGHT_SHARED = True
+    with_fake_session(CountingSession(delay=1.0, counter_path=counter_path))
+    response = upstream_client.post('https://coalesce.test/v1/chat/completions', json={'n': 7})
+    results.put(response.json())
+
+
+def test_identical_requests_coalesced_across_workers():
+    """With shared single-flight, two worker processes make one upstream call"""
+    print("Testing single-flight coalescing across processes...")
+    shared_dir = tempfile.mkdtemp()
+    counter_path = os.path.join(shared_dir, 'calls.txt')
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_shared_worker, args=(shared_dir, counter_path, results))
+             for _ in range(2)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    with open(counter_path) as f:
+        calls = len(f.read())
+    assert calls == 1, calls
+    assert results.get() == results.get() == {'echo': 7}
+    print("✓ 2 workers made 1 upstream call")
+
+
+def main():
+    tests = [test_session_reused_per_host, test_sessions_rebuilt_after_fork, test_timeout_normalization,
+             test_identical_requests_coalesced, test_leader_error_shared,
+             test_identical_requests_coalesced_across_workers]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
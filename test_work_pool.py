@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for the bounded Imagen pool and slideshow admission control
+"""
+
+import io
+import sys
+import time
+import threading
+import app as app_module
+import job_queue
+from work_pool import BoundedPool, PoolFull
+from app import app
+from testing_helpers import make_user, logged_in_client
+
+
+def test_pool_bounds_concurrency_and_queue():
+    """At most max_workers run at once, at most max_queued wait, and the rest is refused whole"""
+    print("Testing bounded pool...")
+    pool = BoundedPool('test', max_workers=2, max_queued=2)
+    release = threading.Event()
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def call(i):
+        with lock:
+            running.append(i)
+            peak[0] = max(peak[0], len(running))
+        release.wait(5)
+        with lock:
+            running.remove(i)
+        return i
+
+    futures = pool.submit_all([(call, (i,), {}) for i in range(3)])
+    try:
+        pool.submit_all([(call, (i,), {}) for i in range(3, 5)])
+        assert False, "pool accepted more than it can hold"
+    except PoolFull as e:
+        assert e.retry_after >= 1
+    assert pool.has_room(1) and not pool.has_room(2)
+    time.sleep(0.1)
+    stats = pool.stats()
+    assert (stats['active'], stats['queued'], stats['rejected']) == (2, 1, 2), stats
+
+    release.set()
+    assert [f.result(timeout=5) for f in futures] == [0, 1, 2]
+    time.sleep(0.05)
+    stats = pool.stats()
+    assert peak[0] == 2
+    assert (stats['active'], stats['queued'], stats['completed']) == (0, 0, 3), stats
+    assert stats['wait_p95_ms'] is not None
+    print("✓ Concurrency and queue bounded, overflow refused")
+
+
+def test_cancelled_calls_free_their_slot():
+    print("Testing cancellation...")
+    pool = BoundedPool('test', max_workers=1, max_queued=1)
+    release = threading.Event()
+    running, waiting = pool.submit_all([(release.wait, (5,), {}), (release.wait, (5,), {})])
+    assert waiting.cancel()
+    assert pool.has_room(1)
+    release.set()
+    running.result(timeout=5)
+    time.sleep(0.05)
+    assert pool.stats()['cancelled'] == 1 and pool.has_room(2)
+    print("✓ Cancelled call released its slot")
+
+
+def make_client():
+    user_id = make_user('admission', is_paid=True)
+    return logged_in_client(user_id), user_id
+
+
+def post_slideshow(client):
+    return client.post('/generate-slideshow', data={
+        'provider': 'imagen',
+        'product_image': (io.BytesIO(b'\xff\xd8\xff\xe0fakejpeg'), 'product.jpg'),
+    }, headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+
+
+def test_route_admission():
+    """/generate-slideshow answers 429 past the per-user limit and 503 when the queue is full"""
+    print("Testing admission control...")
+    client, user_id = make_client()
+    originals = (app_module.SLIDESHOW_WORKER_MODE, app_module.SLIDESHOW_MAX_QUEUED)
+    app_module.SLIDESHOW_WORKER_MODE = 'external'
+    job_ids = []
+    try:
+        for _ in range(app_module.SLIDESHOW_MAX_ACTIVE_PER_USER):
+            response = post_slideshow(client)
+            assert response.status_code == 202, response.status_code
+            job_ids.append(response.get_json()['job_id'])
+        response = post_slideshow(client)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == str(app_module.SLIDESHOW_RETRY_AFTER)
+
+        other, _ = make_client()
+        with app.app_context():
+            app_module.SLIDESHOW_MAX_QUEUED = job_queue.queue_depth()
+        response = post_slideshow(other)
+        assert response.status_code == 503 and int(response.headers['Retry-After']) > 0
+        assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
+
+        metrics = client.get('/metrics').get_json()
+        assert metrics['slideshow_jobs']['admission_rejections']['queue_full'] >= 1
+        assert 'wait_p95_ms' in metrics['work_pools']['imagen']
+    finally:
+        app_module.SLIDESHOW_WORKER_MODE, app_module.SLIDESHOW_MAX_QUEUED = originals
+        with app.app_context():
+            for job_id in job_ids:
+                job_queue.fail(job_queue.get_job(job_id), 'test cleanup')
+    print("✓ 429 and 503 with Retry-After")
+
+
+def main():
+    tests = [test_pool_bounds_concurrency_and_queue, test_cancelled_calls_free_their_slot, test_route_admission]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script for streamed ZIP downloads of slideshow batches
+"""
+
+import io
+import os
+import sys
+import uuid
+import zipfile
+from datetime import datetime
+from zip_stream import stream_zip
+from storage import get_storage
+from app import app, db, User
+from models import GeneratedAsset
+
+
+class CountingReader(io.BytesIO):
+    """Source that records the largest read, to check nothing is slurped whole"""
+
+    largest = 0
+
+    def read(self, size=-1):
+        assert size > 0, "whole-file read"
+        data = super().read(size)
+        CountingReader.largest = max(CountingReader.largest, len(data))
+        return data
+
+
+def test_stream_zip_is_valid_and_bounded():
+    """The streamed archive opens with zipfile, entries are STORED, and chunks stay small"""
+    print("Testing ZIP streaming...")
+    files = {f'scene_{i}.png': os.urandom(300 * 1024 + i) for i in range(4)}
+    entries = [(name, lambda data=data: CountingReader(data), len(data), datetime(2024, 5, 1, 12, 30))
+               for name, data in files.items()]
+
+    chunks = list(stream_zip(entries, chunk_size=16 * 1024))
+    assert max(len(chunk) for chunk in chunks) < 17 * 1024, max(len(chunk) for chunk in chunks)
+    assert CountingReader.largest <= 16 * 1024
+    assert all(chunks)
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(files)
+        for info in archive.infolist():
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert info.date_time == (2024, 5, 1, 12, 30, 0)
+            assert archive.read(info) == files[info.filename]
+    print("✓ Valid STORED archive in bounded chunks")
+
+
+def test_download_batch_route():
+    """/download-batch streams the batch's PNGs (not its variants) to its owner only"""
+    print("Testing /download-batch...")
+    local = get_storage('local')
+    with app.app_context():
+        owner, other = User(), User()
+        for user in (owner, other):
+            user.email = f"zip-{uuid.uuid4().hex[:8]}@example.com"
+            user.set_password('testpassword123')
+            db.session.add(user)
+        db.session.commit()
+        batch_id = uuid.uuid4().hex[:12]
+        stored = {}
+        for name in ('scene_0.png', 'scene_1.png', 'scene_0-320.webp'):
+            data = os.urandom(2048)
+            item = local.put(io.BytesIO(data), name.rsplit('.', 1)[1])
+            stored[name] = (data, item.key)
+            db.session.add(GeneratedAsset(batch_id=batch_id, user_id=owner.id, filename=name, backend='local',
+                                          storage_key=item.key, content_type=item.content_type, size=item.size,
+                                          sha256=item.sha256))
+        db.session.commit()
+        owner_id, other_id = owner.id, other.id
+
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'test-secret-key'
+    try:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(owner_id)
+            sess['_fresh'] = True
+        response = client.get(f'/download-batch/{batch_id}')
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.headers['Content-Type'] == 'application/zip'
+        assert f'slideshow-{batch_id}.zip' in response.headers['Content-Disposition']
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            assert archive.namelist() == ['scene_0.png', 'scene_1.png']
+            assert archive.read('scene_1.png') == stored['scene_1.png'][0]
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(other_id)
+            sess['_fresh'] = True
+        assert client.get(f'/download-batch/{batch_id}').status_code == 302
+        assert client.get('/download-batch/nosuchbatch').status_code == 302
+    finally:
+        for _, key in stored.values():
+            local.delete(key)
+    print("✓ Owner gets the PNGs as a ZIP")
+
+
+def main():
+    tests = [test_stream_zip_is_valid_and_bounded, test_download_batch_route]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"✗ {test.__name__} failed: {e}")
+    print(f"=== Test Results: {passed}/{len(tests)} tests passed ===")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
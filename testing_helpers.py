@@ -0,0 +1,63 @@
+"""
+Shared helpers for the test scripts: throwaway users and logged-in test clients
+Not a test script itself (no test_ prefix, so pytest doesn't collect it).
+Importing it before app points the database, generated files, staged uploads and other
+instance state at a temporary directory, so test runs leave the working tree alone;
+conftest.py imports it first for pytest runs.
+"""
+
+import os
+import uuid
+import atexit
+import shutil
+import tempfile
+
+
+def _isolate():
+    """Default every on-disk path the app writes to into one temporary directory (set env vars win)"""
+    root = tempfile.mkdtemp(prefix='pitchai-tests-')
+    atexit.register(shutil.rmtree, root, ignore_errors=True)
+    defaults = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(root, 'test.db')}",
+        'STORAGE_LOCAL_DIR': os.path.join(root, 'generated'),
+        'UPLOAD_STAGING_DIR': os.path.join(root, 'uploads'),
+        'RATE_LIMIT_FILE': os.path.join(root, 'rate_limits.json'),
+        'SINGLEFLIGHT_DIR': os.path.join(root, 'singleflight'),
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+_isolate()
+
+from app import app, db, User  # noqa: E402  (after the environment is set)
+
+DEFAULT_PROMPT_RESULT = {
+    'original_prompt': 'a sneaker',
+    'improved_prompt': 'a white sneaker on a sunlit desk',
+    'tool_type': 'image_video',
+    'model_key': 'imagen',
+}
+
+
+def make_user(prefix='test', is_paid=False):
+    """Create a user with a unique email and return its id"""
+    with app.app_context():
+        user = User()
+        user.email = f"{prefix}-{uuid.uuid4().hex[:8]}@example.com"
+        user.set_password('testpassword123')
+        user.is_paid = is_paid
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def logged_in_client(user_id, prompt_result=None):
+    """A test client logged in as user_id, with prompt_result (an image prompt by default) in its session"""
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'test-secret-key'
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+        sess['prompt_result'] = dict(prompt_result or DEFAULT_PROMPT_RESULT)
+    return client
@@ -0,0 +1,90 @@
+"""
+Size-capped, streaming handling for image uploads
+Multipart bodies are parsed into a spooled temp file (memory up to UPLOAD_SPOOL_BYTES, then disk),
+checked by magic bytes, and copied to their destination in chunks, never read whole into memory
+"""
+
+import os
+import tempfile
+
+from flask import Request
+
+from image_preprocess import sniff_mime
+
+# Largest product image accepted
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+# Room for the multipart framing and other form fields on top of the file
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Upload parts larger than this are spooled to disk while the form is parsed
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_BYTES', str(512 * 1024)))
+ALLOWED_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+COPY_CHUNK = 64 * 1024
+SNIFF_BYTES = 16
+
+
+class UploadRejected(Exception):
+    """An upload refused before it was stored; the message is safe to show to the user"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class SpooledUploadRequest(Request):
+    """Request whose uploaded files spool to disk past UPLOAD_SPOOL_BYTES instead of Werkzeug's fixed 500KB"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode='rb+')
+
+
+def max_content_length(max_upload_bytes=MAX_UPLOAD_BYTES):
+    """MAX_CONTENT_LENGTH for a form carrying one upload of up to max_upload_bytes"""
+    return max_upload_bytes + FORM_OVERHEAD_BYTES
+
+
+def check_content_length(content_length, max_upload_bytes=MAX_UPLOAD_BYTES):
+    """Reject from the Content-Length header alone, before any of the body is read"""
+    if content_length is not None and content_length > max_content_length(max_upload_bytes):
+        raise UploadRejected(too_large_message(max_upload_bytes), 413)
+
+
+def too_large_message(max_upload_bytes=MAX_UPLOAD_BYTES):
+    return f'Image too large. Please upload an image under {max_upload_bytes // (1024 * 1024)}MB.'
+
+
+def save_image_upload(file_storage, dest_path, max_upload_bytes=MAX_UPLOAD_BYTES,
+                      allowed_types=ALLOWED_IMAGE_TYPES):
+    """Stream an uploaded image to dest_path in chunks and return its MIME type.
+
+    The type comes from the file's first bytes, so nothing that isn't a
+    supported image is written anywhere. Raises UploadRejected (and leaves
+    no partial file behind) for a disallowed type or an oversized file.
+    """
+    stream = file_storage.stream
+    head = stream.read(SNIFF_BYTES)
+    mime = sniff_mime(head)
+    if mime not in allowed_types:
+        raise UploadRejected('Unsupported image type. Please upload a JPEG, PNG or WebP image.', 415)
+
+    written = len(head)
+    temp_path = f"{dest_path}.part"
+    try:
+        with open(temp_path, 'wb') as out:
+            out.write(head)
+            while True:
+                chunk = stream.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_upload_bytes:
+                    raise UploadRejected(too_large_message(max_upload_bytes), 413)
+                out.write(chunk)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return mime
@@ -0,0 +1,360 @@
+"""
+Shared HTTP client for upstream AI APIs (OpenAI, Google Generative Language)
+Keeps one pooled keep-alive session per host so repeated calls skip the TCP+TLS handshake
+"""
+
+import os
+import time
+import base64
+import hashlib
+import random
+import threading
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from circuit_breaker import get_breaker
+from rate_limiter import rate_limiter
+from singleflight import SingleFlight
+import fast_json
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Pool / retry configuration (override via environment)
+POOL_CONNECTIONS = int(os.getenv('UPSTREAM_POOL_CONNECTIONS', '4'))
+POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', '10'))
+CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+DEFAULT_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '30'))
+MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+BACKOFF_FACTOR = float(os.getenv('UPSTREAM_BACKOFF_FACTOR', '0.5'))
+MAX_BACKOFF = float(os.getenv('UPSTREAM_MAX_BACKOFF', '8'))
+# A Retry-After longer than this is not waited out; the 429 is returned to the caller
+MAX_RETRY_AFTER = float(os.getenv('UPSTREAM_MAX_RETRY_AFTER', '10'))
+PREWARM = os.getenv('UPSTREAM_PREWARM', '1') == '1'
+
+# API base URLs; MOCK_UPSTREAM_URL points both at a local mock_upstream.py instead
+MOCK_UPSTREAM_URL = os.getenv('MOCK_UPSTREAM_URL', '').rstrip('/')
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', MOCK_UPSTREAM_URL or 'https://api.openai.com').rstrip('/')
+GOOGLE_API_BASE = os.getenv('GOOGLE_API_BASE', MOCK_UPSTREAM_URL or 'https://generativelanguage.googleapis.com').rstrip('/')
+
+# Hosts we talk to; pre-warmed after each gunicorn worker forks
+UPSTREAM_HOSTS = list(dict.fromkeys([OPENAI_API_BASE, GOOGLE_API_BASE]))
+
+# Only retry on responses that mean the request was not processed
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Image generation (':predict' endpoints) is legitimately slow; only flag it as slow well past normal latency
+BREAKER_OPTIONS = {
+    ':predict': {'slow_seconds': float(os.getenv('CIRCUIT_IMAGEN_SLOW_SECONDS', '60'))},
+}
+
+# Identical concurrent POSTs share one upstream call (per process; SHARED also across workers)
+SINGLEFLIGHT = os.getenv('UPSTREAM_SINGLEFLIGHT', '1') == '1'
+SINGLEFLIGHT_SHARED = os.getenv('UPSTREAM_SINGLEFLIGHT_SHARED', '0') == '1'
+
+# Recent per-call timings kept for /metrics
+TIMING_WINDOW = int(os.getenv('UPSTREAM_TIMING_WINDOW', '500'))
+
+_sessions = {}
+_sessions_pid = None
+_lock = threading.Lock()
+_timings = {}
+_timings_lock = threading.Lock()
+_singleflight = SingleFlight()
+
+
+class FastJSONResponse(requests.Response):
+    """Response whose json() decodes with fast_json (orjson when installed)"""
+
+    def json(self, **kwargs):
+        if kwargs or not self.content:
+            return super().json(**kwargs)
+        return fast_json.loads(self.content)
+
+
+class FastJSONAdapter(HTTPAdapter):
+    def build_response(self, req, resp):
+        response = super().build_response(req, resp)
+        response.__class__ = FastJSONResponse
+        return response
+
+
+def _build_session():
+    """Create a requests session with a pooled adapter (retries are handled in post())"""
+    adapter = FastJSONAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url):
+    """Get the pooled session for the host of `url` (one per host, per process)"""
+    global _sessions_pid
+    key = _host_key(url)
+    with _lock:
+        # Sockets must never be shared across a fork (gunicorn preload_app)
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session()
+            _sessions[key] = session
+        return session
+
+
+def _normalize_timeout(timeout):
+    if timeout is None:
+        return (CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+    if isinstance(timeout, (tuple, list)):
+        return tuple(timeout)
+    return (min(CONNECT_TIMEOUT, timeout), timeout)
+
+
+def _attempt_timeout(timeout, deadline, url):
+    """Per-attempt (connect, read) timeout, shrunk to what is left of the deadline"""
+    if deadline is None:
+        return timeout
+    remaining = deadline.timeout(stage=endpoint_name(url))
+    return (min(timeout[0], remaining), min(timeout[1], remaining))
+
+
+def endpoint_name(url):
+    """Breaker name for an upstream endpoint: host plus path"""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def breaker_for(url):
+    path = urlsplit(url).path
+    options = next((opts for suffix, opts in BREAKER_OPTIONS.items() if path.endswith(suffix)), {})
+    return get_breaker(endpoint_name(url), **options)
+
+
+def is_available(url):
+    """False while the endpoint's circuit breaker is open"""
+    return breaker_for(url).state != 'open'
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, or the server's Retry-After when it sent one"""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF_FACTOR * (2 ** attempt)))
+
+
+def request_key(url, headers, payload):
+    """Identity of an upstream POST: endpoint, headers (credentials) and canonical JSON body"""
+    canonical = fast_json.dumps_bytes([url, sorted((headers or {}).items()), payload], sort_keys=True, default=str)
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def _encode_response(response):
+    """Serializable form of a completed response, for other workers; None if not worth sharing"""
+    if response.status_code >= 500 or response.status_code == 429:
+        return None
+    return {
+        'status_code': response.status_code,
+        'headers': dict(response.headers),
+        'url': response.url,
+        'encoding': response.encoding,
+        'content': base64.b64encode(response.content).decode('ascii'),
+    }
+
+
+def _decode_response(data):
+    response = FastJSONResponse()
+    response.status_code = data['status_code']
+    response.headers.update(data['headers'])
+    response.url = data['url']
+    response.encoding = data['encoding']
+    response._content = base64.b64decode(data['content'])
+    return response
+
+
+def post(url, headers=None, json=None, timeout=None, deadline=None, **kwargs):
+    """POST through the shared pool; same call shape as requests.post.
+
+    Identical concurrent calls (same endpoint, headers and JSON body) are
+    coalesced: one goes upstream and every caller gets its response.
+    Streamed calls are never coalesced, since their body can only be read once.
+    With a `deadline` (deadline.Deadline), every attempt's timeout and every
+    retry wait is capped at the time left.
+    """
+    if not SINGLEFLIGHT or json is None or kwargs.get('stream'):
+        return _post(url, headers=headers, json=json, timeout=timeout, deadline=deadline, **kwargs)
+
+    key = request_key(url, headers, json)
+    call = lambda: _post(url, headers=headers, json=json, timeout=timeout, deadline=deadline, **kwargs)
+    if SINGLEFLIGHT_SHARED:
+        response, _ = _singleflight.do_shared(key, call, _encode_response, _decode_response)
+    else:
+        response, _ = _singleflight.do(key, call)
+    return response
+
+
+def singleflight_stats():
+    return _singleflight.stats()
+
+
+def _post(url, headers=None, json=None, timeout=None, deadline=None, **kwargs):
+    """Send one POST with retries.
+
+    Connection errors and 429/502/503/504 responses are retried with jittered
+    backoff (honouring Retry-After). Read timeouts are never retried, since
+    the request may already have been processed. Raises CircuitOpenError
+    without touching the network while the endpoint's breaker is open.
+    Every attempt first waits for the model's shared RPM/TPM budget.
+    A retry that could not start before the deadline is not made, and
+    DeadlineExceeded is raised if the deadline has passed before an attempt.
+    """
+    session = get_session(url)
+    breaker = breaker_for(url)
+    timeout = _normalize_timeout(timeout)
+    # Encode the body once, with the fast encoder, rather than on every attempt
+    data = kwargs.pop('data', None)
+    if json is not None:
+        data = fast_json.dumps_bytes(json)
+        headers = dict(headers or {})
+        headers.setdefault('Content-Type', 'application/json')
+
+    attempt = 0
+    while True:
+        max_wait = None
+        if deadline is not None:
+            deadline.timeout(stage=endpoint_name(url))  # raises DeadlineExceeded once too little is left
+            max_wait = min(rate_limiter.max_wait, deadline.remaining())
+        breaker.before_call()
+        try:
+            rate_limiter.acquire_for_request(url, json, max_wait=max_wait)
+        except BaseException:
+            # No call was made: don't leave a half-open breaker waiting on a probe that never runs
+            breaker.release_probe()
+            raise
+        started = time.monotonic()
+        try:
+            response = session.post(url, headers=headers, data=data,
+                                    timeout=_attempt_timeout(timeout, deadline, url), **kwargs)
+        except requests.ConnectionError:
+            breaker.record(False, time.monotonic() - started)
+            delay = backoff_delay(attempt)
+            if attempt >= MAX_RETRIES or (deadline is not None and delay >= deadline.remaining()):
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except requests.RequestException:
+            breaker.record(False, time.monotonic() - started)
+            raise
+
+        elapsed = time.monotonic() - started
+        breaker.record(response.status_code < 500 and response.status_code != 429, elapsed)
+        if response.status_code not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+            return response
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None and retry_after > MAX_RETRY_AFTER:
+            return response
+        delay = backoff_delay(attempt, retry_after)
+        if deadline is not None and delay >= deadline.remaining():
+            return response
+        logger.info(f"Upstream {response.status_code} from {endpoint_name(url)}, retrying in {delay:.1f}s")
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def warm_connections(hosts=None, background=True):
+    """Open a keep-alive connection to each upstream host ahead of the first real call"""
+    hosts = hosts or UPSTREAM_HOSTS
+
+    def _warm():
+        for host in hosts:
+            try:
+                # Any response (even 401/404) leaves a live TLS connection in the pool
+                get_session(host).head(host, timeout=(CONNECT_TIMEOUT, CONNECT_TIMEOUT))
+                logger.info(f"Upstream connection pre-warmed: {host}")
+            except Exception as e:
+                logger.warning(f"Upstream pre-warm failed for {host}: {e}")
+
+    if background:
+        thread = threading.Thread(target=_warm, name='upstream-prewarm', daemon=True)
+        thread.start()
+        return thread
+    _warm()
+    return None
+
+
+def close_all():
+    """Close every pooled session in this process"""
+    with _lock:
+        for session in _sessions.values():
+            try:
+                session.close()
+            except Exception:
+                pass
+        _sessions.clear()
+
+
+def record_timing(name, elapsed, ok=True):
+    """Record how long one upstream call (or group of calls) took"""
+    with _timings_lock:
+        samples = _timings.get(name)
+        if samples is None:
+            samples = deque(maxlen=TIMING_WINDOW)
+            _timings[name] = samples
+        samples.append((elapsed, ok))
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def timing_stats():
+    """Summarize recorded timings (seconds) per call name"""
+    with _timings_lock:
+        snapshot = {name: list(samples) for name, samples in _timings.items()}
+    stats = {}
+    for name, samples in snapshot.items():
+        values = sorted(elapsed for elapsed, _ in samples)
+        stats[name] = {
+            'count': len(samples),
+            'errors': sum(1 for _, ok in samples if not ok),
+            'mean': round(sum(values) / len(values), 4) if values else None,
+            'p50': round(_percentile(values, 50), 4) if values else None,
+            'p95': round(_percentile(values, 95), 4) if values else None,
+            'last': round(samples[-1][0], 4) if samples else None,
+        }
+    return stats
@@ -0,0 +1,176 @@
+"""
+Long-lived, bounded thread pools for upstream generation work
+One pool per process replaces the executor each slideshow used to create, so Imagen concurrency
+is capped per process however many jobs run, and threads are reused instead of created per job.
+Waiting calls are served fairly between users (see fair_queue), weighted by tier.
+The queue in front of the workers is bounded too: work that doesn't fit is refused with PoolFull
+rather than left waiting behind calls that would outlive its deadline.
+"""
+
+import os
+import math
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+from fair_queue import FairQueue, TIER_FREE
+
+logger = logging.getLogger(__name__)
+
+IMAGEN_WORKERS = int(os.getenv('IMAGEN_WORKERS', '4'))
+# Imagen calls allowed to wait for a worker, on top of the ones running
+IMAGEN_QUEUE_SIZE = int(os.getenv('IMAGEN_QUEUE_SIZE', '12'))
+
+# Streamed prompt improvements hold two threads each for the whole stream
+PROMPT_STREAM_WORKERS = int(os.getenv('PROMPT_STREAM_WORKERS', '16'))
+PROMPT_STREAM_QUEUE_SIZE = int(os.getenv('PROMPT_STREAM_QUEUE_SIZE', '4'))
+
+WAIT_SAMPLES = 500
+
+
+class PoolFull(Exception):
+    """A bounded pool has no room for the work; retry_after is a hint in seconds"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} pool is full")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class BoundedPool:
+    """Worker threads holding at most max_workers running plus max_queued waiting calls.
+
+    Waiting calls are dispatched by weighted fair queuing across flows (users) rather than in
+    submission order, so one user's backlog can't hold up everyone else's.
+    """
+
+    def __init__(self, name, max_workers, max_queued):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._lock = threading.Condition()
+        self._workers = {'pid': None, 'threads': []}
+        self._queue = FairQueue()
+        self._pending = 0   # queued + running
+        self._active = 0
+        self._waits = {}    # tier -> recent queue waits
+        self._durations = deque(maxlen=WAIT_SAMPLES)
+        self._counters = {'submitted': 0, 'completed': 0, 'rejected': 0, 'cancelled': 0}
+
+    def _start_workers(self):
+        # Worker threads don't survive a fork; each process starts its own (caller holds the lock)
+        if self._workers['pid'] == os.getpid():
+            return
+        self._queue = FairQueue()
+        self._pending = self._active = 0
+        threads = [threading.Thread(target=self._work, name=f"{self.name}-pool-{i}", daemon=True)
+                   for i in range(self.max_workers)]
+        for thread in threads:
+            thread.start()
+        self._workers.update(pid=os.getpid(), threads=threads)
+
+    def capacity(self):
+        return self.max_workers + self.max_queued
+
+    def has_room(self, count=1):
+        with self._lock:
+            return self._pending + count <= self.capacity()
+
+    def retry_after(self):
+        """Seconds until a queued call can expect to start, from recent call durations"""
+        with self._lock:
+            typical = percentile(self._durations, 0.5) or 10.0
+            backlog = max(self._pending - self.max_workers + 1, 1)
+        return max(1, int(math.ceil(typical * backlog / self.max_workers)))
+
+    def submit_all(self, calls, flow=None, tier=TIER_FREE):
+        """Submit every (fn, args, kwargs) or none of them; raises PoolFull when they don't all fit.
+
+        flow identifies whose work it is (a user id) and tier sets its weight.
+        """
+        with self._lock:
+            self._start_workers()
+            if self._pending + len(calls) > self.capacity():
+                self._counters['rejected'] += len(calls)
+                rejected = True
+            else:
+                rejected = False
+                self._pending += len(calls)
+                self._counters['submitted'] += len(calls)
+                futures = []
+                for fn, args, kwargs in calls:
+                    future = Future()
+                    future.add_done_callback(self._release)
+                    self._queue.push((future, time.monotonic(), tier, fn, args, kwargs), flow=flow, tier=tier)
+                    futures.append(future)
+                self._lock.notify(len(calls))
+        if rejected:
+            raise PoolFull(self.name, self.retry_after())
+        return futures
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_all([(fn, args, kwargs)])[0]
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not len(self._queue):
+                    self._lock.wait()
+                future, submitted_at, tier, fn, args, kwargs = self._queue.pop()
+            # Cancelled while queued: its slot was already released
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            with self._lock:
+                self._active += 1
+                self._waits.setdefault(tier, deque(maxlen=WAIT_SAMPLES)).append(started - submitted_at)
+            try:
+                result, error = fn(*args, **kwargs), None
+            except BaseException as e:
+                result, error = None, e
+            with self._lock:
+                self._active -= 1
+                self._durations.append(time.monotonic() - started)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._counters['cancelled' if future.cancelled() else 'completed'] += 1
+
+    def stats(self):
+        with self._lock:
+            waits = {tier: list(samples) for tier, samples in self._waits.items()}
+            stats = dict(self._counters)
+            stats.update(active=self._active, queued=self._pending - self._active,
+                         max_workers=self.max_workers, max_queued=self.max_queued)
+        overall = [wait for samples in waits.values() for wait in samples]
+        stats.update(wait_stats(overall))
+        stats['tiers'] = {tier: wait_stats(samples) for tier, samples in waits.items()}
+        return stats
+
+
+def wait_stats(samples):
+    """p50/p95 of queue waits given in seconds, in milliseconds"""
+    return {
+        'wait_p50_ms': round(percentile(samples, 0.5) * 1000, 1) if samples else None,
+        'wait_p95_ms': round(percentile(samples, 0.95) * 1000, 1) if samples else None,
+    }
+
+
+# Global instances: Imagen calls for every slideshow in this process, and streamed
+# completions kept apart from the synchronous ones so open streams can't starve them
+imagen_pool = BoundedPool('imagen', IMAGEN_WORKERS, IMAGEN_QUEUE_SIZE)
+prompt_stream_pool = BoundedPool('prompt-stream', PROMPT_STREAM_WORKERS, PROMPT_STREAM_QUEUE_SIZE)
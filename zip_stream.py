@@ -0,0 +1,64 @@
+"""
+ZIP archives streamed as they are built
+The archive is written into a sink that hands each piece straight to the response generator,
+so neither the whole archive nor a whole member file is ever held in memory or written to disk.
+Entries are STORED: PNG and WebP are already compressed, and deflating them would only cost CPU.
+"""
+
+import zipfile
+from contextlib import closing
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Write-only, unseekable file: zipfile writes into it and the generator drains it.
+
+    Without seek(), zipfile writes a data descriptor after each entry
+    instead of going back to patch the sizes and CRC into its header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of entries piece by piece.
+
+    entries is an iterable of (name, open_source, size, modified): open_source()
+    returns a readable file, size is its length in bytes (to choose ZIP64 up
+    front) and modified a datetime. Memory use is about one chunk, whatever
+    the number or size of the entries.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, open_source, size, modified in entries:
+            info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = size
+            with closing(open_source()) as source, \
+                    archive.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as member:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    member.write(chunk)
+                    yield sink.drain()
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data